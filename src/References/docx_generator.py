@@ -1,4 +1,3 @@
-from tkinter import messagebox
 from docx import Document
 import re
 from docx.shared import Pt, Inches, Cm
@@ -9,18 +8,35 @@ from docx.oxml import OxmlElement
 import os
 import sys
 from docx.enum.table import WD_TABLE_ALIGNMENT
-from PIL import Image as PILImage
-import win32com.client
+from PIL import Image as PILImage, ImageOps, ImageChops, ImageStat
+import math
 import io
 import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import time
+import json
 from copy import deepcopy
+import generation_metrics
+from lxml import etree
 from docx.text.paragraph import Paragraph
+from docx.document import _Body
+from docx.table import _Cell
+from docx.blkcntnr import BlockItemContainer
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.part import XmlPart
+from docx.opc.oxml import serialize_part_xml
+from docx.oxml import parse_xml
 
-# Importo la funzione resource_path
-try:
-    from form_interface import resource_path
-except ImportError:
+STORY_RELATIONSHIP_TYPES = (RT.HEADER, RT.FOOTER, RT.FOOTNOTES, RT.ENDNOTES)
+
+# Importo la funzione resource_path dall'interfaccia solo se è già caricata:
+# reimportarla da qui (es. dal thread di importazione in background) eseguirebbe di nuovo
+# tutto il codice di avvio della GUI
+_form_module = sys.modules.get("form_interface") or sys.modules.get("__main__")
+if hasattr(_form_module, "resource_path"):
+    resource_path = _form_module.resource_path
+else:
     # Funzione di fallback se non possiamo importare da form_interface
     def resource_path(relative_path):
         """Ottiene il percorso assoluto per le risorse, funziona sia in modalità sviluppo che come file eseguibile"""
@@ -32,7 +48,8 @@ except ImportError:
         
         return os.path.join(base_path, relative_path)
 
-def generate_document(template_path=None, output_path=None, data=None, images=None):
+def generate_document(template_path=None, output_path=None, data=None, images=None, max_output_size=None, report=None,
+                      incremental=True, renditions=None, template_document=None):
     """
     Genera un documento Word basato su un modello, sostituendo i segnaposto con i dati forniti
     e inserendo le immagini indicate dove si trova il segnaposto {{foto}} o {{Foto}}.
@@ -42,6 +59,18 @@ def generate_document(template_path=None, output_path=None, data=None, images=No
         output_path (str, optional): Percorso dove salvare il documento generato. Se None, salva nella directory dello script.
         data (dict, optional): Dizionario con i dati da inserire nel documento
         images (list, optional): Lista di dizionari con path, description e orientation delle immagini
+        max_output_size (int, optional): Dimensione massima del documento in byte; le figure vengono
+            ridotte con un fattore comune di scala e qualità fino a rientrarvi
+        report (dict, optional): Se indicato riceve le impostazioni scelte per le figure e la dimensione finale
+        incremental (bool, optional): Se il file di output è stato generato in precedenza con lo stesso
+            modello e le stesse immagini, aggiorna solo i campi e le didascalie cambiati
+        renditions (list | callable, optional): Figure già codificate con prepare_renditions, nell'ordine
+            di images (ad esempio condivise con altri formati di esportazione), oppure una funzione che
+            le restituisce dato il documento; viene chiamata solo se serve una generazione completa
+            e se restituisce None le figure si codificano qui
+        template_document (Document | callable, optional): Modello già letto da template_path, usato al
+            posto del file (viene modificato: passare una copia), oppure una funzione che lo restituisce
+            solo quando serve
     """
     # Debug: verifica i dati ricevuti all'inizio della funzione
     print("\nDEBUG - docx_generator.generate_document - Dati ricevuti:")
@@ -66,20 +95,53 @@ def generate_document(template_path=None, output_path=None, data=None, images=No
     if data is None:
         data = {}
     
+    # Tempi delle fasi e dati della generazione per lo storico delle metriche
+    metrics = generation_metrics.GenerationRun(template_path, "docx")
+    paragraph_count = 0
+    megapixels = 0.0
+    
+    # Aggiornamento incrementale del documento prodotto dalla generazione precedente
+    if incremental and os.path.exists(output_path):
+        if patch_document(template_path, output_path, data, images, max_output_size, report):
+            metrics.mark("patch")
+            metrics.finish(output_path, mode="incremental", images=len(images or []))
+            return output_path
+        metrics.mark("patch")
+    manifest = GenerationManifest(data) if incremental else None
+    phase1_done = False
+    
     try:
         # Fase 1: genera il documento con python-docx per sostituire i segnaposti normali e aggiungere le immagini
-        doc = Document(template_path)
+        doc = template_document() if callable(template_document) else template_document
+        if doc is None:
+            doc = Document(template_path)
+        metrics.mark("load")
         
         # Definizione pattern per i segnaposto
         placeholder_pattern = re.compile(r'\{\{([^}]+)\}\}')
         
+        # Codifica delle figure in parallelo (entro il budget del documento, se indicato)
+        if callable(renditions):
+            renditions = renditions(doc)
+        if images and renditions is None:
+            image_budget = document_image_budget(template_path, images, max_output_size)
+            renditions = prepare_renditions(images, *compute_image_box(doc), image_budget=image_budget, report=report)
+            metrics.mark("images")
+        if renditions:
+            megapixels = sum(rendition.get("source_pixels") or 0 for rendition in renditions
+                             if not isinstance(rendition, Exception)) / 1e6
+        
         # Flag per tracciare se abbiamo già inserito le immagini
         images_inserted = False
         
+        # Valori dei campi risolti una sola volta per tutti i paragrafi
+        lookup = FieldLookup(data)
+        
         # Funzione per sostituire i segnaposti in un paragrafo
-        def process_paragraph(paragraph):
+        def process_paragraph(paragraph, part):
             nonlocal images_inserted
-            if any(placeholder in paragraph.text for placeholder in ["{{foto}}", "{{Foto}}"]) and images and len(images) > 0:
+            # Le foto vanno solo nel corpo: le immagini sono relazioni della parte principale
+            if part is doc.part and any(placeholder in paragraph.text for placeholder in ["{{foto}}", "{{Foto}}"]) and images and len(images) > 0:
                 parent = paragraph._p.getparent()
                 index = list(parent).index(paragraph._p)
                 parent.remove(paragraph._p)
@@ -91,48 +153,41 @@ def generate_document(template_path=None, output_path=None, data=None, images=No
                 tbl = table._tbl
                 parent.insert(index, tbl)
                 
-                populate_images_table(doc, table, images)
+                populate_images_table(doc, table, images, renditions, manifest)
                 
                 images_inserted = True
                 return True
             else:
-                replace_text_in_paragraph(paragraph, data)
+                if manifest is not None:
+                    manifest.replace_paragraph(paragraph)
+                else:
+                    replace_paragraph_fields(paragraph, data, lookup)
                 return False
         
-        # Sostituzione dei segnaposto nelle tabelle
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        process_paragraph(paragraph)
-        
-        # Sostituzione dei segnaposto nel corpo del documento
-        paragraphs = list(doc.paragraphs)
-        for paragraph in paragraphs:
-            process_paragraph(paragraph)
-        
-        # Sostituzione dei segnaposto negli header e footer
-        for section in doc.sections:
-            for header in section.header.paragraphs:
-                process_paragraph(header)
-            
-            for footer in section.footer.paragraphs:
-                process_paragraph(footer)
+        # Sostituzione dei segnaposto in tutte le parti con testo: corpo (tabelle annidate e
+        # caselle di testo comprese), intestazioni e piè di pagina di ogni tipo, note
+        for part, paragraph in iter_story_paragraphs(doc):
+            process_paragraph(paragraph, part)
+            paragraph_count += 1
         
         # Se non abbiamo ancora inserito le immagini e ci sono immagini da inserire
         if not images_inserted and images and len(images) > 0:
             doc.add_heading('Documentazione Fotografica', level=1)
-            insert_images_table_at_end(doc, images)
+            insert_images_table_at_end(doc, images, renditions, manifest)
         
         # Salva il documento temporaneo
         temp_path = output_path + "_temp.docx"
+        metrics.mark("fill")
         doc.save(temp_path)
+        phase1_done = True
+        metrics.mark("save")
         
         # Fase 2: usa win32com per gestire i checkbox
         # Importante: Crea una nuova istanza di Word anziché usare quella eventualmente già aperta
         try:
-            # Inizializza COM
+            # Inizializza COM (pywin32 è importato solo qui perché disponibile solo su Windows)
             import pythoncom
+            import win32com.client
             pythoncom.CoInitialize()
             
             # Crea una nuova istanza di Word (evita di riutilizzare istanze già aperte)
@@ -235,8 +290,233 @@ def generate_document(template_path=None, output_path=None, data=None, images=No
                 os.remove(output_path)
             os.rename(temp_path, output_path)
     
+    if phase1_done:
+        metrics.mark("word")
+    
+    # Il manifest descrive il file appena scritto (dopo l'eventuale salvataggio di Word)
+    if manifest is not None and phase1_done and os.path.exists(output_path):
+        manifest.save(template_path, output_path, images, max_output_size)
+    if phase1_done:
+        metrics.finish(output_path, paragraphs=paragraph_count, images=len(images or []), megapixels=megapixels)
+    
+    # Dimensione effettiva (Word può ricomprimere leggermente il pacchetto nella fase 2)
+    if report is not None and os.path.exists(output_path):
+        report["output_size"] = os.path.getsize(output_path)
+        if max_output_size:
+            report["within_limit"] = report["output_size"] <= max_output_size
+    
     return output_path
 
+# Campi resi come checkbox di Word nella fase 2: il segnaposto resta nel documento
+CHECKBOX_FIELDS = ("Visivo", "Rilievo/Verifica misure", "Test/Collaudo", "Altro",
+                   "Conforme/Positivo", "Non conforme", "Osservazione",
+                   "D.L. Generale", "D.L. Strutture", "D.L. Facciate",
+                   "D.L. Imp. Elettrici/Speciali", "D.L. Imp. Meccanici")
+RICH_TEXT_FIELD = "Oggetto del Sopralluogo"
+# Valori su più righe: False = un paragrafo per riga, True = interruzioni di riga nello stesso paragrafo
+MULTILINE_LINE_BREAKS = False
+RICH_TEXT_TAGS = ("<b>", "<i>", "<u>")
+PLACEHOLDER_PATTERN = re.compile(r'\{\{([^}]+)\}\}')
+TEXT_IN_RUN_PATH = f"{qn('w:r')}/{qn('w:t')}"
+
+def normalize_field_name(text):
+    """Normalizza un nome di campo (spazi multipli, caratteri speciali, maiuscole)"""
+    # Rimuove spazi multipli e converte in minuscolo
+    normalized = ' '.join(text.lower().split())
+    # Rimuove caratteri speciali mantenendo lettere, numeri e spazi
+    return ''.join(c for c in normalized if c.isalnum() or c.isspace())
+
+class FieldLookup:
+    """Valori dei segnaposto con le stesse strategie di ricerca di replace_text_in_paragraph, calcolati una volta"""
+
+    def __init__(self, data):
+        self.data = data
+        self.normalized_data = {normalize_field_name(key): value for key, value in data.items()}
+        self._values = {}
+
+    def value(self, placeholder):
+        if placeholder not in self._values:
+            normalized = normalize_field_name(placeholder)
+            value = None
+            for key in (placeholder, placeholder.replace(" ", ""), normalized):
+                if self.data.get(key) is not None:
+                    value = self.data[key]
+                    break
+            if value is None:
+                value = self.normalized_data.get(normalized)
+            self._values[placeholder] = "" if value is None else value
+        return self._values[placeholder]
+
+    def simple_text(self, placeholder):
+        """Testo da scrivere direttamente nel w:t, o None se il valore richiede il percorso completo"""
+        value = self.value(placeholder)
+        if isinstance(value, bool):
+            return None
+        text = str(value)
+        if "\n" in text or "\r" in text or "\t" in text:
+            return None
+        if placeholder == RICH_TEXT_FIELD and any(tag in text for tag in RICH_TEXT_TAGS):
+            return None
+        return text
+
+def fast_replace_paragraph(p, lookup):
+    """
+    Percorso rapido: una sola passata sui w:t dei run del paragrafo, con sostituzione in place
+    dei segnaposto contenuti per intero in un elemento di testo e con un valore semplice.
+
+    Returns:
+        bool: False se il paragrafo richiede replace_text_in_paragraph (segnaposto divisi tra
+            più run, valori su più righe o formattati, checkbox); in quel caso non viene modificato
+    """
+    full_text = p.text
+    if "{{" not in full_text:
+        return True
+    expected = len(PLACEHOLDER_PATTERN.findall(full_text))
+    found = 0
+    updates = []
+    for t in p.iterfind(TEXT_IN_RUN_PATH):
+        text = t.text
+        if not text or "{{" not in text:
+            continue
+        pieces = []
+        last = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            found += 1
+            placeholder = match.group(1)
+            if placeholder in CHECKBOX_FIELDS:
+                # Resta per la fase 2, come in replace_text_in_paragraph
+                continue
+            if placeholder.startswith("checkbox_"):
+                return False
+            replacement = lookup.simple_text(placeholder)
+            if replacement is None:
+                return False
+            pieces.append(text[last:match.start()])
+            pieces.append(replacement)
+            last = match.end()
+        if pieces:
+            pieces.append(text[last:])
+            updates.append((t, "".join(pieces)))
+    # Segnaposto spezzati tra più w:t o dentro collegamenti ipertestuali
+    if found != expected:
+        return False
+    
+    for t, text in updates:
+        if not text:
+            # Come run.text = "": nessun elemento di testo vuoto
+            t.getparent().remove(t)
+        else:
+            t.text = text
+            if text != text.strip():
+                t.set(qn('xml:space'), 'preserve')
+    return True
+
+def replace_paragraph_fields(paragraph, data, lookup=None):
+    """Sostituisce i segnaposto del paragrafo, con replace_text_in_paragraph solo se necessario"""
+    if fast_replace_paragraph(paragraph._p, lookup or FieldLookup(data)):
+        return paragraph
+    return replace_text_in_paragraph(paragraph, data)
+
+def iter_story_parts(doc):
+    """
+    Parti del documento che contengono testo, ciascuna una sola volta: il corpo e poi
+    intestazioni, piè di pagina (predefiniti, prima pagina, pagine pari) e note.
+    Le intestazioni collegate tra sezioni sono la stessa parte e vengono visitate una volta.
+
+    python-docx carica le note come parti binarie: il loro XML si legge dal blob della
+    parte e vi viene riscritto quando il chiamante passa alla parte successiva.
+    """
+    yield doc.part, doc.element.body
+    seen = {id(doc.part)}
+    for rel in doc.part.rels.values():
+        if rel.is_external or rel.reltype not in STORY_RELATIONSHIP_TYPES:
+            continue
+        part = rel.target_part
+        if id(part) in seen:
+            continue
+        seen.add(id(part))
+        if isinstance(part, XmlPart):
+            yield part, part.element
+            continue
+        element = parse_xml(part.blob)
+        try:
+            yield part, element
+        finally:
+            part._blob = serialize_part_xml(element)
+
+def story_container(element, part):
+    """Oggetto python-docx per il contenitore dei paragrafi (corpo, cella o altro blocco)"""
+    if element.tag == qn('w:body'):
+        return _Body(element, part)
+    if element.tag == qn('w:tc'):
+        return _Cell(element, part)
+    return BlockItemContainer(element, part)
+
+def iter_story_paragraphs(doc):
+    """Coppie (parte, paragrafo) di tutto il documento in ordine, compresi tabelle annidate e caselle di testo"""
+    for part, root in iter_story_parts(doc):
+        # Elenco preso prima delle sostituzioni: i paragrafi aggiunti dai valori non vanno rielaborati
+        for p in list(root.iter(qn('w:p'))):
+            if p.getparent() is not None:
+                yield part, Paragraph(p, story_container(p.getparent(), part))
+
+def insert_value_lines(p, r, lines, line_breaks=None):
+    """
+    Inserisce le righe successive alla prima di un valore su più righe (le righe vuote
+    vengono saltate).
+
+    Ogni riga diventa un paragrafo dopo p, copiato da un unico prototipo con le proprietà
+    del paragrafo p e del run r; i paragrafi vengono inseriti tutti insieme. Con line_breaks
+    le righe restano invece nel run r, separate da interruzioni di riga (w:br).
+
+    Args:
+        p: Elemento w:p del paragrafo con la prima riga
+        r: Elemento w:r del run con la prima riga (fornisce la formattazione)
+        lines: Righe successive alla prima
+        line_breaks (bool, optional): Usa w:br invece di nuovi paragrafi (predefinito MULTILINE_LINE_BREAKS)
+    """
+    lines = [line for line in lines if line.strip()]
+    if not lines:
+        return
+    if line_breaks is None:
+        line_breaks = MULTILINE_LINE_BREAKS
+    
+    if line_breaks:
+        for line in lines:
+            r.append(OxmlElement('w:br'))
+            t = OxmlElement('w:t')
+            t.set(qn('xml:space'), 'preserve')
+            t.text = line
+            r.append(t)
+        return
+    
+    # Prototipo: solo proprietà di paragrafo e di run (senza interruzione di sezione)
+    prototype = OxmlElement('w:p')
+    pPr = p.find(qn('w:pPr'))
+    if pPr is not None:
+        pPr = deepcopy(pPr)
+        sectPr = pPr.find(qn('w:sectPr'))
+        if sectPr is not None:
+            pPr.remove(sectPr)
+        prototype.append(pPr)
+    prototype_run = OxmlElement('w:r')
+    rPr = r.find(qn('w:rPr'))
+    if rPr is not None:
+        prototype_run.append(deepcopy(rPr))
+    prototype_text = OxmlElement('w:t')
+    prototype_text.set(qn('xml:space'), 'preserve')
+    prototype_run.append(prototype_text)
+    prototype.append(prototype_run)
+    
+    new_paragraphs = []
+    for line in lines:
+        new_p = deepcopy(prototype)
+        new_p[-1][-1].text = line
+        new_paragraphs.append(new_p)
+    parent = p.getparent()
+    index = parent.index(p)
+    parent[index + 1:index + 1] = new_paragraphs
+
 def replace_text_in_paragraph(paragraph, data):
     """Sostituisce i segnaposto nel testo del paragrafo"""
     # DEBUG - Verifica input
@@ -251,13 +531,7 @@ def replace_text_in_paragraph(paragraph, data):
     if not matches:
         return paragraph
     
-    # Funzione per normalizzare il testo (rimuove spazi, caratteri speciali e converte in minuscolo)
-    def normalize_text(text):
-        # Rimuove spazi multipli e converte in minuscolo
-        normalized = ' '.join(text.lower().split())
-        # Rimuove caratteri speciali mantenendo lettere, numeri e spazi
-        normalized = ''.join(c for c in normalized if c.isalnum() or c.isspace())
-        return normalized
+    normalize_text = normalize_field_name
     
     # Prima gestisci i checkbox
     for match in matches:
@@ -280,10 +554,7 @@ def replace_text_in_paragraph(paragraph, data):
         placeholder_text = f"{{{{{placeholder}}}}}"
         
         # Salta i segnaposto che sono checkbox o che sono usati per i checkbox
-        if placeholder.startswith("checkbox_") or placeholder in ["Visivo", "Rilievo/Verifica misure", "Test/Collaudo", "Altro", 
-                                                                  "Conforme/Positivo", "Non conforme", "Osservazione", 
-                                                                  "D.L. Generale", "D.L. Strutture", "D.L. Facciate", 
-                                                                  "D.L. Imp. Elettrici/Speciali", "D.L. Imp. Meccanici"]:
+        if placeholder.startswith("checkbox_") or placeholder in CHECKBOX_FIELDS:
             continue
         
         # Normalizza il placeholder
@@ -500,45 +771,9 @@ def replace_text_in_paragraph(paragraph, data):
                             # Sostituisci il segnaposto con la prima riga
                             run.text = run.text.replace(placeholder_text, lines[0])
                             
-                            # Ottieni il paragrafo attuale e il suo contenitore
-                            current_p = paragraph._p
-                            parent = current_p.getparent()
-                            
                             try:
-                                # Per ciascuna riga aggiuntiva, crea un vero nuovo paragrafo
-                                for i in range(1, len(lines)):
-                                    if not lines[i].strip():  # Salta righe vuote
-                                        continue
-                                    
-                                    print(f"Creazione nuovo paragrafo per riga {i}: '{lines[i]}'")
-                                    
-                                    # Crea un nuovo paragrafo copiando il paragrafo originale
-                                    # Questo mantiene tutta la formattazione e stile
-                                    new_p = deepcopy(paragraph._p)
-                                    
-                                    # Rimuovi tutti i run esistenti dal paragrafo copiato
-                                    for old_run in new_p.findall('.//w:r', {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}):
-                                        old_run.getparent().remove(old_run)
-                                    
-                                    # Crea un nuovo run con le stesse proprietà del run originale
-                                    new_r = deepcopy(run._r)
-                                    # Rimuovi gli elementi di testo esistenti
-                                    for old_t in new_r.findall('.//w:t', {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}):
-                                        old_t.getparent().remove(old_t)
-                                    
-                                    # Aggiungi nuovo testo con la stessa formattazione
-                                    new_t = OxmlElement('w:t')
-                                    new_t.set(qn('xml:space'), 'preserve')  # Preserva spazi
-                                    new_t.text = lines[i]
-                                    new_r.append(new_t)
-                                    
-                                    # Aggiungi il run al paragrafo
-                                    new_p.append(new_r)
-                                    
-                                    # Aggiungi il nuovo paragrafo dopo il paragrafo corrente
-                                    current_p.addnext(new_p)
-                                    # Aggiorna il paragrafo corrente per il prossimo ciclo
-                                    current_p = new_p
+                                # Le righe successive diventano paragrafi con la formattazione di questo
+                                insert_value_lines(paragraph._p, run._r, lines[1:])
                             
                             except Exception as e:
                                 print(f"Errore durante la creazione dei paragrafi: {str(e)}")
@@ -598,31 +833,9 @@ def replace_text_in_paragraph(paragraph, data):
                         for i in range(start_idx + 1, end_idx + 1):
                             paragraph.runs[i].text = ""
                         
-                        # Ottieni un riferimento al documento
-                        doc = paragraph._parent
-                        
-                        # Aggiungi un nuovo paragrafo per ogni riga aggiuntiva
-                        for i in range(1, len(lines)):
-                            # Salta righe vuote
-                            if not lines[i].strip():
-                                continue
-                                
-                            print(f"Inserimento paragrafo per la riga {i}: '{lines[i]}'")
-                            
-                            # Crea un nuovo paragrafo
-                            new_para = doc.add_paragraph(lines[i])
-                            
-                            # Ottieni l'elemento XML del nuovo paragrafo
-                            new_p = new_para._p
-                            
-                            # Rimuovi il paragrafo dalla fine del documento
-                            doc._body._body.remove(new_p)
-                            
-                            # Inseriscilo dopo il paragrafo corrente
-                            paragraph._element.addnext(new_p)
-                            
-                            # Aggiorna il paragrafo corrente per il prossimo ciclo
-                            paragraph = new_para
+                        # Le righe successive vengono inserite subito dopo questo paragrafo
+                        # (funziona anche in celle, intestazioni e caselle di testo)
+                        insert_value_lines(paragraph._p, start_run._r, lines[1:])
                     else:
                         # Senza newline, sostituisci normalmente
                         start_run.text = pre_text + replacement_text
@@ -704,20 +917,22 @@ def insert_images_table_at_paragraph(doc, paragraph_index, images):
     # Configura la tabella e inserisci le immagini
     populate_images_table(doc, table, images)
 
-def insert_images_table_at_end(doc, images):
+def insert_images_table_at_end(doc, images, renditions=None, manifest=None):
     """
     Inserisce una tabella con immagini alla fine del documento.
     
     Args:
         doc: Documento Word
         images: Lista di immagini da inserire
+        renditions: Figure già codificate (opzionale)
+        manifest: GenerationManifest che registra le didascalie (opzionale)
     """
     table = doc.add_table(rows=1, cols=1)
     table.alignment = WD_TABLE_ALIGNMENT.CENTER
     set_table_border(table, False)
     
     # Configura la tabella e inserisci le immagini
-    populate_images_table(doc, table, images)
+    populate_images_table(doc, table, images, renditions, manifest)
 
 def insert_images_table(cell, images):
     """
@@ -755,36 +970,596 @@ def get_image_size(img_path, rotation=0):
     except Exception:
         return 0, 0
 
-def populate_images_table(doc, table, images):
+# Orientamenti EXIF (tag 274) che scambiano larghezza e altezza
+EXIF_SWAPPED_ORIENTATIONS = (5, 6, 7, 8)
+
+# Formati che Word incorpora direttamente senza conversione
+PASSTHROUGH_FORMATS = ("JPEG", "PNG")
+
+def compute_image_box(doc):
     """
-    Popola una tabella con immagini e didascalie.
+    Calcola lo spazio disponibile per una figura.
+
+    Args:
+        doc: Documento Word (None se la tabella è in una cella)
+
+    Returns:
+        Tuple: (larghezza massima, altezza massima) in EMU
     """
-    # Calcola le dimensioni per le immagini
     if doc:
         section = doc.sections[0]
         # Calcola la larghezza disponibile (pagina intera meno margini)
-        page_width_cm = section.page_width.cm
-        margin_left_cm = section.left_margin.cm
-        margin_right_cm = section.right_margin.cm
-        available_width_cm = page_width_cm - margin_left_cm - margin_right_cm
+        available_width_cm = section.page_width.cm - section.left_margin.cm - section.right_margin.cm
+        
+        # Altezza massima (metà pagina meno spazio per didascalia)
+        page_height_cm = section.page_height.cm - section.top_margin.cm - section.bottom_margin.cm
+        available_height_cm = ((page_height_cm - 2) / 2) * 0.8  # -2 per le didascalie
         
         # Converti in EMU (1 cm = 360000 EMU)
-        available_width_emu = int(available_width_cm * 360000)
+        return int(available_width_cm * 360000), int(available_height_cm * 360000)
+    
+    # Se siamo in una cella, usiamo dimensioni di default
+    return int(Cm(15).emu), int(Cm(10).emu)  # pagina A4
+
+def fit_image_to_box(width, height, box_width_emu, box_height_emu):
+    """
+    Calcola dimensioni nel documento e dimensioni in pixel di una figura.
+
+    Args:
+        width, height: Dimensioni dell'immagine (dopo tutte le rotazioni)
+        box_width_emu, box_height_emu: Spazio disponibile in EMU
+
+    Returns:
+        Tuple: (larghezza EMU, altezza EMU, larghezza px, altezza px)
+    """
+    aspect_ratio = width / height
+    
+    # Usa sempre l'altezza come riferimento
+    target_height_emu = box_height_emu
+    target_width_emu = int(target_height_emu * aspect_ratio)
+    
+    # Se la larghezza calcolata supera quella disponibile, ricalcola partendo dalla larghezza
+    if target_width_emu > box_width_emu:
+        target_width_emu = box_width_emu
+        target_height_emu = int(target_width_emu / aspect_ratio)
+    
+    # Dimensioni in pixel per il ridimensionamento (96 DPI), almeno 1 pixel
+    width_px = max(1, int((target_width_emu / 360000) * 96))
+    height_px = max(1, int((target_height_emu / 360000) * 96))
+    return target_width_emu, target_height_emu, width_px, height_px
+
+# Classificazione del contenuto. Nei disegni e nelle schermate quasi tutti i pixel sono
+# uguali al vicino (tinta unita) e il resto sono bordi netti; nelle foto il rumore e le
+# sfumature producono molte differenze intermedie
+LINE_ART_MAX_COLORS = 64
+LINE_ART_FLAT_FRACTION = 0.7
+LINE_ART_MAX_GRADIENT_FRACTION = 0.15
+FLAT_DIFFERENCE = 2
+EDGE_DIFFERENCE = 32
+CLASSIFY_SAMPLE_SIZE = 160
+PALETTE_COLORS = 256
+
+# Disegni: palette più piccola (tra quelle elencate) che rispetta il PSNR obiettivo
+PALETTE_STEPS = (16, 32, 64, 128, 256)
+LINE_ART_TARGET_PSNR = 38.0
+
+# Disegni e schermate da file senza perdita vengono incorporati a risoluzione doppia
+# (96 DPI sono pochi per il testo) se il PNG non pesa più di quello a 96 DPI;
+# i disegni da JPEG restano a 96 DPI
+LINE_ART_SCALE = 2
+
+# Dimensione massima del documento: il fattore comune riduce la scala fino a BUDGET_MIN_SCALE
+# e la qualità JPEG fino a BUDGET_MIN_QUALITY; la ricerca fa al massimo 1 + 6 (+1) tentativi
+BUDGET_MIN_SCALE = 0.4
+BUDGET_MIN_QUALITY = 20
+# Scala e qualità procedono a passi: i tentativi vicini della bisezione danno gli stessi
+# parametri e riusano le codifiche già fatte invece di ricodificare per differenze invisibili
+BUDGET_SCALE_STEP = 0.05
+BUDGET_QUALITY_STEP = 5
+BUDGET_MAX_ITERATIONS = 6
+BUDGET_SOURCE_CACHE_BYTES = 256 * 1024 * 1024
+# Byte stimati per figura oltre ai dati dell'immagine (XML del disegno, didascalia, relazioni)
+BUDGET_IMAGE_OVERHEAD = 4096
+
+# Foto: qualità JPEG minima che rispetta l'errore percettivo obiettivo (PSNR in dB),
+# al massimo la qualità 75 usata finora
+PHOTO_TARGET_PSNR = 38.0
+PHOTO_QUALITY_RANGE = (35, 75)
+PHOTO_QUALITY_STEP = 4
+
+def classify_image(img):
+    """
+    Distingue foto e disegni/schermate (colori piatti) con statistiche su un campione ridotto.
+
+    Returns:
+        str: "lineart" oppure "photo"
+    """
+    sample = img.convert("RGB")
+    sample.thumbnail((CLASSIFY_SAMPLE_SIZE, CLASSIFY_SAMPLE_SIZE), PILImage.NEAREST)
+    
+    # Pochi colori distinti: disegno, schema o schermata
+    if sample.getcolors(LINE_ART_MAX_COLORS) is not None:
+        return "lineart"
+    
+    # Istogramma delle differenze con il pixel a destra (tollerante agli artefatti JPEG)
+    shifted = ImageChops.offset(sample, 1, 0)
+    histogram = ImageChops.difference(sample, shifted).convert("L").histogram()
+    total = max(1, sum(histogram))
+    flat_fraction = sum(histogram[:FLAT_DIFFERENCE + 1]) / total
+    gradient_fraction = sum(histogram[FLAT_DIFFERENCE + 1:EDGE_DIFFERENCE]) / total
+    if flat_fraction >= LINE_ART_FLAT_FRACTION and gradient_fraction <= LINE_ART_MAX_GRADIENT_FRACTION:
+        return "lineart"
+    return "photo"
+
+def compute_psnr(original, encoded):
+    """PSNR in dB tra due immagini RGB delle stesse dimensioni"""
+    stat = ImageStat.Stat(ImageChops.difference(original, encoded))
+    mse = sum(rms ** 2 for rms in stat.rms) / len(stat.rms)
+    if mse == 0:
+        return float("inf")
+    return 10 * math.log10(255 ** 2 / mse)
+
+def encode_jpeg(img, quality):
+    """Codifica un'immagine RGB come JPEG in memoria"""
+    output = io.BytesIO()
+    img.save(output, format="JPEG", quality=quality, dpi=(150, 150), optimize=True)
+    return output.getvalue()
+
+def encode_photo(img, target_psnr=PHOTO_TARGET_PSNR):
+    """
+    Codifica una foto in JPEG con la qualità più bassa che rispetta il PSNR obiettivo.
+
+    La qualità si cerca per bisezione in PHOTO_QUALITY_RANGE (al massimo 4 tentativi);
+    superfici uniformi come il calcestruzzo scendono molto, i dettagli fini restano alti.
+
+    Returns:
+        Tuple: (byte JPEG, qualità scelta)
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    low, high = PHOTO_QUALITY_RANGE
+    best = None
+    while high - low > PHOTO_QUALITY_STEP:
+        quality = (low + high) // 2
+        data = encode_jpeg(img, quality)
+        with PILImage.open(io.BytesIO(data)) as decoded:
+            psnr = compute_psnr(img, decoded.convert("RGB"))
+        if psnr >= target_psnr:
+            high, best = quality, (data, quality)
+        else:
+            low = quality
+    if best is None:
+        best = (encode_jpeg(img, high), high)
+    return best
+
+def encode_png(img):
+    """Codifica un'immagine come PNG in memoria (compressione massima)"""
+    output = io.BytesIO()
+    img.save(output, format="PNG", optimize=True)
+    return output.getvalue()
+
+def encode_palette(img, colors):
+    """Codifica un'immagine come PNG a palette (senza retinatura), o senza perdita se colors è None"""
+    if not colors:
+        return encode_png(img)
+    palette_img = img.convert("RGB").quantize(colors=colors, method=PILImage.Quantize.MEDIANCUT,
+                                              dither=PILImage.Dither.NONE)
+    return encode_png(palette_img)
+
+def encode_line_art(img, target_psnr=LINE_ART_TARGET_PSNR):
+    """
+    Codifica disegni e schermate in PNG a palette.
+
+    Se l'immagine ha al massimo 256 colori la palette è esatta; altrimenti (bordi sfumati,
+    artefatti JPEG) si usa la palette più piccola che rispetta il PSNR obiettivo, senza
+    retinatura. Se nessuna palette basta si salva un PNG senza perdita.
+
+    Returns:
+        Tuple: (byte PNG, numero di colori della palette o None se senza perdita)
+    """
+    img = img.convert("RGB")
+    colors = img.getcolors(PALETTE_COLORS)
+    if colors is not None:
+        return encode_palette(img, len(colors)), len(colors)
+    
+    for palette_size in PALETTE_STEPS:
+        palette_img = img.quantize(colors=palette_size, method=PILImage.Quantize.MEDIANCUT,
+                                   dither=PILImage.Dither.NONE)
+        if compute_psnr(img, palette_img.convert("RGB")) >= target_psnr:
+            return encode_png(palette_img), palette_size
+    
+    # Immagini in scala di grigi (es. disegni scansionati) in un solo canale
+    red, green, blue = img.split()
+    if ImageChops.difference(red, green).getbbox() is None and ImageChops.difference(red, blue).getbbox() is None:
+        img = red
+    return encode_png(img), None
+
+def line_art_pixel_size(img, width_px, height_px):
+    """Dimensioni in pixel per un disegno: fino a LINE_ART_SCALE volte, senza ingrandire l'originale"""
+    factor = max(1.0, min(LINE_ART_SCALE, img.width / width_px, img.height / height_px))
+    return max(1, int(width_px * factor)), max(1, int(height_px * factor))
+
+# Rotazioni manuali (gradi in senso antiorario) come trasposizioni senza perdita (usate anche da miniature e anteprima)
+ROTATION_TRANSPOSE = {
+    90: PILImage.Transpose.ROTATE_90,
+    180: PILImage.Transpose.ROTATE_180,
+    270: PILImage.Transpose.ROTATE_270,
+}
+
+def load_oriented_image(image_path, rotation, draft_size=None):
+    """
+    Decodifica un'immagine applicando orientamento EXIF e rotazione manuale.
+
+    Args:
+        image_path: Percorso del file
+        rotation: Rotazione manuale in gradi (antiorari)
+        draft_size: Dimensioni minime (già orientate) per la decodifica ridotta dei JPEG, None per piena risoluzione
+    """
+    with PILImage.open(image_path) as img:
+        if draft_size:
+            try:
+                orientation = img.getexif().get(274, 1)
+            except Exception:
+                orientation = 1
+            # La richiesta è espressa nell'orientamento del file
+            width_px, height_px = draft_size
+            if (orientation in EXIF_SWAPPED_ORIENTATIONS) != (rotation in (90, 270)):
+                img.draft("RGB", (height_px, width_px))
+            else:
+                img.draft("RGB", (width_px, height_px))
         
-        # Altezza massima (metà pagina meno spazio per didascalia)
-        page_height_cm = section.page_height.cm
-        margin_top_cm = section.top_margin.cm
-        margin_bottom_cm = section.bottom_margin.cm
-        available_height_cm = ((page_height_cm - margin_top_cm - margin_bottom_cm - 2) / 2) * 0.8  # -2 per le didascalie
-        available_height_emu = int(available_height_cm * 360000)
+        # Gestione orientamento EXIF e rotazione manuale
+        img = ImageOps.exif_transpose(img)
+        if rotation in ROTATION_TRANSPOSE:
+            print(f"Applicazione rotazione manuale: {rotation}°")
+            img = img.transpose(ROTATION_TRANSPOSE[rotation])
+        img.load()
+        return img
+
+def load_rendition_source(img_info, box_width_emu, box_height_emu):
+    """
+    Legge una figura e prepara quanto serve per codificarla nel documento.
+
+    Le foto che stanno già nel riquadro di destinazione e non richiedono rotazioni
+    (o solo un capovolgimento di 180°, applicato come rotazione del disegno) conservano
+    i byte originali e non vengono decodificate. Le altre vengono decodificate a scala
+    ridotta, orientate, classificate (foto o disegno) e ridimensionate.
+
+    Args:
+        img_info: Dizionario con path, rotation e opzionalmente processed_image
+        box_width_emu, box_height_emu: Spazio disponibile in EMU
+
+    Returns:
+        dict: path, rotation, width_emu, height_emu, width_px, height_px, source_format,
+              passthrough_data (byte originali o None), kind e img (immagine alle
+              dimensioni finali, None se si usano i byte originali)
+    """
+    rotation = img_info.get("rotation", 0) % 360
+    source = {"path": img_info.get("path"), "rotation": rotation, "passthrough_data": None,
+              "source_format": None, "kind": None, "img": None}
+    
+    # Immagine già elaborata in memoria dal chiamante
+    if "processed_image" in img_info:
+        img = img_info["processed_image"]
+        print(f"\nUsando immagine processata: {img.width}x{img.height}")
+        source["width_emu"], source["height_emu"], source["width_px"], source["height_px"] = \
+            fit_image_to_box(img.width, img.height, box_width_emu, box_height_emu)
+        source["source_pixels"] = img.width * img.height
+        source["img"] = resize_rendition_source(source, img)
+        return source
+    
+    print(f"\nCaricando immagine da file: {img_info['path']}")
+    with PILImage.open(img_info["path"]) as img:
+        # Dimensioni e orientamento dall'header, senza decodificare i pixel
+        try:
+            orientation = img.getexif().get(274, 1)
+        except Exception as e:
+            print(f"Errore nella lettura EXIF: {str(e)}")
+            orientation = 1
+        print(f"Orientamento EXIF: {orientation}")
+        
+        width, height = img.size
+        if orientation in EXIF_SWAPPED_ORIENTATIONS:
+            width, height = height, width
+        if rotation in (90, 270):
+            width, height = height, width
+        print(f"Dimensioni dopo rotazioni: {width}x{height}")
+        
+        width_emu, height_emu, width_px, height_px = fit_image_to_box(width, height, box_width_emu, box_height_emu)
+        print(f"Dimensioni target: {width_emu/360000:.2f}x{height_emu/360000:.2f} cm ({width_px}x{height_px} px)")
+        source.update(width_emu=width_emu, height_emu=height_emu, width_px=width_px, height_px=height_px,
+                      source_format=img.format, source_pixels=width * height)
+        
+        # Immagine già abbastanza piccola e senza rotazioni da ricalcolare: byte originali
+        if (img.format in PASSTHROUGH_FORMATS and orientation == 1 and rotation in (0, 180)
+                and width <= width_px and height <= height_px):
+            with open(img_info["path"], "rb") as f:
+                source["passthrough_data"] = f.read()
+            return source
+    
+    source["img"] = decode_rendition_source(source)
+    return source
+
+def decode_rendition_source(source):
+    """Decodifica (a scala ridotta per i JPEG) l'immagine di una figura alle dimensioni finali"""
+    img = load_oriented_image(source["path"], source["rotation"], (source["width_px"], source["height_px"]))
+    return resize_rendition_source(source, img)
+
+def resize_rendition_source(source, img):
+    """Classifica l'immagine e la ridimensiona (i disegni da file senza perdita a risoluzione doppia)"""
+    width_px, height_px = source["width_px"], source["height_px"]
+    source["kind"] = classify_image(img)
+    if source["kind"] == "lineart" and source["source_format"] != "JPEG":
+        width_px, height_px = line_art_pixel_size(img, width_px, height_px)
+    return img.resize((width_px, height_px), PILImage.LANCZOS)
+
+def budget_scale(factor):
+    """Scala delle dimensioni in pixel per un fattore di compressione comune (1 = nessuna riduzione), a passi di BUDGET_SCALE_STEP"""
+    scale = BUDGET_MIN_SCALE + (1 - BUDGET_MIN_SCALE) * factor
+    return round(round(scale / BUDGET_SCALE_STEP) * BUDGET_SCALE_STEP, 2)
+
+def budget_quality(base_quality, factor):
+    """Qualità JPEG per un fattore di compressione comune, a partire da quella scelta a fattore 1 (a passi di BUDGET_QUALITY_STEP)"""
+    quality = BUDGET_MIN_QUALITY + (base_quality - BUDGET_MIN_QUALITY) * factor
+    return max(BUDGET_MIN_QUALITY, min(base_quality, int(round(quality / BUDGET_QUALITY_STEP) * BUDGET_QUALITY_STEP)))
+
+def encode_rendition(source, factor=1.0, img=None, cache=None, cache_key=None):
+    """
+    Codifica una figura preparata con load_rendition_source.
+
+    A fattore 1 si usano i byte originali se possibile, altrimenti la qualità adattiva
+    (PSNR obiettivo) per le foto e la palette minima per i disegni; i parametri scelti
+    vengono ricordati nella sorgente. Con fattore minore di 1 dimensioni in pixel e
+    qualità JPEG si riducono insieme (vedi budget_scale e budget_quality).
+
+    Args:
+        source: Dizionario prodotto da load_rendition_source
+        factor (float): Fattore comune tra 0 (massima compressione) e 1
+        img: Immagine alle dimensioni finali se non è conservata nella sorgente
+        cache (dict): Codifiche già calcolate, indicizzate per figura, scala e parametri di codifica
+        cache_key: Identificativo della figura nella cache
+
+    Returns:
+        dict: data (bytes), width_emu, height_emu, passthrough, rotate_180, kind, quality, scale
+    """
+    rendition = {"width_emu": source["width_emu"], "height_emu": source["height_emu"],
+                 "passthrough": False, "rotate_180": False, "kind": source["kind"],
+                 "quality": None, "scale": 1.0, "source_pixels": source.get("source_pixels")}
+    if factor >= 1 and source["passthrough_data"] is not None:
+        print("Immagine incorporata senza ricodifica")
+        rendition.update(data=source["passthrough_data"], passthrough=True,
+                         rotate_180=source["rotation"] == 180, kind="original")
+        return rendition
+    
+    if img is None:
+        img = source["img"] if source["img"] is not None else decode_rendition_source(source)
+    
+    if factor >= 1:
+        if source["kind"] == "lineart":
+            data, source["palette_size"] = encode_line_art(img)
+            # Risoluzione doppia solo se il PNG non è più pesante di quello alle dimensioni del riquadro
+            box_size = (source["width_px"], source["height_px"])
+            if img.size != box_size:
+                single, palette_size = encode_line_art(img.resize(box_size, PILImage.LANCZOS))
+                if len(single) <= len(data):
+                    data, source["palette_size"] = single, palette_size
+                    source["pixel_size"] = box_size
+                    print(f"Disegno incorporato a {box_size[0]}x{box_size[1]} px: la risoluzione doppia pesa di più")
+            rendition["quality"] = source["palette_size"]
+        else:
+            data, source["quality"] = encode_photo(img)
+            rendition["quality"] = source["quality"]
+        rendition["data"] = data
+        return rendition
+    
+    # Riduzione comune di scala e qualità per rispettare la dimensione massima del documento
+    scale = budget_scale(factor)
+    base_width, base_height = source.get("pixel_size") or img.size
+    size = (max(1, int(base_width * scale)), max(1, int(base_height * scale)))
+    if source["kind"] == "lineart":
+        params = ("png", source.get("palette_size"))
+    else:
+        params = ("jpeg", budget_quality(source.get("quality", PHOTO_QUALITY_RANGE[1]), factor))
+    key = (cache_key, scale, params)
+    if cache is not None and key in cache:
+        data = cache[key]
     else:
-        # Se siamo in una cella, usiamo dimensioni di default
-        available_width_emu = int(Cm(15).emu)  # pagina A4
-        available_height_emu = int(Cm(10).emu)
+        small = img.resize(size, PILImage.LANCZOS)
+        if params[0] == "png":
+            data = encode_palette(small, params[1])
+        else:
+            data = encode_jpeg(small.convert("RGB") if small.mode != "RGB" else small, params[1])
+        if cache is not None:
+            cache[key] = data
+    rendition.update(data=data, quality=params[1], scale=scale)
+    return rendition
+
+def prepare_image_rendition(img_info, box_width_emu, box_height_emu):
+    """
+    Prepara i byte di una figura da inserire nel documento (vedi load_rendition_source).
+
+    Args:
+        img_info: Dizionario con path, rotation e opzionalmente processed_image
+        box_width_emu, box_height_emu: Spazio disponibile in EMU
+
+    Returns:
+        dict: data (bytes), width_emu, height_emu, passthrough, rotate_180, kind, quality, scale
+    """
+    return encode_rendition(load_rendition_source(img_info, box_width_emu, box_height_emu))
+
+class ImageBudgetSearch:
+    """
+    Codifica in parallelo le figure di un documento, opzionalmente entro un budget in byte.
+
+    Il budget si rispetta cercando per bisezione un unico fattore che riduce insieme
+    dimensioni e qualità di tutte le figure. Le sorgenti decodificate restano in memoria
+    fino a BUDGET_SOURCE_CACHE_BYTES (oltre si rileggono dal file); scala e qualità vanno a
+    passi (BUDGET_SCALE_STEP, BUDGET_QUALITY_STEP), così i tentativi della bisezione che
+    cadono sullo stesso passo riusano le codifiche del tentativo precedente.
+    """
+
+    def __init__(self, images, box_width_emu, box_height_emu, workers=None):
+        self.images = images
+        self.box_width_emu = box_width_emu
+        self.box_height_emu = box_height_emu
+        self.workers = workers or min(8, os.cpu_count() or 2)
+        self.sources = [None] * len(images)
+        self._encode_cache = {}
+        self._cached_source_bytes = 0
+        self._lock = threading.Lock()
+
+    def _run(self, task):
+        """Esegue task(i) per tutte le figure in parallelo; gli errori diventano risultati"""
+        def safe_task(index):
+            try:
+                return task(index)
+            except Exception as e:
+                print(f"Errore nella preparazione dell'immagine {index + 1}: {str(e)}")
+                return e
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(safe_task, range(len(self.images))))
+
+    def renditions(self, factor=1.0, keep_sources=False):
+        """Codifica tutte le figure con un fattore comune; le figure non leggibili restano eccezioni"""
+        def task(index):
+            if self.sources[index] is None:
+                self.sources[index] = load_rendition_source(self.images[index], self.box_width_emu, self.box_height_emu)
+            source = self.sources[index]
+            if isinstance(source, Exception):
+                raise source
+            img = source["img"]
+            if img is None and (factor < 1 or source["passthrough_data"] is None):
+                img = decode_rendition_source(source)
+            rendition = encode_rendition(source, factor, img, self._encode_cache, index)
+            
+            # Le sorgenti si conservano per i tentativi successivi solo entro il limite di memoria
+            if keep_sources and img is not None and not source.get("cached"):
+                size = img.width * img.height * len(img.getbands())
+                with self._lock:
+                    keep = self._cached_source_bytes + size <= BUDGET_SOURCE_CACHE_BYTES
+                    if keep:
+                        self._cached_source_bytes += size
+                source["img"] = img if keep else None
+                source["cached"] = keep
+            elif not keep_sources:
+                source["img"] = None
+            return rendition
+        
+        results = self._run(task)
+        for index, result in enumerate(results):
+            if isinstance(result, Exception) and self.sources[index] is None:
+                self.sources[index] = result
+        return results
+
+    @staticmethod
+    def total_bytes(renditions):
+        """Byte occupati dalle figure codificate"""
+        return sum(len(r["data"]) for r in renditions if isinstance(r, dict))
+
+    def search(self, budget_bytes, report=None, max_iterations=BUDGET_MAX_ITERATIONS):
+        """
+        Cerca il fattore più alto con cui le figure stanno nel budget.
+
+        Args:
+            budget_bytes (int): Byte disponibili per le figure
+            report (dict): Se indicato viene riempito con le impostazioni scelte
+            max_iterations (int): Numero massimo di bisezioni dopo il tentativo a fattore 1
+
+        Returns:
+            list: Figure codificate (o eccezioni per le figure non leggibili)
+        """
+        start_time = time.time()
+        best_factor = 1.0
+        best = self.renditions(1.0, keep_sources=True)
+        best_size = self.total_bytes(best)
+        iterations = 1
+        print(f"Figure a qualità piena: {best_size / 1048576:.2f} MB (budget {budget_bytes / 1048576:.2f} MB)")
+        
+        if best_size > budget_bytes:
+            low, high = 0.0, 1.0
+            best = None
+            for _ in range(max_iterations):
+                factor = (low + high) / 2
+                candidate = self.renditions(factor, keep_sources=True)
+                size = self.total_bytes(candidate)
+                iterations += 1
+                print(f"Fattore {factor:.3f}: {size / 1048576:.2f} MB")
+                if size <= budget_bytes:
+                    low, best, best_factor, best_size = factor, candidate, factor, size
+                else:
+                    high = factor
+            
+            # Nessun tentativo nel budget: massima compressione
+            if best is None:
+                best_factor = 0.0
+                best = self.renditions(0.0, keep_sources=True)
+                best_size = self.total_bytes(best)
+                iterations += 1
+        
+        qualities = [r["quality"] for r in best if isinstance(r, dict) and r["kind"] == "photo" and r["quality"]]
+        settings = {
+            "factor": best_factor,
+            "scale": budget_scale(best_factor) if best_factor < 1 else 1.0,
+            "photo_quality": (min(qualities), max(qualities)) if qualities else None,
+            "image_bytes": best_size,
+            "budget_bytes": budget_bytes,
+            "fits": best_size <= budget_bytes,
+            "iterations": iterations,
+            "seconds": round(time.time() - start_time, 2),
+        }
+        print(f"Budget immagini: {settings}")
+        if report is not None:
+            report.update(settings)
+        
+        # Le sorgenti decodificate non servono più
+        for source in self.sources:
+            if isinstance(source, dict):
+                source["img"] = None
+        return best
+
+def document_image_budget(template_path, images, max_output_size):
+    """Byte disponibili per le figure entro max_output_size (None senza limite)"""
+    if not max_output_size:
+        return None
+    return max_output_size - os.path.getsize(template_path) - BUDGET_IMAGE_OVERHEAD * len(images)
+
+def prepare_renditions(images, box_width_emu, box_height_emu, image_budget=None, report=None):
+    """
+    Codifica in parallelo tutte le figure di un documento.
+
+    Args:
+        images: Lista di dizionari con path, description e rotation
+        box_width_emu, box_height_emu: Spazio disponibile in EMU
+        image_budget (int): Byte disponibili per le figure, None senza limite
+        report (dict): Riceve le impostazioni scelte se c'è un budget
+
+    Returns:
+        list: Figure codificate (o eccezioni per le figure non leggibili), nell'ordine di images
+    """
+    search = ImageBudgetSearch(images, box_width_emu, box_height_emu)
+    if image_budget is None:
+        return search.renditions(1.0)
+    return search.search(max(0, image_budget), report)
+
+def set_picture_rotation(picture, degrees):
+    """Ruota un'immagine inline nel documento senza modificarne i pixel"""
+    for xfrm in picture._inline.xpath('.//pic:spPr/a:xfrm'):
+        xfrm.set('rot', str(int(degrees * 60000)))
+
+def populate_images_table(doc, table, images, renditions=None, manifest=None):
+    """
+    Popola una tabella con immagini e didascalie.
+
+    Args:
+        renditions: Figure già codificate con prepare_renditions (None per codificarle qui)
+        manifest: GenerationManifest che registra le didascalie per l'aggiornamento incrementale
+    """
+    # Calcola le dimensioni per le immagini
+    available_width_emu, available_height_emu = compute_image_box(doc)
     
     print(f"\nDimensioni disponibili:")
-    print(f"Larghezza massima: {available_width_cm:.2f} cm ({available_width_emu} EMU)")
-    print(f"Altezza massima: {available_height_cm:.2f} cm ({available_height_emu} EMU)")
+    print(f"Larghezza massima: {available_width_emu / 360000:.2f} cm ({available_width_emu} EMU)")
+    print(f"Altezza massima: {available_height_emu / 360000:.2f} cm ({available_height_emu} EMU)")
     
     # Assicurati che la tabella abbia una sola colonna
     if len(table.columns) > 1:
@@ -814,71 +1589,12 @@ def populate_images_table(doc, table, images):
         cell = table.cell(i, 0)
         
         try:
-            # Usa l'immagine processata se disponibile, altrimenti carica dal file
-            if "processed_image" in img_info:
-                img = img_info["processed_image"]
-                print(f"\nUsando immagine processata: {img.width}x{img.height}")
+            if renditions is not None:
+                rendition = renditions[i]
+                if isinstance(rendition, Exception):
+                    raise rendition
             else:
-                img = PILImage.open(img_info["path"])
-                print(f"\nCaricando immagine da file: {img_info['path']}")
-                
-                # Gestione orientamento EXIF
-                try:
-                    exif = img.getexif()
-                    orientation = exif.get(274, 1)
-                    print(f"Orientamento EXIF: {orientation}")
-                    
-                    if orientation == 3:
-                        img = img.rotate(180, expand=True)
-                    elif orientation == 6:
-                        img = img.rotate(270, expand=True)
-                    elif orientation == 8:
-                        img = img.rotate(90, expand=True)
-                except Exception as e:
-                    print(f"Errore nella lettura EXIF: {str(e)}")
-                
-                # Applica la rotazione manuale se presente
-                rotation = img_info.get("rotation", 0)
-                if rotation != 0:
-                    print(f"Applicazione rotazione manuale: {rotation}°")
-                    img = img.rotate(rotation, expand=True)
-            
-            # Ottieni le dimensioni dopo tutte le rotazioni
-            orig_width, orig_height = img.size
-            print(f"Dimensioni dopo rotazioni: {orig_width}x{orig_height}")
-            
-            # Calcola il rapporto d'aspetto dell'immagine
-            aspect_ratio = orig_width / orig_height
-            print(f"Rapporto d'aspetto: {aspect_ratio:.2f}")
-            
-            # Usa sempre l'altezza come riferimento
-            target_height_emu = available_height_emu
-            target_width_emu = int(target_height_emu * aspect_ratio)
-            
-            # Se la larghezza calcolata supera quella disponibile, ricalcola partendo dalla larghezza
-            if target_width_emu > available_width_emu:
-                target_width_emu = available_width_emu
-                target_height_emu = int(target_width_emu / aspect_ratio)
-            
-            print(f"Dimensioni target: {target_width_emu/360000:.2f}x{target_height_emu/360000:.2f} cm")
-            
-            # Calcola le dimensioni in pixel per il ridimensionamento
-            scale_factor = 1  # Ridotto da 2 a 1 per ridurre il numero di pixel
-            width_px = int((target_width_emu / 360000) * 96 * scale_factor)  # 96 DPI
-            height_px = int((target_height_emu / 360000) * 96 * scale_factor)
-            
-            # Assicurati che le dimensioni siano almeno 1 pixel
-            width_px = max(1, width_px)
-            height_px = max(1, height_px)
-            
-            print(f"Dimensioni in pixel: {width_px}x{height_px}")
-            
-            # Crea un'immagine temporanea con le dimensioni corrette
-            temp_path = f"{img_info['path']}_temp.jpg"
-            
-            # Ridimensiona e salva l'immagine con una qualità più bassa
-            img = img.resize((width_px, height_px), PILImage.LANCZOS)
-            img.save(temp_path, quality=75, dpi=(150, 150), optimize=True)
+                rendition = prepare_image_rendition(img_info, available_width_emu, available_height_emu)
             
             # Paragrafo per l'immagine
             p = cell.paragraphs[0]
@@ -886,15 +1602,16 @@ def populate_images_table(doc, table, images):
             p.space_after = Pt(24)  # Aggiunge 24pt di spazio dopo l'immagine
             run = p.add_run()
             
-            # Aggiungi l'immagine al documento
-            picture = run.add_picture(temp_path)
+            # Aggiungi l'immagine al documento direttamente dalla memoria
+            picture = run.add_picture(io.BytesIO(rendition["data"]))
             
             # Imposta le dimensioni esatte dell'immagine nel documento
-            picture.width = target_width_emu
-            picture.height = target_height_emu
+            picture.width = rendition["width_emu"]
+            picture.height = rendition["height_emu"]
             
-            # Rimuovi il file temporaneo
-            os.remove(temp_path)
+            # Capovolgimento senza perdita per le immagini incorporate con i byte originali
+            if rendition["rotate_180"]:
+                set_picture_rotation(picture, 180)
             
             # Aggiungi una riga vuota per la spaziatura
             cell.add_paragraph()
@@ -911,6 +1628,8 @@ def populate_images_table(doc, table, images):
             caption = cell.add_paragraph(caption_text)
             caption.alignment = WD_ALIGN_PARAGRAPH.CENTER
             format_caption(caption)
+            if manifest is not None:
+                manifest.mark_caption(i, caption)
             
             # Aggiungi una riga vuota dopo la didascalia
             cell.add_paragraph()
@@ -1110,4 +1829,330 @@ def replace_placeholder(paragraph, placeholder, value):
                             run.text = run.text.replace(placeholder_text_no_spaces, "")
                     create_checkbox_control(paragraph, value)
                     print("Checkbox created successfully")
-                    return 
\ No newline at end of file
+                    return 
+# Rigenerazione incrementale: durante la generazione ogni paragrafo con segnaposto viene
+# racchiuso in un segnalibro nascosto (il nome inizia con "_", Word non lo mostra) e il suo XML
+# originale del modello viene salvato in un manifest insieme ai valori dei campi e alle chiavi
+# delle immagini. Se poi cambiano solo testi e didascalie, si rigenerano solo quei paragrafi
+# e il resto del pacchetto (immagini comprese) viene copiato così com'è.
+MANIFEST_VERSION = 2
+FIELD_MARK_PREFIX = "_vi_p"
+CAPTION_MARK_PREFIX = "_vi_c"
+MARK_BOOKMARK_BASE_ID = 900000
+PATCHABLE_PART_PATTERN = re.compile(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+_manifests_pruned = False
+STORED_MEDIA_EXTENSIONS = (".jpeg", ".jpg", ".png", ".gif", ".emf", ".wmf")
+
+def manifest_path(output_path):
+    """Percorso del manifest di un documento generato, nella cartella dati dell'applicazione"""
+    import hashlib
+    import template_cache
+    key = os.path.normcase(os.path.abspath(output_path)).encode("utf-8")
+    return os.path.join(template_cache.app_data_dir("manifest"), hashlib.sha1(key).hexdigest()[:20] + ".json")
+
+def file_signature(path):
+    """Dimensione e data di modifica di un file (None se non esiste)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def image_cache_key(img_info):
+    """Chiave che cambia se cambia il file dell'immagine o la sua rotazione (non la didascalia)"""
+    path = os.path.abspath(img_info.get("path", ""))
+    return [path, file_signature(path), img_info.get("rotation", 0) % 360]
+
+def loose_field_key(text):
+    """Forma ridotta di un nome di campo: copre tutte le strategie di ricerca di replace_text_in_paragraph"""
+    return "".join(c for c in text.lower() if c.isalnum())
+
+def add_mark_bookmark(first_p, last_p, name, bookmark_id):
+    """Racchiude i paragrafi da first_p a last_p (fratelli consecutivi) in un segnalibro"""
+    start = OxmlElement('w:bookmarkStart')
+    start.set(qn('w:id'), str(bookmark_id))
+    start.set(qn('w:name'), name)
+    pPr = first_p.find(qn('w:pPr'))
+    if pPr is not None:
+        pPr.addnext(start)
+    else:
+        first_p.insert(0, start)
+    end = OxmlElement('w:bookmarkEnd')
+    end.set(qn('w:id'), str(bookmark_id))
+    last_p.append(end)
+
+class GenerationManifest:
+    """Registra durante la generazione dove sono finiti i valori dei campi e le didascalie"""
+
+    def __init__(self, data):
+        self.data = data
+        self.bool_fields = {loose_field_key(key) for key, value in data.items() if isinstance(value, bool)}
+        self.marks = []
+        self.unpatchable = set()
+        self.captions = {}
+        self.lookup = FieldLookup(data)
+
+    def replace_paragraph(self, paragraph):
+        """Sostituisce i segnaposto del paragrafo e ne marca il risultato"""
+        p = paragraph._p
+        names = PLACEHOLDER_PATTERN.findall(paragraph.text)
+        already_marked = any((el.get(qn('w:name')) or "").startswith(FIELD_MARK_PREFIX)
+                             for el in p.findall(qn('w:bookmarkStart')))
+        # Checkbox e paragrafi già marcati non si aggiornano in place
+        if not names or already_marked or any(
+                name.startswith("checkbox_") or loose_field_key(name) in self.bool_fields for name in names):
+            self.unpatchable.update(names)
+            replace_paragraph_fields(paragraph, self.data, self.lookup)
+            return
+        
+        template_xml = etree.tostring(p, encoding="unicode")
+        next_sibling = p.getnext()
+        replace_paragraph_fields(paragraph, self.data, self.lookup)
+        
+        # I valori su più righe aggiungono paragrafi subito dopo quello originale
+        last_p = p
+        while last_p.getnext() is not None and last_p.getnext() is not next_sibling and last_p.getnext().tag == qn('w:p'):
+            last_p = last_p.getnext()
+        index = len(self.marks)
+        mark = {
+            "name": f"{FIELD_MARK_PREFIX}{index}",
+            "placeholders": names,
+            "xml": template_xml,
+        }
+        add_mark_bookmark(p, last_p, mark["name"], MARK_BOOKMARK_BASE_ID + index)
+        self.marks.append(mark)
+
+    def mark_caption(self, index, paragraph):
+        """Marca la didascalia della figura index (il numero di figura resta quello calcolato ora)"""
+        match = re.match(r'Figura (\d+)', paragraph.text)
+        bookmark_id = MARK_BOOKMARK_BASE_ID - 1 - index
+        add_mark_bookmark(paragraph._p, paragraph._p, f"{CAPTION_MARK_PREFIX}{index}", bookmark_id)
+        self.captions[index] = int(match.group(1)) if match else None
+
+    def save(self, template_path, output_path, images, max_output_size):
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "path": os.path.abspath(output_path),
+            "output": file_signature(output_path),
+            "template": [os.path.abspath(template_path), file_signature(template_path)],
+            "max_output_size": max_output_size,
+            "images": [image_cache_key(img_info) for img_info in images or []],
+            "descriptions": [img_info.get("description", "") for img_info in images or []],
+            "figure_numbers": [self.captions.get(i) for i in range(len(images or []))],
+            "fields": self.data,
+            "marks": self.marks,
+            "unpatchable": sorted(self.unpatchable),
+        }
+        write_manifest(output_path, manifest)
+        prune_manifests()
+
+def prune_manifests():
+    """Elimina, una volta per sessione, i manifest dei documenti che non esistono più"""
+    global _manifests_pruned
+    if _manifests_pruned:
+        return
+    _manifests_pruned = True
+    import template_cache
+    folder = template_cache.app_data_dir("manifest")
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        try:
+            with open(path, encoding="utf-8") as f:
+                output_path = json.load(f).get("path")
+        except (OSError, ValueError):
+            output_path = None
+        # Manifest illeggibili o di versioni precedenti (senza percorso) non servono più
+        if not output_path or not os.path.exists(output_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+def write_manifest(output_path, manifest):
+    """Scrive il manifest in modo atomico (un manifest troncato farebbe solo rigenerare tutto)"""
+    path = manifest_path(output_path)
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except (OSError, TypeError, ValueError) as e:
+        print(f"Impossibile salvare il manifest di {output_path}: {str(e)}")
+
+def load_manifest(output_path):
+    try:
+        with open(manifest_path(output_path), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
+
+def caption_text(description, figure_number):
+    """Testo della didascalia, come lo compone format_caption"""
+    description = description.strip()
+    if not description:
+        return f"Figura {figure_number}"
+    if description.startswith("Figura"):
+        return description
+    return f"Figura {figure_number} - {description}"
+
+def find_marked_paragraphs(root, name):
+    """
+    Paragrafi consecutivi racchiusi dal segnalibro indicato.
+
+    L'id del segnalibro si legge dal bookmarkStart trovato per nome: Word rinumera gli id
+    quando salva il documento, i nomi invece restano.
+
+    Returns:
+        tuple: (paragrafi, id del segnalibro), o None se la struttura non è riconoscibile
+    """
+    starts = root.xpath(f'.//w:bookmarkStart[@w:name="{name}"]')
+    if len(starts) != 1:
+        return None
+    bookmark_id = starts[0].get(qn('w:id'))
+    ends = root.xpath(f'.//w:bookmarkEnd[@w:id="{bookmark_id}"]')
+    if bookmark_id is None or len(ends) != 1:
+        return None
+    first_p, last_p = starts[0].getparent(), ends[0].getparent()
+    if first_p.tag != qn('w:p') or last_p.tag != qn('w:p'):
+        return None
+    paragraphs = [first_p]
+    while paragraphs[-1] is not last_p:
+        following = paragraphs[-1].getnext()
+        if following is None or following.tag != qn('w:p'):
+            return None
+        paragraphs.append(following)
+    return paragraphs, bookmark_id
+
+def patch_document(template_path, output_path, data, images=None, max_output_size=None, report=None):
+    """
+    Aggiorna in place un documento generato in precedenza, riscrivendo solo i paragrafi
+    dei campi cambiati e le didascalie modificate.
+
+    Returns:
+        bool: False se non è possibile (manifest assente, documento modificato, immagini o
+            checkbox cambiati...): in quel caso occorre rigenerare tutto
+    """
+    from docx.oxml import parse_xml
+    import zipfile
+    
+    manifest = load_manifest(output_path)
+    if manifest is None:
+        return False
+    images = images or []
+    if (manifest["output"] is None or manifest["output"] != file_signature(output_path)
+            or manifest["template"] != [os.path.abspath(template_path), file_signature(template_path)]
+            or manifest["max_output_size"] != max_output_size
+            or manifest["images"] != [image_cache_key(img_info) for img_info in images]):
+        return False
+    
+    old_fields = manifest["fields"]
+    changed = {key for key in set(old_fields) | set(data) if old_fields.get(key) != data.get(key)}
+    if any(isinstance(old_fields.get(key), bool) or isinstance(data.get(key), bool) for key in changed):
+        return False
+    changed_keys = {loose_field_key(key) for key in changed}
+    def is_affected(names):
+        return any(loose_field_key(name) in changed_keys for name in names)
+    if is_affected(manifest["unpatchable"]):
+        return False
+    
+    marks = [mark for mark in manifest["marks"] if is_affected(mark["placeholders"])]
+    captions = []
+    for i, img_info in enumerate(images):
+        description = img_info.get("description", "")
+        if description != manifest["descriptions"][i]:
+            if manifest["figure_numbers"][i] is None:
+                return False
+            captions.append((i, caption_text(description, manifest["figure_numbers"][i])))
+    
+    start_time = time.time()
+    lookup = FieldLookup(data)
+    try:
+        with zipfile.ZipFile(output_path) as package:
+            # Solo le parti che contengono i segnalibri da aggiornare vengono analizzate
+            pending = [(mark["name"], mark) for mark in marks]
+            pending += [(f"{CAPTION_MARK_PREFIX}{i}", text) for i, text in captions]
+            new_parts = {}
+            for info in package.infolist():
+                if not pending or not PATCHABLE_PART_PATTERN.match(info.filename):
+                    continue
+                xml = package.read(info.filename)
+                here = [item for item in pending if f'w:name="{item[0]}"'.encode("utf-8") in xml]
+                if not here:
+                    continue
+                root = parse_xml(xml)
+                for name, target in here:
+                    if name.startswith(CAPTION_MARK_PREFIX):
+                        found = find_marked_paragraphs(root, name)
+                        if found is None or len(found[0]) != 1:
+                            return False
+                        paragraphs = found[0]
+                        runs = paragraphs[0].findall(qn('w:r'))
+                        if not runs:
+                            return False
+                        for r in runs[1:]:
+                            paragraphs[0].remove(r)
+                        for child in list(runs[0]):
+                            if child.tag != qn('w:rPr'):
+                                runs[0].remove(child)
+                        t = OxmlElement('w:t')
+                        t.set(qn('xml:space'), 'preserve')
+                        t.text = target
+                        runs[0].append(t)
+                        continue
+                    
+                    found = find_marked_paragraphs(root, name)
+                    if found is None:
+                        return False
+                    paragraphs, bookmark_id = found
+                    # Il paragrafo del modello viene ricostruito e sostituito con la stessa logica della generazione
+                    p = parse_xml(target["xml"])
+                    paragraphs[0].addprevious(p)
+                    next_sibling = paragraphs[-1].getnext()
+                    for old_p in paragraphs:
+                        old_p.getparent().remove(old_p)
+                    replace_paragraph_fields(Paragraph(p, story_container(p.getparent(), None)), data, lookup)
+                    last_p = p
+                    while last_p.getnext() is not None and last_p.getnext() is not next_sibling and last_p.getnext().tag == qn('w:p'):
+                        last_p = last_p.getnext()
+                    add_mark_bookmark(p, last_p, name, bookmark_id)
+                pending = [item for item in pending if item not in here]
+                new_parts[info.filename] = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+            if pending:
+                print(f"Segnalibri non trovati nel documento: {[item[0] for item in pending]}")
+                return False
+            
+            # Nuovo pacchetto: parti XML aggiornate, tutto il resto copiato (le immagini senza ricompressione)
+            temp_path = output_path + ".tmp"
+            with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as out:
+                for info in package.infolist():
+                    content = new_parts.get(info.filename)
+                    if content is None:
+                        content = package.read(info.filename)
+                    entry = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                    entry.compress_type = (zipfile.ZIP_STORED if info.filename.lower().endswith(STORED_MEDIA_EXTENSIONS)
+                                           else zipfile.ZIP_DEFLATED)
+                    out.writestr(entry, content)
+        # Fallisce se il documento è aperto in Word: si passa alla rigenerazione completa
+        os.replace(temp_path, output_path)
+    except Exception as e:
+        print(f"Aggiornamento incrementale non riuscito, rigenerazione completa: {str(e)}")
+        if 'temp_path' in locals() and os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    
+    manifest["fields"] = data
+    manifest["descriptions"] = [img_info.get("description", "") for img_info in images]
+    manifest["output"] = file_signature(output_path)
+    write_manifest(output_path, manifest)
+    
+    print(f"Aggiornamento incrementale: {len(marks)} paragrafi e {len(captions)} didascalie "
+          f"in {time.time() - start_time:.2f} s")
+    if report is not None:
+        report["incremental"] = True
+        report["patched_paragraphs"] = len(marks)
+        report["patched_captions"] = len(captions)
+        report["output_size"] = os.path.getsize(output_path)
+        if max_output_size:
+            report["within_limit"] = report["output_size"] <= max_output_size
+    return True
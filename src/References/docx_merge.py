@@ -0,0 +1,664 @@
+import os
+import copy
+import shutil
+import hashlib
+import zipfile
+import posixpath
+import tempfile
+
+from lxml import etree
+
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+R_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WP_NS = "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing"
+PIC_NS = "http://schemas.openxmlformats.org/drawingml/2006/picture"
+VML_O_NS = "urn:schemas-microsoft-com:office:office"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+CT_NS = "http://schemas.openxmlformats.org/package/2006/content-types"
+REL_TYPE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/"
+
+# Parti condivise da tutti i verbali: si prendono dal primo documento (stili e numerazioni
+# vengono uniti, le altre sono uguali per documenti generati dallo stesso modello)
+SHARED_TYPES = {REL_TYPE + name for name in (
+    "styles", "numbering", "settings", "theme", "fontTable", "webSettings", "stylesWithEffects",
+    "people", "customXml", "glossaryDocument",
+)}
+
+# Note e commenti hanno il contenuto di ciascun verbale: si uniscono in una sola parte per tipo
+# con gli id rinumerati (tipo di relazione -> elemento della voce e riferimenti nel corpo)
+NOTE_TYPES = {
+    REL_TYPE + "footnotes": ("footnote", ("footnoteReference",)),
+    REL_TYPE + "endnotes": ("endnote", ("endnoteReference",)),
+    REL_TYPE + "comments": ("comment", ("commentReference", "commentRangeStart", "commentRangeEnd")),
+}
+# Voci speciali delle note (separatori): restano quelle del primo verbale, richiamate dalle impostazioni
+SEPARATOR_NOTE_TYPES = ("separator", "continuationSeparator", "continuationNotice")
+
+# Formati già compressi: nel pacchetto si memorizzano senza ricomprimerli
+STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".emf", ".wmf", ".tif", ".tiff")
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_BODY_MARKER = "__VI_MERGE_BODY__"
+
+# Segnalibri nascosti dell'aggiornamento incrementale (FIELD_MARK_PREFIX e CAPTION_MARK_PREFIX
+# di docx_generator): nel volume si ripeterebbero uguali per ogni verbale, quindi si tolgono
+GENERATION_MARK_PREFIXES = ("_vi_p", "_vi_c")
+# Livelli di un elenco per cui si riparte dal primo numero a ogni verbale
+NUMBERING_LEVELS = 9
+
+def _w(name):
+    return f"{{{W_NS}}}{name}"
+
+def rels_name(part_name):
+    """Nome del file delle relazioni di una parte del pacchetto"""
+    directory, base = posixpath.split(part_name)
+    return posixpath.join(directory, "_rels", base + ".rels")
+
+def resolve_target(part_name, target):
+    """Percorso nel pacchetto della destinazione di una relazione (relativa alla parte sorgente)"""
+    if target.startswith("/"):
+        return target.lstrip("/")
+    return posixpath.normpath(posixpath.join(posixpath.dirname(part_name), target))
+
+def strip_generation_marks(root):
+    """Toglie i segnalibri dell'aggiornamento incrementale; restituisce quanti ne ha tolti"""
+    ids = set()
+    for start in list(root.iter(_w("bookmarkStart"))):
+        if (start.get(_w("name")) or "").startswith(GENERATION_MARK_PREFIXES):
+            ids.add(start.get(_w("id")))
+            start.getparent().remove(start)
+    if ids:
+        for end in list(root.iter(_w("bookmarkEnd"))):
+            if end.get(_w("id")) in ids:
+                end.getparent().remove(end)
+    return len(ids)
+
+def read_relationships(zin, part_name):
+    """Relazioni di una parte: lista di (Id, Type, Target, TargetMode)"""
+    try:
+        data = zin.read(rels_name(part_name))
+    except KeyError:
+        return []
+    root = etree.fromstring(data)
+    return [(rel.get("Id"), rel.get("Type"), rel.get("Target"), rel.get("TargetMode"))
+            for rel in root.iter(f"{{{PKG_REL_NS}}}Relationship")]
+
+def serialize_relationships(relationships):
+    """XML di un file di relazioni da una lista di (Id, Type, Target, TargetMode)"""
+    root = etree.Element(f"{{{PKG_REL_NS}}}Relationships", nsmap={None: PKG_REL_NS})
+    for rel_id, rel_type, target, mode in relationships:
+        rel = etree.SubElement(root, f"{{{PKG_REL_NS}}}Relationship", Id=rel_id, Type=rel_type, Target=target)
+        if mode:
+            rel.set("TargetMode", mode)
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+
+class ContentTypes:
+    """Tipi di contenuto di un pacchetto ([Content_Types].xml)"""
+
+    def __init__(self, data):
+        root = etree.fromstring(data)
+        self.defaults = {el.get("Extension").lower(): el.get("ContentType") for el in root.iter(f"{{{CT_NS}}}Default")}
+        self.overrides = {el.get("PartName").lstrip("/"): el.get("ContentType") for el in root.iter(f"{{{CT_NS}}}Override")}
+
+    def get(self, part_name):
+        if part_name in self.overrides:
+            return self.overrides[part_name]
+        return self.defaults.get(posixpath.splitext(part_name)[1].lstrip(".").lower())
+
+class DocumentMerger:
+    """
+    Unisce più verbali .docx in un unico volume, un documento alla volta.
+
+    Ogni documento viene letto e scritto subito nel pacchetto di uscita: il corpo passa
+    in un file temporaneo (con un'interruzione di sezione tra un verbale e l'altro), le
+    immagini e le altre parti vengono copiate rinumerando le relazioni. Le parti identiche
+    (stessi byte e stesse relazioni) si scrivono una sola volta; stili e numerazioni si
+    uniscono solo quando differiscono da quelli già presenti.
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self._temp_path = output_path + ".tmp"
+        self._zout = zipfile.ZipFile(self._temp_path, "w", zipfile.ZIP_DEFLATED)
+        self._body = tempfile.TemporaryFile()
+        self._names = set()
+        self._content_types = {}         # parte scritta -> tipo di contenuto
+        self._defaults = {}
+        self._parts_by_hash = {}         # impronta del contenuto -> parte già scritta
+        self._relationships = []         # relazioni del documento principale
+        self._shared_rel_ids = {}        # tipo condiviso -> Id nel documento unito
+        self._main_part = None
+        self._document_head = None
+        self._document_tail = None
+        self._pending_sect_pr = None
+        self._nsmap = None
+        self._styles = None
+        self._style_ids = set()
+        self._styles_part = None
+        self._seen_styles = set()
+        self._numbering = None
+        self._numbering_part = None
+        self._numbering_maps = {}        # impronta numbering.xml -> (mappa abstractNumId, elementi w:num)
+        self._next_rel = 1
+        self._next_drawing_id = 1
+        self._next_bookmark_id = 0
+        self._notes = {}                 # tipo di relazione -> parte unita di note o commenti
+        self.documents = 0
+        self.media_parts = 0
+        self.deduplicated_parts = 0
+
+    def _new_rel_id(self):
+        rel_id = f"rId{self._next_rel}"
+        self._next_rel += 1
+        return rel_id
+
+    def _unique_name(self, part_name):
+        """Nome libero nel pacchetto di uscita, con un contatore prima dell'estensione"""
+        if part_name not in self._names:
+            return part_name
+        stem, ext = posixpath.splitext(part_name)
+        stem = stem.rstrip("0123456789")
+        counter = 1
+        while f"{stem}{counter}{ext}" in self._names:
+            counter += 1
+        return f"{stem}{counter}{ext}"
+
+    def _write(self, part_name, data, content_type=None):
+        """Scrive una parte nel pacchetto (i formati già compressi senza ricompressione)"""
+        compression = zipfile.ZIP_STORED if part_name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+        self._zout.writestr(zipfile.ZipInfo(part_name, date_time=(1980, 1, 1, 0, 0, 0)), data, compress_type=compression)
+        self._names.add(part_name)
+        if content_type:
+            self._content_types[part_name] = content_type
+
+    def _copy_part(self, zin, content_types, part_name, visited):
+        """
+        Copia una parte (e le parti collegate) con un nuovo nome, riusando quelle identiche.
+
+        Returns:
+            str: Nome della parte nel pacchetto di uscita
+        """
+        if part_name in visited:
+            return visited[part_name]
+        data = zin.read(part_name)
+        # Intestazioni e piè di pagina dei verbali generati contengono anch'essi i segnalibri
+        if part_name.endswith(".xml") and any(prefix.encode("ascii") in data for prefix in GENERATION_MARK_PREFIXES):
+            root = etree.fromstring(data)
+            if strip_generation_marks(root):
+                data = etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True)
+        relationships = []
+        for rel_id, rel_type, target, mode in read_relationships(zin, part_name):
+            if mode == "External":
+                relationships.append((rel_id, rel_type, target, mode))
+            else:
+                relationships.append((rel_id, rel_type, self._copy_part(zin, content_types, resolve_target(part_name, target), visited), None))
+
+        digest = hashlib.sha1(data)
+        for rel in relationships:
+            digest.update(repr(rel).encode("utf-8"))
+        key = digest.hexdigest()
+        if key in self._parts_by_hash:
+            self.deduplicated_parts += 1
+            visited[part_name] = self._parts_by_hash[key]
+            return visited[part_name]
+
+        new_name = self._unique_name(part_name)
+        self._write(new_name, data, content_types.get(part_name))
+        if relationships:
+            directory = posixpath.dirname(new_name)
+            self._write(rels_name(new_name), serialize_relationships(
+                [(rel_id, rel_type, target if mode else posixpath.relpath(target, directory), mode)
+                 for rel_id, rel_type, target, mode in relationships]))
+        if part_name.startswith("word/media/"):
+            self.media_parts += 1
+        self._parts_by_hash[key] = new_name
+        visited[part_name] = new_name
+        return new_name
+
+    def _merge_styles(self, data, num_map=None):
+        """Aggiunge gli stili non ancora presenti (solo se il file differisce da quelli già visti)"""
+        key = hashlib.sha1(data).hexdigest()
+        if key in self._seen_styles:
+            return
+        self._seen_styles.add(key)
+        root = etree.fromstring(data)
+        if self._styles is None:
+            self._styles = root
+            self._style_ids = {style.get(_w("styleId")) for style in root.iter(_w("style"))}
+            return
+        for style in root.iter(_w("style")):
+            style_id = style.get(_w("styleId"))
+            if style_id not in self._style_ids:
+                style = copy.deepcopy(style)
+                for num_id in style.iter(_w("numId")):
+                    if num_map and num_id.get(_w("val")) in num_map:
+                        num_id.set(_w("val"), num_map[num_id.get(_w("val"))])
+                self._styles.append(style)
+                self._style_ids.add(style_id)
+
+    def _merge_numbering(self, data):
+        """
+        Unisce le numerazioni di un documento.
+
+        Le definizioni (abstractNum) si aggiungono una sola volta per contenuto; ogni verbale
+        dopo il primo riceve invece istanze (w:num) proprie con startOverride, così i suoi
+        elenchi ripartono dal primo numero invece di continuare quelli del verbale precedente.
+
+        Returns:
+            dict: Mappa dei numId del documento verso quelli del volume (vuota per il primo verbale)
+        """
+        key = hashlib.sha1(data).hexdigest()
+        if self._numbering is None:
+            self._numbering = etree.fromstring(data)
+            self._numbering_maps[key] = ({}, [copy.deepcopy(num) for num in self._numbering.iter(_w("num"))])
+            return {}
+
+        if key not in self._numbering_maps:
+            root = etree.fromstring(data)
+            abstract_offset = max((int(el.get(_w("abstractNumId"))) for el in self._numbering.iter(_w("abstractNum"))), default=-1) + 1
+            abstracts = list(self._numbering.iter(_w("abstractNum")))
+            insert_at = self._numbering.index(abstracts[-1]) + 1 if abstracts else 0
+            abstract_map = {}
+            for abstract in root.iter(_w("abstractNum")):
+                abstract = copy.deepcopy(abstract)
+                old_id = abstract.get(_w("abstractNumId"))
+                abstract_map[old_id] = str(int(old_id) + abstract_offset)
+                abstract.set(_w("abstractNumId"), abstract_map[old_id])
+                self._numbering.insert(insert_at, abstract)
+                insert_at += 1
+            self._numbering_maps[key] = (abstract_map, list(root.iter(_w("num"))))
+        abstract_map, nums = self._numbering_maps[key]
+
+        # Primo numero di ogni livello delle definizioni del volume
+        starts = {}
+        for abstract in self._numbering.iter(_w("abstractNum")):
+            for lvl in abstract.iter(_w("lvl")):
+                start = lvl.find(_w("start"))
+                starts[(abstract.get(_w("abstractNumId")), lvl.get(_w("ilvl")))] = \
+                    start.get(_w("val")) if start is not None else "0"
+
+        next_num_id = max((int(el.get(_w("numId"))) for el in self._numbering.iter(_w("num"))), default=0) + 1
+        cleanup = self._numbering.find(_w("numIdMacAtCleanup"))
+        num_map = {}
+        for num in nums:
+            num = copy.deepcopy(num)
+            old_id = num.get(_w("numId"))
+            num_map[old_id] = str(next_num_id)
+            next_num_id += 1
+            num.set(_w("numId"), num_map[old_id])
+            # L'identificativo durevole di Word deve restare unico tra le istanze
+            for name in [name for name in num.attrib if name.endswith("}durableId")]:
+                del num.attrib[name]
+            abstract_ref = num.find(_w("abstractNumId"))
+            if abstract_ref is None:
+                continue
+            abstract_id = abstract_map.get(abstract_ref.get(_w("val")), abstract_ref.get(_w("val")))
+            abstract_ref.set(_w("val"), abstract_id)
+            overrides = {override.get(_w("ilvl")): override for override in num.findall(_w("lvlOverride"))}
+            for level in map(str, range(NUMBERING_LEVELS)):
+                override = overrides.get(level)
+                if override is None:
+                    override = etree.SubElement(num, _w("lvlOverride"))
+                    override.set(_w("ilvl"), level)
+                if override.find(_w("startOverride")) is None:
+                    start = etree.Element(_w("startOverride"))
+                    start.set(_w("val"), starts.get((abstract_id, level), "0"))
+                    # w:startOverride precede un eventuale w:lvl
+                    override.insert(0, start)
+            if cleanup is not None:
+                cleanup.addprevious(num)
+            else:
+                self._numbering.append(num)
+        return num_map
+
+    def _section_break(self, sect_pr):
+        """Paragrafo che chiude la sezione di un verbale (la successiva inizia su una nuova pagina)"""
+        paragraph = etree.Element(_w("p"), nsmap={"w": W_NS})
+        etree.SubElement(paragraph, _w("pPr")).append(sect_pr)
+        return etree.tostring(paragraph)
+
+    def add(self, path):
+        """Aggiunge un verbale in coda al volume"""
+        first = self.documents == 0
+        with zipfile.ZipFile(path) as zin:
+            content_types = ContentTypes(zin.read("[Content_Types].xml"))
+            main_part = next((resolve_target("", target) for _, rel_type, target, _ in read_relationships(zin, "")
+                              if rel_type.endswith("/officeDocument")), "word/document.xml")
+            relationships = read_relationships(zin, main_part)
+            shared_parts = {}
+            for rel_id, rel_type, target, mode in relationships:
+                if rel_type in SHARED_TYPES and mode != "External":
+                    shared_parts[rel_type] = resolve_target(main_part, target)
+
+            if first:
+                self._main_part = main_part
+                self._defaults = dict(content_types.defaults)
+                self._content_types[main_part] = content_types.get(main_part)
+                self._copy_package(zin, content_types, main_part, relationships)
+
+            # Numerazioni e stili uniti una sola volta per contenuto
+            num_map = {}
+            numbering_part = shared_parts.get(REL_TYPE + "numbering")
+            if numbering_part:
+                if first:
+                    self._numbering_part = numbering_part
+                    self._numbering_content_type = content_types.get(numbering_part)
+                num_map = self._merge_numbering(zin.read(numbering_part))
+            styles_part = shared_parts.get(REL_TYPE + "styles")
+            if styles_part:
+                if first:
+                    self._styles_part = styles_part
+                    self._styles_content_type = content_types.get(styles_part)
+                self._merge_styles(zin.read(styles_part), num_map)
+
+            # Relazioni del corpo rinumerate nel volume
+            rel_map = {}
+            note_maps = {}
+            visited = {}
+            for rel_id, rel_type, target, mode in relationships:
+                if rel_type in NOTE_TYPES and mode != "External":
+                    rel_map[rel_id], id_map = self._merge_notes(zin, content_types, rel_type,
+                                                                resolve_target(main_part, target), visited)
+                    for tag in NOTE_TYPES[rel_type][1]:
+                        note_maps[_w(tag)] = id_map
+                    continue
+                if rel_type in SHARED_TYPES and mode != "External":
+                    if first:
+                        self._shared_rel_ids[rel_type] = self._new_rel_id()
+                        self._relationships.append((self._shared_rel_ids[rel_type], rel_type,
+                                                    posixpath.relpath(shared_parts[rel_type], posixpath.dirname(main_part)), None))
+                    if rel_type in self._shared_rel_ids:
+                        rel_map[rel_id] = self._shared_rel_ids[rel_type]
+                    continue
+                new_id = self._new_rel_id()
+                rel_map[rel_id] = new_id
+                if mode == "External":
+                    self._relationships.append((new_id, rel_type, target, mode))
+                else:
+                    new_part = self._copy_part(zin, content_types, resolve_target(main_part, target), visited)
+                    self._relationships.append((new_id, rel_type, posixpath.relpath(new_part, posixpath.dirname(self._main_part)), None))
+
+            with zin.open(main_part) as f:
+                root = etree.parse(f).getroot()
+
+        body = root.find(_w("body"))
+        self._remap_body(body, rel_map, num_map, note_maps)
+        sect_pr = body[-1] if len(body) and body[-1].tag == _w("sectPr") else None
+        if sect_pr is not None:
+            body.remove(sect_pr)
+            if not first:
+                self._set_next_page(sect_pr)
+
+        if first:
+            self._nsmap = dict(root.nsmap)
+        elif self._pending_sect_pr is not None:
+            self._body.write(self._section_break(self._pending_sect_pr))
+        self._body.write(self._serialize_children(root, body))
+        self._pending_sect_pr = sect_pr
+
+        if first:
+            # Apertura e chiusura del documento principale del primo verbale
+            for child in list(body):
+                body.remove(child)
+            body.text = _BODY_MARKER
+            head, tail = etree.tostring(root, encoding="UTF-8").split(_BODY_MARKER.encode("ascii"))
+            self._document_head, self._document_tail = head, tail
+        self.documents += 1
+        print(f"Verbale aggiunto al volume ({self.documents}): {path}")
+
+    def _merge_notes(self, zin, content_types, rel_type, part_name, visited):
+        """
+        Aggiunge le note (o i commenti) di un verbale alla parte unita del volume.
+
+        Il primo verbale che ne ha fornisce la parte con i separatori; le voci dei successivi
+        vi si accodano con id nuovi. Le parti collegate alle note (immagini, collegamenti)
+        vengono copiate come quelle del corpo.
+
+        Returns:
+            Tuple: (Id della relazione dal documento principale, mappa degli id delle voci)
+        """
+        item_tag = _w(NOTE_TYPES[rel_type][0])
+        root = etree.fromstring(zin.read(part_name))
+        strip_generation_marks(root)
+        notes = self._notes.get(rel_type)
+        first = notes is None
+        if first:
+            name = self._unique_name(part_name)
+            self._names.add(name)
+            notes = self._notes[rel_type] = {
+                "root": root, "part": name, "content_type": content_types.get(part_name),
+                "relationships": [], "rel_id": self._new_rel_id(),
+                "next_id": max((int(item.get(_w("id"))) for item in root.iter(item_tag)), default=-1) + 1,
+            }
+            self._relationships.append((notes["rel_id"], rel_type,
+                                        posixpath.relpath(name, posixpath.dirname(self._main_part)), None))
+
+        # Relazioni delle note verso la parte unita
+        note_rel_map = {}
+        for rel_id, note_rel_type, target, mode in read_relationships(zin, part_name):
+            new_id = f"rId{len(notes['relationships']) + 1}"
+            note_rel_map[rel_id] = new_id
+            if mode != "External":
+                target = posixpath.relpath(self._copy_part(zin, content_types, resolve_target(part_name, target), visited),
+                                           posixpath.dirname(notes["part"]))
+            notes["relationships"].append((new_id, note_rel_type, target, mode))
+
+        id_map = {}
+        items = list(root.iter(item_tag))
+        for item in items:
+            if not first:
+                if item.get(_w("type")) in SEPARATOR_NOTE_TYPES:
+                    continue
+                id_map[item.get(_w("id"))] = str(notes["next_id"])
+                item.set(_w("id"), id_map[item.get(_w("id"))])
+                notes["next_id"] += 1
+                notes["root"].append(item)
+            for el in item.iter():
+                if not isinstance(el.tag, str):
+                    continue
+                for name, value in el.attrib.items():
+                    if name.startswith(f"{{{R_NS}}}") and value in note_rel_map:
+                        el.set(name, note_rel_map[value])
+        return notes["rel_id"], id_map
+
+    def _serialize_children(self, root, body):
+        """
+        XML dei blocchi del corpo. Se i prefissi coincidono con quelli del primo verbale si
+        serializza il corpo in una volta e si tolgono i tag di apertura e chiusura, così i
+        blocchi non ripetono le dichiarazioni dei namespace.
+        """
+        if not len(body):
+            return b""
+        if all(self._nsmap.get(prefix) == uri for prefix, uri in root.nsmap.items()):
+            data = etree.tostring(body)
+            return data[data.index(b">") + 1:data.rindex(b"</")]
+        return b"".join(etree.tostring(child) for child in body)
+
+    def _copy_package(self, zin, content_types, main_part, relationships):
+        """Copia dal primo verbale le parti non legate al corpo (proprietà, tema, impostazioni...)"""
+        skip = {"[Content_Types].xml", main_part, rels_name(main_part)}
+        # Le parti raggiungibili dal corpo si copiano (rinominate e senza duplicati) documento per documento
+        pending = [resolve_target(main_part, target) for _, rel_type, target, mode in relationships
+                   if rel_type not in SHARED_TYPES and mode != "External"]
+        while pending:
+            part = pending.pop()
+            if part in skip:
+                continue
+            skip.add(part)
+            skip.add(rels_name(part))
+            pending.extend(resolve_target(part, target) for _, _, target, mode in read_relationships(zin, part)
+                           if mode != "External")
+        for rel_type in (REL_TYPE + "styles", REL_TYPE + "numbering"):
+            for _, this_type, target, _ in relationships:
+                if this_type == rel_type:
+                    # Scritte alla fine dopo l'unione
+                    skip.add(resolve_target(main_part, target))
+        for info in zin.infolist():
+            if info.filename in skip or info.is_dir():
+                continue
+            self._write(info.filename, zin.read(info.filename), content_types.get(info.filename))
+
+    def _remap_body(self, body, rel_map, num_map, note_maps=None):
+        """
+        Aggiorna nel corpo gli Id delle relazioni, le numerazioni, gli id dei disegni, dei
+        segnalibri e dei riferimenti a note e commenti; i segnalibri dell'aggiornamento
+        incrementale vengono tolti.
+        """
+        note_maps = note_maps or {}
+        relid_attr = f"{{{VML_O_NS}}}relid"
+        strip_generation_marks(body)
+        bookmark_offset = self._next_bookmark_id
+        for el in body.iter():
+            if not isinstance(el.tag, str):
+                continue
+            for name, value in el.attrib.items():
+                if (name.startswith(f"{{{R_NS}}}") or name == relid_attr) and value in rel_map:
+                    el.set(name, rel_map[value])
+            tag = el.tag
+            if tag == _w("numId") and num_map:
+                value = el.get(_w("val"))
+                if value in num_map:
+                    el.set(_w("val"), num_map[value])
+            elif tag in (f"{{{WP_NS}}}docPr", f"{{{PIC_NS}}}cNvPr"):
+                el.set("id", str(self._next_drawing_id))
+                self._next_drawing_id += 1
+            elif tag in note_maps:
+                value = el.get(_w("id"))
+                if value in note_maps[tag]:
+                    el.set(_w("id"), note_maps[tag][value])
+            elif tag in (_w("bookmarkStart"), _w("bookmarkEnd")):
+                bookmark_id = int(el.get(_w("id"), 0)) + bookmark_offset
+                el.set(_w("id"), str(bookmark_id))
+                self._next_bookmark_id = max(self._next_bookmark_id, bookmark_id + 1)
+
+    @staticmethod
+    def _set_next_page(sect_pr):
+        """Fa iniziare la sezione su una nuova pagina"""
+        section_type = sect_pr.find(_w("type"))
+        if section_type is None:
+            section_type = etree.Element(_w("type"))
+            # w:type precede le dimensioni della pagina nell'ordine dello schema
+            following = next((child for child in sect_pr if child.tag not in (
+                _w("headerReference"), _w("footerReference"), _w("footnotePr"), _w("endnotePr"))), None)
+            if following is not None:
+                following.addprevious(section_type)
+            else:
+                sect_pr.append(section_type)
+        section_type.set(_w("val"), "nextPage")
+
+    def finish(self):
+        """Scrive documento principale, stili, numerazioni e tipi di contenuto e chiude il volume"""
+        if self.documents == 0:
+            raise ValueError("Nessun verbale da unire")
+        main_part = self._main_part
+
+        info = zipfile.ZipInfo(main_part, date_time=(1980, 1, 1, 0, 0, 0))
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with self._zout.open(info, "w") as f:
+            f.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n')
+            f.write(self._document_head)
+            self._body.seek(0)
+            shutil.copyfileobj(self._body, f, COPY_CHUNK_SIZE)
+            if self._pending_sect_pr is not None:
+                f.write(etree.tostring(self._pending_sect_pr))
+            f.write(self._document_tail)
+        self._names.add(main_part)
+        self._body.close()
+
+        if self._styles is not None:
+            self._write(self._styles_part, etree.tostring(self._styles, xml_declaration=True, encoding="UTF-8", standalone=True),
+                        self._styles_content_type)
+        if self._numbering is not None:
+            self._write(self._numbering_part, etree.tostring(self._numbering, xml_declaration=True, encoding="UTF-8", standalone=True),
+                        self._numbering_content_type)
+        for notes in self._notes.values():
+            self._write(notes["part"], etree.tostring(notes["root"], xml_declaration=True, encoding="UTF-8", standalone=True),
+                        notes["content_type"])
+            if notes["relationships"]:
+                self._write(rels_name(notes["part"]), serialize_relationships(notes["relationships"]))
+        self._write(rels_name(main_part), serialize_relationships(self._relationships))
+
+        root = etree.Element(f"{{{CT_NS}}}Types", nsmap={None: CT_NS})
+        defaults = dict(self._defaults)
+        for part_name in self._names:
+            ext = posixpath.splitext(part_name)[1].lstrip(".").lower()
+            if ext and ext not in defaults and self._content_types.get(part_name):
+                if part_name.startswith("word/media/"):
+                    defaults[ext] = self._content_types[part_name]
+        for ext, content_type in sorted(defaults.items()):
+            etree.SubElement(root, f"{{{CT_NS}}}Default", Extension=ext, ContentType=content_type)
+        for part_name in sorted(self._names):
+            content_type = self._content_types.get(part_name)
+            ext = posixpath.splitext(part_name)[1].lstrip(".").lower()
+            if content_type and defaults.get(ext) != content_type:
+                etree.SubElement(root, f"{{{CT_NS}}}Override", PartName="/" + part_name, ContentType=content_type)
+        self._write("[Content_Types].xml", etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True))
+
+        self._zout.close()
+        os.replace(self._temp_path, self.output_path)
+        print(f"Volume creato: {self.output_path} ({self.documents} verbali, {self.media_parts} immagini, "
+              f"{self.deduplicated_parts} parti duplicate riutilizzate)")
+
+    def abort(self):
+        """Chiude ed elimina il volume incompleto"""
+        try:
+            self._zout.close()
+            self._body.close()
+        finally:
+            if os.path.exists(self._temp_path):
+                os.remove(self._temp_path)
+
+def merge_documents(paths, output_path, report=None):
+    """
+    Unisce più verbali .docx in un unico documento, con un'interruzione di sezione tra l'uno e l'altro.
+
+    Args:
+        paths (list): Percorsi dei verbali nell'ordine del volume
+        output_path (str): Percorso del documento unito
+        report (dict, optional): Riceve numero di verbali, immagini e parti duplicate riutilizzate
+
+    Returns:
+        str: Percorso del documento unito
+    """
+    merger = DocumentMerger(output_path)
+    try:
+        for path in paths:
+            merger.add(path)
+        merger.finish()
+    except Exception:
+        merger.abort()
+        raise
+    if report is not None:
+        report.update(documents=merger.documents, media_parts=merger.media_parts,
+                      deduplicated_parts=merger.deduplicated_parts, output_size=os.path.getsize(output_path))
+    return output_path
+
+def merge_jobs(jobs, output_path, report=None):
+    """
+    Genera e unisce più verbali in un volume senza tenerli tutti su disco o in memoria.
+
+    Args:
+        jobs (list): Parametri di generate_document per ogni verbale (template_path, data, images)
+        output_path (str): Percorso del documento unito
+        report (dict, optional): Come in merge_documents
+    """
+    from docx_generator import generate_document
+
+    merger = DocumentMerger(output_path)
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            for number, job in enumerate(jobs, 1):
+                path = os.path.join(temp_dir, f"verbale_{number}.docx")
+                # File temporaneo: niente manifest per l'aggiornamento incrementale
+                generate_document(job.get("template_path"), path, job.get("data"), job.get("images"),
+                                  incremental=False)
+                merger.add(path)
+                os.remove(path)
+        merger.finish()
+    except Exception:
+        merger.abort()
+        raise
+    if report is not None:
+        report.update(documents=merger.documents, media_parts=merger.media_parts,
+                      deduplicated_parts=merger.deduplicated_parts, output_size=os.path.getsize(output_path))
+    return output_path
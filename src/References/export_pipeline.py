@@ -0,0 +1,180 @@
+"""
+Esportazione dello stesso verbale in più formati con una sola codifica delle foto.
+
+Le figure vengono lette, orientate, ridimensionate e codificate una volta con
+prepare_renditions (con la relativa cache delle codifiche); le stesse codifiche vengono
+poi passate in parallelo al documento Word, al PDF e all'archivio delle foto.
+"""
+import os
+import re
+import time
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from docx_generator import generate_document, prepare_renditions, BUDGET_IMAGE_OVERHEAD
+from pdf_exporter import export_pdf, compute_image_box, PDF_BASE_OVERHEAD
+from preview_renderer import load_template_index
+
+EXPORT_FORMATS = ("docx", "pdf", "zip")
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Archivio delle foto: copia a blocchi (memoria costante), senza ricompressione dei formati già compressi
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+ARCHIVE_STORED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".heic", ".heif", ".webp", ".mp4", ".mov", ".zip")
+ARCHIVE_CAPTION_LENGTH = 80
+ORIGINALS_FOLDER = "Originali"
+RENDITIONS_FOLDER = "Nel verbale"
+
+def default_outputs(docx_path):
+    """Percorsi dei tre formati accanto al documento Word scelto"""
+    base = os.path.splitext(docx_path)[0]
+    return {"docx": base + ".docx", "pdf": base + ".pdf", "zip": base + " - Foto.zip"}
+
+def originals_archive_path(output_path):
+    """Percorso dello zip delle foto originali accanto al documento generato"""
+    return os.path.splitext(output_path)[0] + " - Foto originali.zip"
+
+def archive_entry_name(number, description, extension):
+    """Nome nell'archivio: numero di figura e didascalia, senza caratteri non validi nei nomi di file"""
+    caption = re.sub(r'[\\/:*?"<>|\r\n\t]+', " ", description or "")
+    caption = " ".join(caption.split())[:ARCHIVE_CAPTION_LENGTH].rstrip(" .")
+    name = f"Figura {number:02d}" + (f" - {caption}" if caption else "")
+    return name + extension.lower()
+
+def archive_entry(name, extension, modified=None):
+    """Voce zip: memorizzata per i formati già compressi, compressa per gli altri"""
+    # Lo zip non rappresenta date anteriori al 1980
+    date_time = time.localtime(max(modified or time.time(), 315532800))[:6]
+    entry = zipfile.ZipInfo(name, date_time=date_time)
+    entry.compress_type = zipfile.ZIP_STORED if extension.lower() in ARCHIVE_STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    return entry
+
+def write_photo_archive(output_path, images=None, renditions=None, originals=True, report=None):
+    """
+    Archivio zip delle foto del verbale, con nomi dati da numero di figura e didascalia.
+
+    Gli originali vengono copiati dal disco a blocchi di ARCHIVE_CHUNK_SIZE, quindi la memoria
+    usata non dipende dalla dimensione delle foto; le figure già codificate (renditions)
+    sono quelle esatte incorporate nel documento. Con entrambi i tipi, ciascuno va nella
+    propria cartella dell'archivio.
+
+    Args:
+        output_path (str): Percorso dello zip da creare
+        images (list): Lista di dizionari con path e description (per gli originali e i nomi)
+        renditions (list, optional): Figure codificate (le eccezioni vengono saltate)
+        originals (bool): Includi i file originali delle foto
+        report (dict, optional): Riceve numero di foto, file mancanti e dimensione finale
+    """
+    images = images or []
+    renditions = renditions or []
+    both = originals and bool(renditions)
+    temp_path = output_path + ".tmp"
+    count = 0
+    missing = []
+    try:
+        with zipfile.ZipFile(temp_path, "w", allowZip64=True) as archive:
+            if originals:
+                for number, img_info in enumerate(images, 1):
+                    path = img_info.get("path", "")
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        missing.append(path)
+                        continue
+                    extension = os.path.splitext(path)[1] or ".jpg"
+                    name = archive_entry_name(number, img_info.get("description", ""), extension)
+                    entry = archive_entry(f"{ORIGINALS_FOLDER}/{name}" if both else name, extension, st.st_mtime)
+                    entry.file_size = st.st_size
+                    with open(path, "rb") as source, archive.open(entry, "w") as target:
+                        shutil.copyfileobj(source, target, ARCHIVE_CHUNK_SIZE)
+                    count += 1
+            for number, rendition in enumerate(renditions, 1):
+                if isinstance(rendition, Exception):
+                    continue
+                extension = ".png" if rendition["data"].startswith(PNG_SIGNATURE) else ".jpg"
+                description = images[number - 1].get("description", "") if number <= len(images) else ""
+                name = archive_entry_name(number, description, extension)
+                archive.writestr(archive_entry(f"{RENDITIONS_FOLDER}/{name}" if both else name, extension),
+                                 rendition["data"])
+                count += 1
+        os.replace(temp_path, output_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if missing:
+        print(f"Foto originali non trovate: {missing}")
+    if report is not None:
+        report["photos"] = count
+        report["missing"] = missing
+        report["output_size"] = os.path.getsize(output_path)
+    return output_path
+
+def export_all(template_path, outputs, data=None, images=None, max_output_size=None, report=None,
+               include_originals=False):
+    """
+    Produce più formati dello stesso verbale codificando ogni foto una sola volta.
+
+    Args:
+        template_path (str): Percorso del modello Word (.docx)
+        outputs (dict): Percorso per ciascun formato ("docx", "pdf", "zip"); i formati
+            assenti non vengono prodotti
+        data (dict): Valori dei campi
+        images (list): Lista di dizionari con path, description e rotation
+        max_output_size (int, optional): Dimensione massima in byte di docx e pdf; il budget
+            delle figure è il più stretto dei due, visto che le figure sono le stesse
+        report (dict, optional): Riceve le impostazioni delle figure e un resoconto per formato
+        include_originals (bool): Lo zip contiene anche le foto originali oltre alle figure del verbale
+
+    Returns:
+        dict: Percorsi prodotti per formato
+    """
+    unknown = set(outputs) - set(EXPORT_FORMATS)
+    if unknown:
+        raise ValueError(f"Formati non supportati: {', '.join(sorted(unknown))}")
+    start_time = time.time()
+    images = images or []
+    image_report = {}
+
+    renditions = []
+    if images:
+        image_budget = None
+        if max_output_size:
+            overhead = max(os.path.getsize(template_path), PDF_BASE_OVERHEAD) + BUDGET_IMAGE_OVERHEAD * len(images)
+            image_budget = max_output_size - overhead
+        index = load_template_index(template_path)
+        renditions = prepare_renditions(images, *compute_image_box(index), image_budget=image_budget, report=image_report)
+    encode_seconds = time.time() - start_time
+    print(f"Figure codificate una volta per {len(outputs)} formati in {encode_seconds:.2f} s")
+
+    # Ogni destinazione riceve una copia della lista: export_pdf vi segna le figure non incorporabili
+    sinks = {
+        "docx": lambda path, sink_report: generate_document(template_path, path, data, images, max_output_size,
+                                                            sink_report, incremental=False,
+                                                            renditions=list(renditions)),
+        "pdf": lambda path, sink_report: export_pdf(template_path, path, data, images, max_output_size,
+                                                    sink_report, renditions=list(renditions)),
+        "zip": lambda path, sink_report: write_photo_archive(path, images, renditions, include_originals, sink_report),
+    }
+    reports = {output_format: {} for output_format in outputs}
+    errors = []
+    with ThreadPoolExecutor(max_workers=max(1, len(outputs))) as executor:
+        futures = {output_format: executor.submit(sinks[output_format], path, reports[output_format])
+                   for output_format, path in outputs.items()}
+        for output_format, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Errore nell'esportazione {output_format}: {str(e)}")
+                errors.append(f"{output_format}: {str(e)}")
+
+    if report is not None:
+        report.update(image_report)
+        report["outputs"] = dict(outputs)
+        report["formats"] = reports
+        report["encode_seconds"] = round(encode_seconds, 2)
+        report["seconds"] = round(time.time() - start_time, 2)
+    if errors:
+        raise RuntimeError("Esportazione non riuscita per " + "; ".join(errors))
+    return dict(outputs)
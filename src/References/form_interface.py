@@ -1,28 +1,44 @@
+import time
+
+# Istante di avvio del processo, usato per il log dei tempi di avvio
+_STARTUP_T0 = time.perf_counter()
+
 import tkinter as tk
 from tkinter import filedialog, messagebox
 import tkinter.ttk as ttk
 import customtkinter as ctk
 import json
+import re
 import os
 import sys
-import subprocess
 import datetime
 import threading
-from PIL import Image, ImageTk, ImageOps
-from docx_generator import generate_document
+import queue
+import itertools
 import io
+import shutil
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+import template_cache
+import project_file
+from rich_text import parse_formatted_text
+
+# Pillow e il generatore Word sono importati in background (vedi _import_heavy_modules)
+# per non ritardare la comparsa della finestra
+Image = ImageTk = ImageOps = None
+generate_document = None
+ROTATION_TRANSPOSE = {}
+_heavy_imports_ready = threading.Event()
+_heavy_imports_errors = {}
 
-# Importazione condizionale di tkcalendar
+# Importazione condizionale di tkcalendar: se manca si usa una entry testuale,
+# senza installazioni sincrone all'avvio
 try:
     from tkcalendar import DateEntry
 except ImportError:
-    try:
-        messagebox.showinfo("Installazione dipendenze", "Il pacchetto tkcalendar non è installato. Sto provando ad installarlo...")
-        subprocess.check_call([sys.executable, "-m", "pip", "install", "tkcalendar"])
-        from tkcalendar import DateEntry
-        messagebox.showinfo("Successo", "tkcalendar installato con successo!")
-    except Exception as e:
-        messagebox.showerror("Errore", f"Impossibile installare tkcalendar: {str(e)}\nUsare il formato GG/MM/AAAA per la data.")
+    DateEntry = None
+    print("Avviso: tkcalendar non disponibile, usare il formato GG/MM/AAAA per la data "
+          "(installabile con 'pip install tkcalendar').")
 
 # Configura customtkinter con tema minimo
 ctk.set_appearance_mode("light")
@@ -36,37 +52,525 @@ def resource_path(relative_path):
         base_path = os.path.abspath(".")
     return os.path.join(base_path, relative_path)
 
-# Funzione per ottimizzare le immagini dopo aver corretto l'orientamento
-def optimize_image(img, max_size=(800, 800), quality=85):
-    """Ottimizza un'immagine PIL Image per ridurre la dimensione del file"""
+# Registro dei tempi di avvio nella cartella dati: oltre questa dimensione diventa avvio.1.log
+STARTUP_LOG_MAX_BYTES = 256 * 1024
+
+def log_startup_time(stage):
+    """Registra il tempo trascorso dall'avvio per una fase di startup"""
+    elapsed = time.perf_counter() - _STARTUP_T0
+    line = f"[avvio] {stage}: {elapsed:.3f} s"
+    print(line)
     try:
-        # Ridimensiona l'immagine mantenendo le proporzioni
+        log_path = os.path.join(template_cache.app_data_dir(), "avvio.log")
+        if os.path.exists(log_path) and os.path.getsize(log_path) > STARTUP_LOG_MAX_BYTES:
+            os.replace(log_path, os.path.join(template_cache.app_data_dir(), "avvio.1.log"))
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(f"{datetime.datetime.now():%Y-%m-%d %H:%M:%S} {line}\n")
+    except OSError:
+        pass
+    return elapsed
+
+def _import_heavy_modules():
+    """Importa Pillow e il generatore Word in un thread secondario"""
+    global Image, ImageTk, ImageOps, generate_document, ROTATION_TRANSPOSE
+    try:
+        try:
+            from PIL import Image, ImageTk, ImageOps
+        except ImportError as e:
+            _heavy_imports_errors["PIL"] = f"Pillow non disponibile: {str(e)}"
+        try:
+            from docx_generator import generate_document, ROTATION_TRANSPOSE
+        except ImportError as e:
+            _heavy_imports_errors["docx_generator"] = f"Generatore Word non disponibile: {str(e)}"
+    finally:
+        _heavy_imports_ready.set()
+        log_startup_time("moduli Pillow/docx importati")
+
+def start_heavy_imports():
+    """Avvia l'importazione in background dei moduli pesanti"""
+    threading.Thread(target=_import_heavy_modules, name="heavy-imports", daemon=True).start()
+
+def ensure_heavy_imports(*modules):
+    """
+    Attende il completamento delle importazioni in background.
+
+    Solleva ImportError se uno dei moduli richiesti ("PIL", "docx_generator") non è disponibile.
+    """
+    if not _heavy_imports_ready.is_set():
+        # Se nessuno ha avviato il thread (es. modulo importato da un altro script) importa subito
+        if not any(t.name == "heavy-imports" for t in threading.enumerate()):
+            _import_heavy_modules()
+        _heavy_imports_ready.wait()
+    for module in modules:
+        if module in _heavy_imports_errors:
+            raise ImportError(_heavy_imports_errors[module])
+
+def create_thumbnail(image_path, max_size=(300, 300)):
+    """
+    Crea una miniatura orientata senza passare dall'immagine a piena risoluzione.
+
+    I JPEG vengono decodificati direttamente a scala ridotta (draft 1/2, 1/4, 1/8),
+    l'orientamento EXIF viene applicato sulla miniatura e non c'è nessun passaggio
+    intermedio di codifica/decodifica JPEG.
+    """
+    with Image.open(image_path) as img:
+        # Decodifica ridotta: il box è quadrato quindi vale per qualsiasi orientamento
+        box = max(max_size)
+        img.draft('RGB', (box, box))
         img.thumbnail(max_size, Image.LANCZOS)
         
-        # Converti in RGB se necessario
-        if img.mode in ('RGBA', 'P'):
-            img = img.convert('RGB')
-            
-        # Salva l'immagine ottimizzata in un buffer
-        output = io.BytesIO()
-        img.save(output, format='JPEG', quality=quality, optimize=True)
-        output.seek(0);
-        
-        # Riapri l'immagine dal buffer
-        return Image.open(output)
-    except Exception:
-        # Se l'ottimizzazione fallisce, restituisci l'immagine originale (corretta per EXIF)
+        # Orientamento EXIF applicato sulla miniatura (restituisce sempre una nuova immagine)
+        thumb = ImageOps.exif_transpose(img)
+    
+    return thumb.convert('RGB') if thumb.mode != 'RGB' else thumb
+
+# Estensioni considerate nell'importazione di una cartella (come nel file dialog)
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+
+# Thread per la lettura degli header durante l'importazione di una cartella
+FOLDER_SCAN_WORKERS = 8
+
+def read_image_header(image_path):
+    """
+    Legge dall'header di una foto data di scatto, orientamento e dimensioni senza decodificare i pixel.
+
+    Se manca DateTimeOriginal si usa DateTime e, in mancanza anche di quello, la data di
+    modifica del file, nello stesso formato EXIF ("AAAA:MM:GG HH:MM:SS") così le date
+    si ordinano come stringhe.
+
+    Returns:
+        dict: Voce per import_image_entries con "path", "capture_time", "orientation", "size"
+              ed eventualmente "error" se l'header non è leggibile
+    """
+    entry = {"path": image_path}
+    try:
+        with Image.open(image_path) as img:
+            entry["size"] = list(img.size)
+            exif = img.getexif()
+            entry["orientation"] = exif.get(274, 1)
+            capture_time = exif.get_ifd(0x8769).get(36867) or exif.get(306)
+    except Exception as e:
+        entry["error"] = str(e)
+        capture_time = None
+    
+    if isinstance(capture_time, bytes):
+        capture_time = capture_time.decode("ascii", "ignore")
+    capture_time = (capture_time or "").strip("\x00 ")
+    if not capture_time:
+        try:
+            capture_time = time.strftime("%Y:%m:%d %H:%M:%S", time.localtime(os.path.getmtime(image_path)))
+        except OSError:
+            capture_time = ""
+    entry["capture_time"] = capture_time
+    return entry
+
+def find_image_files(folder):
+    """Elenca le immagini contenute in una cartella e nelle sue sottocartelle"""
+    paths = []
+    for directory, subdirs, files in os.walk(folder):
+        subdirs.sort()
+        paths.extend(os.path.join(directory, name) for name in sorted(files)
+                     if name.lower().endswith(IMAGE_EXTENSIONS))
+    return paths
+
+def scan_image_folder(folder, workers=FOLDER_SCAN_WORKERS):
+    """
+    Legge in parallelo gli header delle immagini di una cartella e le ordina per data di scatto.
+
+    Returns:
+        list: Voci di read_image_header ordinate per data di scatto e percorso
+    """
+    paths = find_image_files(folder)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        entries = list(executor.map(read_image_header, paths))
+    entries.sort(key=lambda entry: (entry["capture_time"], entry["path"]))
+    return entries
+
+def rotate_thumbnail(thumb, rotation):
+    """Deriva la variante ruotata di una miniatura con una trasposizione di 90° multipli"""
+    method = ROTATION_TRANSPOSE.get(rotation % 360)
+    if method is None:
+        return thumb
+    return thumb.transpose(method)
+
+def compose_preview(thumb, box_size=300):
+    """Centra una miniatura su uno sfondo bianco quadrato per l'anteprima"""
+    bg = Image.new('RGB', (box_size, box_size), (255, 255, 255))
+    x = (box_size - thumb.width) // 2
+    y = (box_size - thumb.height) // 2
+    bg.paste(thumb, (x, y))
+    return bg
+
+# Righe inserite nella lista immagini per ogni passo dell'importazione
+IMPORT_CHUNK_SIZE = 200
+
+# Campi di una voce importata che entrano nel modello delle immagini: dimensioni, orientamento
+# e data di scatto servono solo all'ordinamento dell'importazione
+IMAGE_ENTRY_KEYS = ("description", "rotation", "figure_number", "error")
+
+# Pausa (ms) dopo l'ultima modifica prima di ridisegnare le righe della lista immagini
+LIST_REFRESH_DELAY_MS = 150
+
+# Attesa prima di ridisegnare l'anteprima del documento dopo una modifica
+PREVIEW_REFRESH_DELAY_MS = 300
+PREVIEW_PAGE_GAP = 16
+
+# Intervallo dell'autosalvataggio del progetto (viene scritto solo se qualcosa è cambiato)
+AUTOSAVE_INTERVAL_MS = 5000
+
+class ImagePreviewCache:
+    """
+    Cache LRU delle miniature orientate con un limite di memoria in byte.
+
+    Contiene una sola miniatura base per foto: le varianti ruotate si derivano
+    con rotate_thumbnail invece di occupare voci separate.
+    """
+    def __init__(self, max_bytes=128 * 1024 * 1024, on_evict=None):
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self._items = OrderedDict()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def image_bytes(img):
+        """Stima la memoria occupata dai pixel di un'immagine PIL"""
+        return img.width * img.height * len(img.getbands())
+
+    def __contains__(self, path):
+        return path in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, path):
+        """Restituisce la miniatura (o None) aggiornandone la recenza"""
+        img = self._items.get(path)
+        if img is None:
+            self.misses += 1
+            return None
+        self._items.move_to_end(path)
+        self.hits += 1
         return img
 
+    def peek(self, path):
+        """Restituisce la miniatura senza modificare recenza e statistiche"""
+        return self._items.get(path)
+
+    def put(self, path, img):
+        """Inserisce una miniatura ed elimina le meno recenti oltre il limite di memoria"""
+        self.discard(path)
+        self._items[path] = img
+        self.current_bytes += self.image_bytes(img)
+        # La voce appena inserita resta sempre in cache anche se da sola supera il limite
+        while self.current_bytes > self.max_bytes and len(self._items) > 1:
+            old_path, old_img = self._items.popitem(last=False)
+            self.current_bytes -= self.image_bytes(old_img)
+            self.evictions += 1
+            if self.on_evict:
+                self.on_evict(old_path)
+
+    def discard(self, path):
+        """Rimuove una miniatura se presente"""
+        img = self._items.pop(path, None)
+        if img is not None:
+            self.current_bytes -= self.image_bytes(img)
+
+    def capacity_estimate(self, thumb_size=(300, 300)):
+        """Numero indicativo di miniature RGB della dimensione data che stanno nel limite"""
+        return max(1, self.max_bytes // (thumb_size[0] * thumb_size[1] * 3))
+
+    def stats(self):
+        """Statistiche di utilizzo della cache"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def clear(self):
+        """Svuota la cache e azzera le statistiche"""
+        self._items.clear()
+        self.current_bytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+class ThumbnailPrefetcher:
+    """
+    Pool di thread che genera in background le miniature delle immagini aggiunte.
+
+    Le richieste sono servite per priorità (selezionata, visibile, resto della lista);
+    i risultati vengono consegnati al thread della GUI tramite root.after.
+    """
+    PRIORITY_SELECTED = 0
+    PRIORITY_VISIBLE = 1
+    PRIORITY_BACKGROUND = 2
+
+    def __init__(self, root, on_ready, on_error, max_size=(300, 300), workers=None):
+        self.root = root
+        self.on_ready = on_ready
+        self.on_error = on_error
+        self.max_size = max_size
+        self.workers = workers or max(2, min(4, (os.cpu_count() or 2) - 1))
+        self.project_path = None  # Progetto con le miniature salvate da riutilizzare
+        self._queue = queue.PriorityQueue()
+        self._pending = {}  # path -> priorità della richiesta più urgente in coda
+        self._taken = set()  # percorsi già presi in carico da un worker
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self._threads = []
+
+    def submit(self, path, priority=PRIORITY_BACKGROUND):
+        """Accoda una miniatura; una richiesta già in coda viene solo resa più urgente"""
+        with self._lock:
+            if path in self._taken:
+                return
+            current = self._pending.get(path)
+            if current is not None and current <= priority:
+                return
+            self._pending[path] = priority
+            self._queue.put((priority, next(self._counter), path))
+        self._start_workers()
+
+    def prioritize(self, paths, priority=PRIORITY_VISIBLE):
+        """Rende più urgenti le miniature indicate (es. righe visibili o selezionate)"""
+        for path in paths:
+            self.submit(path, priority)
+
+    def forget(self, path):
+        """Permette di richiedere di nuovo una miniatura già generata (es. dopo uno svuotamento della cache)"""
+        with self._lock:
+            self._taken.discard(path)
+
+    def reset(self):
+        """Dimentica tutte le miniature già generate"""
+        with self._lock:
+            self._taken.clear()
+
+    def _start_workers(self):
+        """Avvia i thread alla prima richiesta"""
+        if self._threads:
+            return
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"thumbnail-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _worker(self):
+        """Estrae le richieste dalla coda e genera le miniature"""
+        while True:
+            priority, _, path = self._queue.get()
+            with self._lock:
+                # Voce superata da una richiesta più urgente già elaborata
+                if self._pending.get(path) != priority:
+                    continue
+                del self._pending[path]
+                self._taken.add(path)
+            
+            try:
+                ensure_heavy_imports("PIL")
+                # Miniatura già salvata nel progetto, se l'originale non è cambiato
+                thumb = None
+                if self.project_path:
+                    thumb = project_file.load_thumbnail(self.project_path, path)
+                # La generazione della miniatura verifica anche che il file sia decodificabile
+                if thumb is None:
+                    thumb = create_thumbnail(path, self.max_size)
+                callback, args = self.on_ready, (path, thumb)
+            except Exception as e:
+                callback, args = self.on_error, (path, str(e))
+            
+            try:
+                self.root.after(0, callback, *args)
+            except RuntimeError:
+                # La finestra principale è stata chiusa
+                return
+
+class ThumbnailGallery:
+    """
+    Griglia di miniature virtualizzata per il tab Immagini.
+
+    Crea elementi grafici e PhotoImage solo per le celle visibili e li riutilizza durante
+    lo scorrimento, così memoria e numero di widget non crescono con il numero di foto.
+    Le miniature vengono lette dalla cache dell'applicazione (alimentata in background).
+    """
+    CELL_WIDTH = 124
+    CELL_HEIGHT = 144
+    THUMB_SIZE = 104
+
+    def __init__(self, parent, app):
+        self.app = app
+        colors = app.colors
+        self.frame = tk.Frame(parent, bg=colors['surface'])
+        self.canvas = tk.Canvas(self.frame,
+                                bg=colors['surface'],
+                                highlightthickness=0,
+                                yscrollincrement=self.CELL_HEIGHT // 4)
+        self.scrollbar = tk.Scrollbar(self.frame, command=self.canvas.yview)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.canvas.configure(yscrollcommand=self._on_view_change)
+        
+        self._slots = []  # Celle grafiche riutilizzabili
+        self._columns = 1
+        self._total = 0
+        self._selected_index = None
+        
+        self.canvas.bind("<Configure>", lambda e: self.refresh())
+        self.canvas.bind("<Button-1>", self._on_click)
+        self.canvas.bind("<MouseWheel>", self._on_mousewheel)
+        self.canvas.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-3, "units"))
+        self.canvas.bind("<Button-5>", lambda e: self.canvas.yview_scroll(3, "units"))
+
+    def is_visible(self):
+        """Verifica se la griglia è attualmente mostrata"""
+        return bool(self.frame.winfo_ismapped())
+
+    def refresh(self):
+        """Ricalcola l'area di scorrimento e ridisegna le celle visibili"""
+        width = max(1, self.canvas.winfo_width())
+        self._columns = max(1, width // self.CELL_WIDTH)
+        self._total = len(self.app.images)
+        rows = (self._total + self._columns - 1) // self._columns
+        self.canvas.configure(scrollregion=(0, 0, width, max(rows * self.CELL_HEIGHT, 1)))
+        self._update_visible()
+
+    def set_selection(self, index):
+        """Evidenzia la cella dell'immagine selezionata"""
+        self._selected_index = index
+        self._update_visible()
+
+    def on_thumbnail_ready(self, path):
+        """Aggiorna la cella della foto se è visibile"""
+        if any(slot["path"] == path for slot in self._slots):
+            self._update_visible()
+
+    def _on_view_change(self, first, last):
+        """Aggiorna scrollbar e celle visibili quando la vista scorre"""
+        self.scrollbar.set(first, last)
+        self._update_visible()
+
+    def _on_mousewheel(self, event):
+        """Scorrimento con la rotella del mouse (Windows/macOS)"""
+        self.canvas.yview_scroll(int(-event.delta / 40) or (-1 if event.delta > 0 else 1), "units")
+
+    def _on_click(self, event):
+        """Seleziona l'immagine sotto il puntatore"""
+        x = self.canvas.canvasx(event.x)
+        y = self.canvas.canvasy(event.y)
+        column = int(x // self.CELL_WIDTH)
+        index = int(y // self.CELL_HEIGHT) * self._columns + column
+        if column < self._columns and 0 <= index < len(self.app.images):
+            self.app.select_image(index)
+
+    def _visible_range(self):
+        """Indici delle immagini nelle righe visibili (più una riga di margine)"""
+        top = self.canvas.canvasy(0)
+        bottom = top + self.canvas.winfo_height()
+        first_row = max(0, int(top // self.CELL_HEIGHT))
+        last_row = int(bottom // self.CELL_HEIGHT) + 1
+        return range(first_row * self._columns, min(self._total, (last_row + 1) * self._columns))
+
+    def _new_slot(self):
+        """Crea gli elementi grafici di una cella riutilizzabile"""
+        colors = self.app.colors
+        return {
+            "frame": self.canvas.create_rectangle(0, 0, 0, 0, outline=colors['outline_variant'], width=1),
+            "image": self.canvas.create_image(0, 0, anchor="center"),
+            "text": self.canvas.create_text(0, 0, anchor="n", width=self.CELL_WIDTH - 8,
+                                            font=('Arial', 9), fill=colors['on_surface']),
+            "index": None,
+            "path": None,
+            "key": None,
+            "photo": None,
+        }
+
+    def _update_visible(self):
+        """Assegna le celle del pool alle immagini visibili e nasconde quelle in eccesso"""
+        visible = self._visible_range()
+        while len(self._slots) < len(visible):
+            self._slots.append(self._new_slot())
+        
+        missing = []
+        for slot, index in zip(self._slots, visible):
+            self._show_slot(slot, index, missing)
+        for slot in self._slots[len(visible):]:
+            if slot["index"] is not None:
+                for item in ("frame", "image", "text"):
+                    self.canvas.itemconfigure(slot[item], state="hidden")
+                slot.update(index=None, path=None, key=None, photo=None)
+        
+        # Le miniature mancanti delle celle visibili passano in testa alla coda
+        if missing and self.app._prefetcher is not None:
+            self.app._prefetcher.prioritize(missing)
+
+    def _show_slot(self, slot, index, missing):
+        """Posiziona una cella e ne aggiorna il contenuto solo se è cambiato"""
+        image_info = self.app.images[index]
+        path = image_info["path"]
+        row, column = divmod(index, self._columns)
+        x0 = column * self.CELL_WIDTH
+        y0 = row * self.CELL_HEIGHT
+        colors = self.app.colors
+        
+        selected = index == self._selected_index
+        self.canvas.coords(slot["frame"], x0 + 3, y0 + 3, x0 + self.CELL_WIDTH - 3, y0 + self.CELL_HEIGHT - 3)
+        self.canvas.itemconfigure(slot["frame"], state="normal",
+                                  outline=colors['primary'] if selected else colors['outline_variant'],
+                                  width=2 if selected else 1)
+        self.canvas.coords(slot["image"], x0 + self.CELL_WIDTH // 2, y0 + 6 + self.THUMB_SIZE // 2)
+        self.canvas.coords(slot["text"], x0 + self.CELL_WIDTH // 2, y0 + self.THUMB_SIZE + 12)
+        
+        thumb = self.app._image_cache.peek(path)
+        label = f"Fig. {image_info.get('figure_number', '')}"
+        key = (path, image_info.get("rotation", 0), thumb is not None, label, bool(image_info.get("error")))
+        if slot["key"] != key:
+            photo = None
+            if thumb is not None:
+                small = rotate_thumbnail(thumb, image_info.get("rotation", 0)).copy()
+                small.thumbnail((self.THUMB_SIZE, self.THUMB_SIZE), Image.BILINEAR)
+                photo = ImageTk.PhotoImage(small)
+            elif not image_info.get("error"):
+                missing.append(path)
+            text = "Non leggibile" if image_info.get("error") else label
+            self.canvas.itemconfigure(slot["image"], image=photo or "", state="normal")
+            self.canvas.itemconfigure(slot["text"], text=text, state="normal",
+                                      fill=colors['error'] if image_info.get("error") else colors['on_surface'])
+            slot.update(photo=photo, key=key)
+        else:
+            self.canvas.itemconfigure(slot["image"], state="normal")
+            self.canvas.itemconfigure(slot["text"], state="normal")
+        slot.update(index=index, path=path)
+
 class FormApplication:
     def __init__(self, root):
         self.root = root
         self.root.title("Verbale di ispezione")
         self.root.geometry("1274x922")
         
-        # Cache per le immagini
-        self._image_cache = {}
-        self._max_cache_size = 10  # Numero massimo di immagini in cache
+        # Cache LRU delle miniature orientate (una per foto, limitata in byte)
+        self._prefetcher = None
+        self.thumbnail_gallery = None
+        self._image_cache = ImagePreviewCache(on_evict=self._on_thumbnail_evicted)
+        
+        # Progetto aperto (None = sessione autosalvata nel profilo utente)
+        self.project_path = None
+        self._autosaver = project_file.ProjectAutosaver(project_file.session_path())
+        self._autosave_job = None
+        
+        # Anteprima del documento (renderer e cache dei blocchi creati al primo uso)
+        self._preview_renderer = None
+        self._preview_job = None
+        self._preview_running = False
+        self._preview_pending = False
+        self._preview_missing = set()
+        self._preview_photos = []
         
         # Definizione colori per Material Design 3 con tema rosso
         self.colors = {
@@ -142,8 +646,17 @@ class FormApplication:
         
         # Inizializzazione delle variabili di stato
         self.images = []
+        self._image_paths = set()  # Indice dei percorsi già presenti in self.images
+        self._pending_list_rows = deque()  # Nomi in attesa di essere inseriti nella lista
+        self._import_job = None
+        self._import_done = 0
+        self._import_total = 0
+        self._pending_list_refresh = {}  # indice -> immagine con riga da ridisegnare
+        self._list_refresh_job = None
+        self._details_status_job = None
         self.current_image = None
         self.current_original_image = None
+        self.current_image_path = None
         self.current_rotation = 0
         self.selected_image_index = None
         self.fields = {}
@@ -155,8 +668,30 @@ class FormApplication:
         # Carica i dati dal file se esiste
         self.load_data_from_file()
         
-        # Seleziona il primo tab all'inizio
+        # Il contenuto dei tab viene costruito dopo che la finestra è comparsa
+        log_startup_time("struttura finestra creata")
+        self.root.after_idle(self._finish_startup)
+        
+        # Alla chiusura salva lo stato della sessione
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _finish_startup(self):
+        """Completa l'avvio dopo la prima visualizzazione della finestra"""
+        log_startup_time("finestra visibile")
+        
+        # Aggiorna in background la copia locale del modello Word di rete
+        template_cache.refresh_in_background(self.model_path_var.get())
+        
+        # Seleziona il primo tab all'inizio (il tab Immagini viene costruito alla prima selezione)
         self.select_tab("Dati")
+        
+        elapsed = log_startup_time("tab Dati pronto")
+        if elapsed > 1.0:
+            print(f"Avviso: avvio più lento dell'obiettivo di 1 s ({elapsed:.3f} s)")
+        
+        # Propone di riprendere la sessione precedente, poi avvia l'autosalvataggio
+        self._offer_session_restore()
+        self._autosave_job = self.root.after(AUTOSAVE_INTERVAL_MS, self._autosave)
 
     def _setup_ui(self):
         """Setup dell'interfaccia utente"""
@@ -184,6 +719,7 @@ class FormApplication:
         # Creazione dei tab
         self.add_tab("Dati")
         self.add_tab("Immagini")
+        self.add_tab("Anteprima")
         
         # Funzione condivisa per creare pulsanti
         self.create_button_func = self.create_button_method
@@ -215,6 +751,30 @@ class FormApplication:
         button_frame2 = ctk.CTkFrame(model_frame, fg_color=self.colors['background'])
         button_frame2.pack(side=tk.LEFT, padx=10)
         
+        # Dimensione massima del documento (es. limite degli allegati email), vuoto = nessun limite
+        max_size_label = ctk.CTkLabel(model_frame, text="Max MB:", fg_color=self.colors['background'], text_color=self.colors['on_surface'])
+        max_size_label.pack(side=tk.LEFT)
+        
+        self.max_size_var = tk.StringVar(value="")
+        max_size_entry = ctk.CTkEntry(model_frame, 
+                            textvariable=self.max_size_var, 
+                            width=50,
+                            fg_color=self.colors['surface'],
+                            text_color=self.colors['on_surface'],
+                            border_color=self.colors['outline'],
+                            border_width=1)
+        max_size_entry.pack(side=tk.LEFT, padx=5)
+        
+        # Zip delle foto originali accanto al documento generato
+        self.archive_originals_var = tk.BooleanVar(value=False)
+        archive_checkbox = ctk.CTkCheckBox(model_frame,
+                                   text="Zip foto originali",
+                                   variable=self.archive_originals_var,
+                                   fg_color=self.colors['primary'],
+                                   hover_color=self.colors['primary_dark'],
+                                   border_color=self.colors['outline'])
+        archive_checkbox.pack(side=tk.LEFT, padx=5)
+        
         browse_button = self.create_button_func(button_frame2, 
                                    "Sfoglia...", 
                                    self.browse_model,
@@ -222,6 +782,34 @@ class FormApplication:
                                    width=100)
         browse_button.pack(side=tk.LEFT, padx=5)
         
+        open_project_button = self.create_button_func(button_frame2, 
+                                   "Apri Progetto", 
+                                   self.open_project,
+                                   is_primary=False,
+                                   width=110)
+        open_project_button.pack(side=tk.LEFT, padx=5)
+        
+        save_project_button = self.create_button_func(button_frame2, 
+                                   "Salva Progetto", 
+                                   self.save_project,
+                                   is_primary=False,
+                                   width=110)
+        save_project_button.pack(side=tk.LEFT, padx=5)
+        
+        merge_button = self.create_button_func(button_frame2, 
+                                   "Unisci Verbali", 
+                                   self.merge_documents,
+                                   is_primary=False,
+                                   width=110)
+        merge_button.pack(side=tk.LEFT, padx=5)
+        
+        export_all_button = self.create_button_func(button_frame2, 
+                                   "Word + PDF + Foto", 
+                                   lambda: self.generate_document(export_all=True),
+                                   is_primary=False,
+                                   width=130)
+        export_all_button.pack(side=tk.LEFT, padx=5)
+        
         generate_button = self.create_button_func(button_frame, 
                                     "Genera Documento", 
                                     self.generate_document,
@@ -238,19 +826,22 @@ class FormApplication:
         clear_button.pack(side=tk.LEFT, padx=5)
 
     def _clear_image_cache(self):
-        """Pulisce la cache delle immagini"""
+        """Pulisce la cache delle immagini rilasciando subito miniature e anteprime"""
+        stats = self._image_cache.stats()
+        print(f"Cache anteprime: {stats['entries']} miniature, {stats['bytes'] / 1048576:.1f} MB, "
+              f"hit rate {stats['hit_rate']:.0%} ({stats['hits']} hit, {stats['misses']} miss, "
+              f"{stats['evictions']} rimozioni)")
         self._image_cache.clear()
+        self.current_image = None
+        self.current_original_image = None
+        self.current_image_path = None
+        if self._prefetcher is not None:
+            self._prefetcher.reset()
 
-    def _add_to_image_cache(self, key, image):
-        """Aggiunge un'immagine alla cache"""
-        if len(self._image_cache) >= self._max_cache_size:
-            # Rimuovi l'elemento più vecchio
-            self._image_cache.pop(next(iter(self._image_cache)))
-        self._image_cache[key] = image
-
-    def _get_from_image_cache(self, key):
-        """Recupera un'immagine dalla cache"""
-        return self._image_cache.get(key)
+    def _on_thumbnail_evicted(self, path):
+        """Permette di rigenerare in background una miniatura uscita dalla cache"""
+        if self._prefetcher is not None:
+            self._prefetcher.forget(path)
 
     def load_data_from_file(self):
         """Carica dati dal file di salvataggio se esiste, altrimenti usa i default"""
@@ -275,6 +866,11 @@ class FormApplication:
             # Carica il percorso del modello se presente
             if "model_path" in saved_data:
                 self.model_path_var.set(saved_data["model_path"])
+            
+            if saved_data.get("max_size_mb"):
+                self.max_size_var.set(saved_data["max_size_mb"])
+            
+            self.archive_originals_var.set(bool(saved_data.get("archive_originals", False)))
                 
         except Exception as e:
             messagebox.showwarning(
@@ -308,6 +904,13 @@ class FormApplication:
             if model_path != self.default_model_path:
                 save_data["model_path"] = model_path
             
+            # Salva la dimensione massima del documento se impostata
+            if self.max_size_var.get().strip():
+                save_data["max_size_mb"] = self.max_size_var.get().strip()
+            
+            if self.archive_originals_var.get():
+                save_data["archive_originals"] = True
+            
             # Salva i dati su file
             with open(self.save_file, 'w', encoding='utf-8') as f:
                 json.dump(save_data, f, ensure_ascii=False, indent=4)
@@ -318,6 +921,195 @@ class FormApplication:
                 f"Impossibile salvare i dati nel file {self.save_file}:\n{str(e)}"
             )
 
+    def _project_state(self):
+        """Serializza lo stato corrente del form e delle immagini"""
+        return project_file.serialize_project(self.collect_form_data(), self.images, self.model_path_var.get())
+    
+    def _set_project_path(self, project_path):
+        """Imposta il progetto su cui lavorano autosalvataggio e miniature salvate"""
+        self._autosaver.flush()
+        self.project_path = project_path
+        self._autosaver = project_file.ProjectAutosaver(project_path or project_file.session_path())
+        if self._prefetcher is not None:
+            self._prefetcher.project_path = self._autosaver.project_path
+        title = "Verbale di ispezione"
+        if project_path:
+            title += f" - {os.path.basename(project_path)}"
+        self.root.title(title)
+    
+    def _autosave(self):
+        """Salva il progetto se è cambiato qualcosa e riprogramma il salvataggio successivo"""
+        self._autosave_job = None
+        try:
+            self._save_project_state()
+        except Exception as e:
+            print(f"Errore durante l'autosalvataggio: {str(e)}")
+        self._autosave_job = self.root.after(AUTOSAVE_INTERVAL_MS, self._autosave)
+    
+    def _save_project_state(self):
+        """Scrive progetto e miniature nuove tramite l'autosalvataggio incrementale"""
+        # Prima della costruzione del tab Dati i campi non sono ancora disponibili
+        if not hasattr(self, 'form_frame'):
+            return False
+        thumbnails = []
+        for image_info in self.images:
+            thumb = self._image_cache.peek(image_info["path"])
+            if thumb is not None:
+                thumbnails.append((image_info["path"], thumb))
+        return self._autosaver.save(self._project_state(), thumbnails)
+    
+    def _on_close(self):
+        """Salva la sessione e chiude l'applicazione"""
+        try:
+            self._save_project_state()
+            self._autosaver.flush()
+        except Exception as e:
+            print(f"Errore durante il salvataggio alla chiusura: {str(e)}")
+        self.root.destroy()
+    
+    def _offer_session_restore(self):
+        """Chiede se riprendere la sessione autosalvata, se contiene immagini"""
+        session_file = project_file.session_path()
+        if not os.path.exists(session_file):
+            return
+        try:
+            project = project_file.load_project(session_file)
+        except Exception as e:
+            print(f"Sessione precedente non leggibile: {str(e)}")
+            return
+        if not project["images"]:
+            return
+        
+        if messagebox.askyesno("Sessione precedente",
+                               f"È disponibile la sessione precedente con {len(project['images'])} immagini.\n\n"
+                               "Vuoi ripristinarla?"):
+            self.apply_project(project, None)
+        else:
+            self._autosaver.reset()
+    
+    def open_project(self):
+        """Apre un file di progetto e ripristina form, immagini e miniature salvate"""
+        project_path = filedialog.askopenfilename(
+            title="Apri progetto",
+            filetypes=[("Progetto verbale", "*" + project_file.PROJECT_EXTENSION), ("Tutti i file", "*.*")]
+        )
+        if not project_path:
+            return
+        
+        try:
+            start_time = time.perf_counter()
+            project = project_file.load_project(project_path)
+            self.apply_project(project, project_path)
+            print(f"Progetto aperto in {time.perf_counter() - start_time:.3f} s: {project_path}")
+        except Exception as e:
+            messagebox.showerror("Errore", f"Impossibile aprire il progetto:\n{str(e)}")
+    
+    def save_project(self):
+        """Salva il progetto (form, immagini e miniature) in un file scelto dall'utente"""
+        project_path = filedialog.asksaveasfilename(
+            title="Salva progetto",
+            initialfile=os.path.basename(self.project_path) if self.project_path else "",
+            defaultextension=project_file.PROJECT_EXTENSION,
+            filetypes=[("Progetto verbale", "*" + project_file.PROJECT_EXTENSION)]
+        )
+        if not project_path:
+            return
+        
+        try:
+            # Le miniature già salvate vengono copiate, le altre si scrivono dalla cache
+            previous_dir = project_file.thumbnail_dir(self._autosaver.project_path)
+            target_dir = project_file.thumbnail_dir(project_path)
+            if os.path.isdir(previous_dir) and os.path.normcase(previous_dir) != os.path.normcase(target_dir):
+                os.makedirs(target_dir, exist_ok=True)
+                for name in os.listdir(previous_dir):
+                    if not os.path.exists(os.path.join(target_dir, name)):
+                        shutil.copyfile(os.path.join(previous_dir, name), os.path.join(target_dir, name))
+            
+            self._set_project_path(project_path)
+            self._save_project_state()
+            messagebox.showinfo("Successo", f"Il progetto è stato salvato correttamente:\n{project_path}")
+        except Exception as e:
+            messagebox.showerror("Errore", f"Impossibile salvare il progetto:\n{str(e)}")
+    
+    def merge_documents(self):
+        """Unisce più verbali .docx già generati in un unico volume"""
+        paths = filedialog.askopenfilenames(
+            title="Seleziona i verbali da unire (nell'ordine del volume)",
+            filetypes=[("Word files", "*.docx")]
+        )
+        if not paths:
+            return
+        output_path = filedialog.asksaveasfilename(
+            title="Salva volume",
+            defaultextension=".docx",
+            filetypes=[("Word files", "*.docx")]
+        )
+        if not output_path:
+            return
+        
+        # I verbali vengono uniti nell'ordine restituito dalla finestra di selezione
+        paths = list(paths)
+        
+        def merge_in_thread():
+            report = {}
+            try:
+                import docx_merge
+                docx_merge.merge_documents(paths, output_path, report)
+                message = (f"Il volume è stato creato correttamente:\n{output_path}\n\n"
+                           f"{report['documents']} verbali, {report['output_size'] / 1048576:.2f} MB")
+                self.root.after(0, lambda: messagebox.showinfo("Successo", message))
+            except Exception as e:
+                error_message = str(e)
+                self.root.after(0, lambda: messagebox.showerror("Errore", f"Impossibile unire i verbali:\n{error_message}"))
+        
+        threading.Thread(target=merge_in_thread, name="merge-documents", daemon=True).start()
+    
+    def apply_project(self, project, project_path):
+        """
+        Ripristina nel form lo stato di un progetto.
+
+        Le immagini passano dall'importazione a blocchi e le miniature vengono lette dalla
+        cartella del progetto, senza decodificare di nuovo gli originali.
+        """
+        self._reset_images()
+        self._set_project_path(project_path)
+        
+        if not hasattr(self, 'form_frame'):
+            self.initialize_dati_tab()
+        self.apply_form_data(project["fields"])
+        if project.get("model_path"):
+            self.model_path_var.set(project["model_path"])
+        
+        self.import_image_entries(project["images"])
+        self._autosaver.mark_saved(self._project_state())
+    
+    def apply_form_data(self, data):
+        """Imposta i valori dei campi e delle caselle di controllo (inverso di collect_form_data)"""
+        for field, widget in self.fields.items():
+            if field not in data:
+                continue
+            value = data[field]
+            if isinstance(widget, dict) and 'widget' in widget:  # Text con formattazione
+                text_widget = widget['widget']
+                text_widget.delete('1.0', tk.END)
+                for segment, tags in parse_formatted_text(str(value)):
+                    text_widget.insert(tk.END, segment, tags)
+            elif hasattr(widget, 'set_date'):  # DateEntry widget
+                try:
+                    widget.set_date(datetime.datetime.strptime(value, '%d/%m/%Y'))
+                except (ValueError, TypeError):
+                    print(f"Data non valida per {field}: {value}")
+            elif isinstance(widget, tk.Text):  # Text widget semplice
+                widget.delete('1.0', tk.END)
+                widget.insert('1.0', str(value))
+            else:  # Entry e altri widget standard
+                widget.delete(0, tk.END)
+                widget.insert(0, str(value))
+        
+        for field, var in self.checkboxes.items():
+            if isinstance(data.get(field), bool):
+                var.set(data[field])
+    
     def create_button_method(self, parent, text, command, **kwargs):
         """Crea un pulsante con stile Material Design"""
         is_primary = kwargs.pop('is_primary', True)
@@ -366,7 +1158,10 @@ class FormApplication:
                     text_widget.insert("1.0", str(self.default_values[field]))
             else:  # Entry e altri widget standard
                 if field in self.default_values:
-                    widget.insert(0, str(self.default_values[field]))
+                    value = self.default_values[field]
+                    if isinstance(value, datetime.datetime):
+                        value = value.strftime('%d/%m/%Y')
+                    widget.insert(0, str(value))
         
         # Imposta i valori predefiniti per i checkbox
         for field, var in self.checkboxes.items():
@@ -391,22 +1186,228 @@ class FormApplication:
             self.default_images_path = os.path.dirname(file_paths[0])
             
             # Aggiungi le nuove immagini alla lista
-            for path in file_paths:
-                # Verifica se l'immagine è già stata aggiunta
-                if not any(img["path"] == path for img in self.images):
-                    self.images.append({
-                        "path": path,
-                        "description": "",
-                        "rotation": 0,
-                        "figure_number": str(len(self.images) + 1)  # Numero figura automatico
-                    })
-                    filename = os.path.basename(path)
-                    self.images_listbox.insert(tk.END, filename)
-        
-        # Se è la prima immagine, selezionala
-        if len(self.images) == 1:
+            self.import_image_entries({"path": path} for path in file_paths)
+    
+    def add_image_folder(self):
+        """Importa tutte le immagini di una cartella (e sottocartelle) ordinate per data di scatto"""
+        folder = filedialog.askdirectory(
+            title="Seleziona Cartella Immagini",
+            initialdir=self.default_images_path
+        )
+        if not folder:
+            return
+        self.default_images_path = folder
+        self.import_status_label.configure(text="Lettura della cartella in corso...")
+        
+        def scan_in_thread():
+            start_time = time.perf_counter()
+            try:
+                ensure_heavy_imports("PIL")
+                entries = scan_image_folder(folder)
+            except Exception as e:
+                self.root.after(0, self._finish_folder_import, folder, None, str(e))
+                return
+            print(f"Lettura header di {len(entries)} immagini in {time.perf_counter() - start_time:.2f} s")
+            self.root.after(0, self._finish_folder_import, folder, entries, None)
+        
+        threading.Thread(target=scan_in_thread, name="folder-import", daemon=True).start()
+    
+    def _finish_folder_import(self, folder, entries, error_message):
+        """Aggiunge (nel thread della GUI) le immagini lette da una cartella"""
+        self.import_status_label.configure(text="")
+        if error_message:
+            messagebox.showerror("Errore", f"Impossibile leggere la cartella:\n{error_message}")
+            return
+        if not entries:
+            messagebox.showinfo("Informazione", f"Nessuna immagine trovata in:\n{folder}")
+            return
+        
+        # I numeri figura seguono l'ordine di scatto; la rotazione resta 0 perché
+        # l'orientamento EXIF viene già applicato in anteprima e nel documento
+        # (le immagini con header non leggibile arrivano già segnalate con "error")
+        self.import_image_entries(entries)
+    
+    def import_image_entries(self, entries):
+        """
+        Aggiunge immagini al modello e ne programma l'inserimento nella lista a blocchi.
+
+        I duplicati si scartano con l'indice dei percorsi; le righe vengono inserite nella
+        listbox con una chiamata per blocco, programmata con after, così l'interfaccia
+        continua a ridisegnarsi durante l'importazione di grandi selezioni.
+        """
+        new_paths = []
+        for entry in entries:
+            path = entry["path"]
+            # Verifica se l'immagine è già stata aggiunta
+            if path in self._image_paths:
+                continue
+            self._image_paths.add(path)
+            
+            image_info = {
+                "path": path,
+                "description": "",
+                "rotation": 0,
+                "figure_number": str(len(self.images) + 1)  # Numero figura automatico
+            }
+            image_info.update((key, entry[key]) for key in IMAGE_ENTRY_KEYS if key in entry)
+            self.images.append(image_info)
+            self._pending_list_rows.append(os.path.basename(path))
+            new_paths.append(path)
+        
+        if not new_paths:
+            return
+        
+        self._import_total += len(new_paths)
+        if self._import_job is None:
+            self._import_job = self.root.after(0, self._insert_pending_list_rows)
+        
+        # Avvia subito la generazione delle miniature, prima quelle visibili
+        self._prefetch_thumbnails(new_paths)
+    
+    def _insert_pending_list_rows(self):
+        """Inserisce nella lista un blocco di righe in attesa e riprogramma il blocco successivo"""
+        self._import_job = None
+        if not hasattr(self, 'images_listbox'):
+            return
+        
+        chunk = [self._pending_list_rows.popleft()
+                 for _ in range(min(IMPORT_CHUNK_SIZE, len(self._pending_list_rows)))]
+        first_index = self.images_listbox.size()
+        if chunk:
+            self.images_listbox.insert(tk.END, *chunk)
+        
+        # Righe già segnalate come non leggibili prima di essere inserite
+        for index in range(first_index, first_index + len(chunk)):
+            if self.images[index].get("error"):
+                self.images_listbox.itemconfig(index, fg=self.colors['error'])
+        
+        # Se la lista era vuota, seleziona la prima immagine
+        if first_index == 0 and chunk:
             self.images_listbox.selection_set(0)
             self.on_image_select(None)
+        
+        self._import_done += len(chunk)
+        self._refresh_gallery()
+        if self._pending_list_rows:
+            self.import_status_label.configure(text=f"Importazione: {self._import_done}/{self._import_total}")
+            self._import_job = self.root.after(1, self._insert_pending_list_rows)
+        else:
+            if self._import_total > IMPORT_CHUNK_SIZE:
+                self.import_status_label.configure(text=f"Importate {self._import_done} immagini")
+                self.root.after(3000, lambda: self.import_status_label.configure(text=""))
+            self._import_done = 0
+            self._import_total = 0
+    
+    def _cancel_pending_import(self):
+        """Interrompe l'inserimento a blocchi in corso"""
+        if self._import_job is not None:
+            self.root.after_cancel(self._import_job)
+            self._import_job = None
+        self._pending_list_rows.clear()
+        self._import_done = 0
+        self._import_total = 0
+    
+    def _get_prefetcher(self):
+        """Crea il pool di generazione delle miniature al primo utilizzo"""
+        if self._prefetcher is None:
+            self._prefetcher = ThumbnailPrefetcher(self.root, self._on_thumbnail_ready, self._on_thumbnail_error)
+            self._prefetcher.project_path = self._autosaver.project_path
+        return self._prefetcher
+    
+    def _visible_image_indices(self):
+        """Restituisce gli indici delle righe attualmente visibili nella lista immagini"""
+        if not hasattr(self, 'images_listbox') or not self.images:
+            return range(0)
+        first = self.images_listbox.nearest(0)
+        last = self.images_listbox.nearest(self.images_listbox.winfo_height())
+        return range(max(0, first), min(len(self.images), last + 1))
+    
+    def _prefetch_thumbnails(self, paths):
+        """Accoda le miniature mancanti dando precedenza alle righe visibili"""
+        prefetcher = self._get_prefetcher()
+        # In background si generano solo le miniature che stanno nella cache,
+        # le altre verranno richieste quando diventano visibili
+        budget = self._image_cache.capacity_estimate() - len(self._image_cache)
+        for path in paths:
+            if budget <= 0:
+                break
+            if path not in self._image_cache:
+                prefetcher.submit(path, ThumbnailPrefetcher.PRIORITY_BACKGROUND)
+                budget -= 1
+        self._prioritize_visible_thumbnails()
+    
+    def _prioritize_visible_thumbnails(self):
+        """Rende prioritarie le miniature delle righe visibili"""
+        if self._prefetcher is None:
+            return
+        paths = [self.images[i]["path"] for i in self._visible_image_indices()]
+        self._prefetcher.prioritize([p for p in paths if p not in self._image_cache])
+    
+    def _on_images_list_scroll(self, first, last):
+        """Aggiorna la scrollbar e la priorità delle miniature quando la lista scorre"""
+        self.images_list_scrollbar.set(first, last)
+        self._prioritize_visible_thumbnails()
+    
+    def _on_thumbnail_ready(self, path, thumb):
+        """Riceve (nel thread della GUI) una miniatura generata in background"""
+        # Immagine rimossa (o lista svuotata) mentre la miniatura era in lavorazione
+        if path not in self._image_paths:
+            return
+        self._image_cache.put(path, thumb)
+        if self.thumbnail_gallery is not None:
+            self.thumbnail_gallery.on_thumbnail_ready(path)
+        if path in self._preview_missing and self.current_tab == "Anteprima":
+            self.schedule_preview_refresh()
+        
+        # Se l'immagine è quella selezionata e l'anteprima non è ancora visibile, mostrala
+        if (self.selected_image_index is not None
+                and self.selected_image_index < len(self.images)
+                and self.images[self.selected_image_index]["path"] == path
+                and self.current_original_image is None):
+            self.load_image_preview(path, self.current_rotation)
+    
+    def _on_thumbnail_error(self, path, message):
+        """Segnala subito nella lista un'immagine che non può essere decodificata"""
+        print(f"Immagine non leggibile: {path} ({message})")
+        for index, img_info in enumerate(self.images):
+            if img_info["path"] == path:
+                img_info["error"] = message
+                if hasattr(self, 'images_listbox') and index < self.images_listbox.size():
+                    self.images_listbox.itemconfig(index, fg=self.colors['error'])
+                if index == self.selected_image_index:
+                    self.preview_label.config(image="", text=f"Errore nel caricamento dell'immagine:\n{message}")
+        self._refresh_gallery()
+    
+    def select_image(self, index):
+        """Seleziona un'immagine (es. dalla griglia delle miniature) sincronizzando la lista"""
+        self._flush_list_refresh()
+        self.images_listbox.selection_clear(0, tk.END)
+        self.images_listbox.selection_set(index)
+        self.images_listbox.see(index)
+        self.on_image_select(None)
+    
+    def _refresh_gallery(self):
+        """Ridisegna la griglia delle miniature se è visibile"""
+        if self.thumbnail_gallery is not None and self.thumbnail_gallery.is_visible():
+            self.thumbnail_gallery.refresh()
+    
+    def toggle_gallery(self):
+        """Alterna la vista a elenco e la griglia delle miniature"""
+        if self.thumbnail_gallery is None:
+            self.thumbnail_gallery = ThumbnailGallery(self.images_list_container, self)
+        
+        if self.thumbnail_gallery.is_visible():
+            self.thumbnail_gallery.frame.pack_forget()
+            self.images_list_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+            self.images_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self.gallery_button.configure(text="Vista Miniature")
+        else:
+            self.images_listbox.pack_forget()
+            self.images_list_scrollbar.pack_forget()
+            self.thumbnail_gallery.frame.pack(fill=tk.BOTH, expand=True, padx=1, pady=1)
+            self.gallery_button.configure(text="Vista Elenco")
+            self.thumbnail_gallery.set_selection(self.selected_image_index)
+            self.root.after_idle(self.thumbnail_gallery.refresh)
     
     def on_image_select(self, event):
         """Gestisce l'evento di selezione di un'immagine dalla lista"""
@@ -417,6 +1418,16 @@ class FormApplication:
             
         index = selection[0]
         self.selected_image_index = index
+        if self.thumbnail_gallery is not None:
+            self.thumbnail_gallery.set_selection(index)
+        
+        # La selezionata e le vicine passano in testa alla coda delle miniature
+        if self._prefetcher is not None:
+            neighbors = range(max(0, index - 2), min(len(self.images), index + 3))
+            self._prefetcher.submit(self.images[index]["path"], ThumbnailPrefetcher.PRIORITY_SELECTED)
+            self._prefetcher.prioritize([self.images[i]["path"] for i in neighbors
+                                         if self.images[i]["path"] not in self._image_cache])
+        
         self.load_image_details(index)
     
     def load_image_details(self, index):
@@ -446,48 +1457,28 @@ class FormApplication:
     def load_image_preview(self, image_path, rotation=0):
         """Carica l'anteprima di un'immagine con rotazione"""
         try:
-            # Controlla se l'immagine è in cache
-            cache_key = f"{image_path}_{rotation}"
-            cached_image = self._get_from_image_cache(cache_key)
-            if cached_image:
-                self.current_image = cached_image
-                self.preview_label.config(image=self.current_image, text="")
-                return
-
-            # Carica l'immagine originale
-            img = Image.open(image_path)
+            ensure_heavy_imports("PIL")
             
-            # Applica la correzione automatica dell'orientamento EXIF
-            try:
-                img = ImageOps.exif_transpose(img)
-            except Exception:
-                pass # Ignora errori EXIF
-
-            # Salva una copia dell'immagine corretta per le rotazioni manuali
-            self.current_original_image = img.copy()
-
-            # Applica la rotazione manuale se presente
-            if rotation != 0:
-                img = img.rotate(rotation, expand=True)
+            # Miniatura orientata dalla cache (anche generata in background), altrimenti
+            # decodificata direttamente a circa 300 px
+            img = self._image_cache.get(image_path)
+            if img is None and image_path == self.current_image_path:
+                # Miniatura uscita dalla cache ma ancora in uso come base per le rotazioni
+                img = self.current_original_image
+            if img is None:
+                img = create_thumbnail(image_path, max_size=(300, 300))
+            if image_path not in self._image_cache:
+                self._image_cache.put(image_path, img)
 
-            # Ottimizza l'immagine per l'anteprima
-            img_preview = optimize_image(img.copy(), max_size=(300, 300), quality=85) # Passa una copia
+            # La miniatura (non l'originale a piena risoluzione) è la base per le rotazioni manuali
+            self.current_original_image = img
+            self.current_image_path = image_path
 
-            # Crea uno sfondo bianco per l'immagine
-            bg = Image.new('RGB', (300, 300), (255, 255, 255))
+            # La variante ruotata si deriva dalla miniatura base senza nuove decodifiche
+            img = rotate_thumbnail(img, rotation)
 
-            # Calcola la posizione per centrare l'immagine ottimizzata
-            x = (300 - img_preview.width) // 2
-            y = (300 - img_preview.height) // 2
-
-            # Incolla l'immagine ottimizzata sul background
-            bg.paste(img_preview, (x, y))
-
-            # Converti in PhotoImage per Tkinter
-            self.current_image = ImageTk.PhotoImage(bg)
-
-            # Salva in cache
-            self._add_to_image_cache(cache_key, self.current_image)
+            # Centra la miniatura su uno sfondo bianco e converti in PhotoImage per Tkinter
+            self.current_image = ImageTk.PhotoImage(compose_preview(img, 300))
 
             # Visualizza l'anteprima
             self.preview_label.config(image=self.current_image, text="")
@@ -503,9 +1494,10 @@ class FormApplication:
         # Aggiorna l'angolo di rotazione (aggiungi 90 gradi per rotazione antioraria)
         self.current_rotation = (self.current_rotation + 90) % 360
         
-        # Aggiorna l'anteprima caricando l'immagine originale e applicando la nuova rotazione totale
+        # L'anteprima ruotata si deriva dalla miniatura in cache: l'originale a piena
+        # risoluzione viene elaborato solo in fase di esportazione
         image_path = self.images[self.selected_image_index]["path"]
-        self.load_image_preview_from_original(self.current_original_image, self.current_rotation)
+        self.load_image_preview(image_path, self.current_rotation)
         
         # Salva automaticamente i dettagli (che include l'angolo di rotazione)
         self.auto_save_details()
@@ -518,94 +1510,73 @@ class FormApplication:
         # Aggiorna l'angolo di rotazione (sottrai 90 gradi per rotazione oraria)
         self.current_rotation = (self.current_rotation - 90) % 360
         
-        # Aggiorna l'anteprima caricando l'immagine originale e applicando la nuova rotazione totale
+        # L'anteprima ruotata si deriva dalla miniatura in cache: l'originale a piena
+        # risoluzione viene elaborato solo in fase di esportazione
         image_path = self.images[self.selected_image_index]["path"]
-        self.load_image_preview_from_original(self.current_original_image, self.current_rotation)
+        self.load_image_preview(image_path, self.current_rotation)
         
         # Salva automaticamente i dettagli (che include l'angolo di rotazione)
         self.auto_save_details()
     
-    def load_image_preview_from_original(self, original_img, rotation=0, cache_key=None):
-        """Genera e visualizza l'anteprima da un'immagine originale con una data rotazione"""
-        try:
-            img = original_img.copy() # Lavora su una copia
-
-            # Applica la rotazione manuale
-            if rotation != 0:
-                img = img.rotate(rotation, expand=True)
-
-            # Ottimizza l'immagine per l'anteprima
-            img_preview = optimize_image(img, max_size=(300, 300), quality=85) # Passa l'immagine ruotata e copiata
-
-            # Crea uno sfondo bianco per l'immagine
-            bg = Image.new('RGB', (300, 300), (255, 255, 255))
-
-            # Calcola la posizione per centrare l'immagine ottimizzata
-            x = (300 - img_preview.width) // 2
-            y = (300 - img_preview.height) // 2
-
-            # Incolla l'immagine ottimizzata sul background
-            bg.paste(img_preview, (x, y))
-
-            # Converti in PhotoImage per Tkinter
-            preview_photo = ImageTk.PhotoImage(bg)
-
-            # Salva in cache se la chiave è fornita
-            if cache_key:
-                self._add_to_image_cache(cache_key, preview_photo)
-
-            # Visualizza l'anteprima
-            self.current_image = preview_photo # Mantieni un riferimento
-            self.preview_label.config(image=self.current_image, text="")
-
-        except Exception as e:
-            self.preview_label.config(image="", text=f"Errore nella generazione anteprima:\n{str(e)}")
-    
     def save_image_details(self):
         """Salva i dettagli dell'immagine corrente"""
         if self.selected_image_index is not None and self.selected_image_index < len(self.images):
-            # Ottieni i dettagli dai widget
-            caption = self.caption_text.get("1.0", tk.END).strip()
-            figure_number = self.figure_number_entry.get().strip()
-            
-            # Stampa di debug prima del salvataggio
-            print(f"\nSalvataggio manuale dettagli immagine #{self.selected_image_index}:")
-            print(f"Didascalia da salvare: '{caption}'")
-            print(f"Numero figura da salvare: '{figure_number}'")
-            print(f"Rotazione da salvare: {self.current_rotation}")
-            
-            # Aggiorna i dati dell'immagine selezionata
-            self.images[self.selected_image_index]["description"] = caption
-            self.images[self.selected_image_index]["figure_number"] = figure_number
-            self.images[self.selected_image_index]["rotation"] = getattr(self, 'current_rotation', 0)
-            
-            # Verifica che le informazioni siano state correttamente salvate
-            saved_caption = self.images[self.selected_image_index].get("description", "")
-            if saved_caption != caption:
-                print(f"ERRORE: La didascalia non è stata salvata correttamente!")
-                print(f"Valore nel dizionario: '{saved_caption}'")
-                print(f"Valore inserito: '{caption}'")
-                # Riprova a salvare la didascalia
-                self.images[self.selected_image_index]["description"] = caption
+            # Aggiorna il modello e la lista senza attendere il ridisegno ritardato
+            self.auto_save_details()
+            self._flush_list_refresh()
             
-            # Stampa di debug dopo il salvataggio
-            print(f"Didascalia salvata: '{self.images[self.selected_image_index].get('description', '')}'")
-            
-            # Aggiorna l'elemento nella listbox per riflettere la nuova descrizione
-            display_text = f"Fig. {figure_number}" if figure_number else "Figura"
-            display_text += f": {caption[:25]}..." if len(caption) > 25 else f": {caption}"
-            
-            # Aggiungi info sulla rotazione
-            rotation = getattr(self, 'current_rotation', 0)
-            if rotation != 0:
-                display_text += f" (Rotazione: {rotation}°)"
-            
-            self.images_listbox.delete(self.selected_image_index)
-            self.images_listbox.insert(self.selected_image_index, display_text)
-            self.images_listbox.selection_set(self.selected_image_index)
-            
-            # Mostra conferma
-            messagebox.showinfo("Informazione", "Dettagli dell'immagine salvati con successo.")
+            # Conferma non modale, che si cancella da sola
+            self.details_status_label.configure(text="Dettagli salvati")
+            if self._details_status_job is not None:
+                self.root.after_cancel(self._details_status_job)
+            self._details_status_job = self.root.after(2000, lambda: self.details_status_label.configure(text=""))
+    
+    def _image_display_text(self, image_info):
+        """Testo mostrato nella lista immagini per un'immagine con didascalia"""
+        caption = image_info.get("description", "")
+        figure_number = image_info.get("figure_number", "")
+        display_text = f"Fig. {figure_number}" if figure_number else "Figura"
+        display_text += f": {caption[:25]}..." if len(caption) > 25 else f": {caption}"
+        
+        # Aggiungi info sulla rotazione
+        rotation = image_info.get("rotation", 0)
+        if rotation != 0:
+            display_text += f" (Rotazione: {rotation}°)"
+        return display_text
+    
+    def _schedule_list_refresh(self, index):
+        """Programma l'aggiornamento della riga nella lista dopo una pausa nella digitazione"""
+        self._pending_list_refresh[index] = self.images[index]
+        if self._list_refresh_job is not None:
+            self.root.after_cancel(self._list_refresh_job)
+        self._list_refresh_job = self.root.after(LIST_REFRESH_DELAY_MS, self._flush_list_refresh)
+    
+    def _flush_list_refresh(self):
+        """Aggiorna in un solo passaggio le righe modificate mantenendo selezione e scorrimento"""
+        if self._list_refresh_job is not None:
+            self.root.after_cancel(self._list_refresh_job)
+            self._list_refresh_job = None
+        if not self._pending_list_refresh or not hasattr(self, 'images_listbox'):
+            self._pending_list_refresh.clear()
+            return
+        
+        labels = list(self.images_listbox.get(0, tk.END))
+        changed = False
+        for index, image_info in self._pending_list_refresh.items():
+            # L'immagine potrebbe essere stata rimossa nel frattempo
+            if index >= len(labels) or index >= len(self.images) or self.images[index] is not image_info:
+                continue
+            display_text = self._image_display_text(image_info)
+            if labels[index] != display_text:
+                labels[index] = display_text
+                changed = True
+        self._pending_list_refresh.clear()
+        
+        # La lista è legata a una variabile Tcl: sostituirne il contenuto non tocca la selezione,
+        # i colori delle righe e la posizione di scorrimento
+        if changed:
+            self.images_listvar.set(tuple(labels))
+            self._refresh_gallery()
     
     def enable_details_controls(self):
         """Abilita i controlli per la modifica dei dettagli dell'immagine"""
@@ -614,18 +1585,25 @@ class FormApplication:
     
     def disable_details_controls(self):
         """Disabilita i controlli per la modifica dei dettagli dell'immagine"""
-        self.caption_text.delete('1.0', tk.END)
-        self.figure_number_entry.delete(0, tk.END)
-        
-        # Crea un'immagine vuota per mostrare invece della X rossa
-        empty_img = Image.new('RGB', (300, 300), color=(240, 240, 240))
-        empty_photo = ImageTk.PhotoImage(empty_img)
-        self.preview_label.config(image=empty_photo)
-        self.preview_label.image = empty_photo  # Mantieni un riferimento
+        # I widget esistono solo dopo la prima apertura del tab Immagini
+        if hasattr(self, 'preview_label'):
+            self.caption_text.delete('1.0', tk.END)
+            self.figure_number_entry.delete(0, tk.END)
+            
+            # Crea un'immagine vuota per mostrare invece della X rossa
+            try:
+                ensure_heavy_imports("PIL")
+                empty_img = Image.new('RGB', (300, 300), color=(240, 240, 240))
+                empty_photo = ImageTk.PhotoImage(empty_img)
+                self.preview_label.config(image=empty_photo)
+                self.preview_label.image = empty_photo  # Mantieni un riferimento
+            except ImportError:
+                self.preview_label.config(image="")
         
         self.selected_image_index = None
         self.current_image = None
         self.current_original_image = None
+        self.current_image_path = None
         self.current_rotation = 0
     
     def remove_image(self):
@@ -633,7 +1611,10 @@ class FormApplication:
         if self.images_listbox.curselection():
             index = self.images_listbox.curselection()[0]
             self.images_listbox.delete(index)
-            self.images.pop(index)
+            removed = self.images.pop(index)
+            self._image_paths.discard(removed["path"])
+            self._image_cache.discard(removed["path"])
+            self._refresh_gallery()
             
             # Se ci sono ancora immagini, seleziona quella successiva
             if self.images:
@@ -646,15 +1627,18 @@ class FormApplication:
     
     def browse_model(self):
         """Apre il file dialog per selezionare il modello Word"""
-        initial_dir = os.path.dirname(self.default_model_path)
+        # Se la cartella di rete non risponde si apre quella del mirror locale
+        current_model = self.model_path_var.get() or self.default_model_path
+        initial_dir = template_cache.browse_directory(current_model)
         file_path = filedialog.askopenfilename(
             title="Seleziona Modello Word",
             initialdir=initial_dir,
-            initialfile=os.path.basename(self.default_model_path),
+            initialfile=os.path.basename(current_model),
             filetypes=[("Word files", "*.docx"), ("All files", "*.*")]
         )
         if file_path:
             self.model_path_var.set(file_path)
+            template_cache.refresh_in_background(file_path)
         elif not self.model_path_var.get():
             # Se non è stato selezionato nulla e non c'è già un percorso impostato,
             # usa il percorso predefinito
@@ -678,10 +1662,11 @@ class FormApplication:
             var.set(False)
                 
         # Pulisci la lista immagini e la cache
-        self.images = []
-        self.images_listbox.delete(0, tk.END)
-        self.clear_image_preview()
-        self._clear_image_cache()
+        self._reset_images()
+        
+        # Si riparte con una nuova sessione (le miniature della precedente non servono più)
+        self._set_project_path(None)
+        self._autosaver.reset()
         
         # Carica nuovamente i valori predefiniti
         self.set_default_values()
@@ -689,9 +1674,28 @@ class FormApplication:
         # Torna alla prima tab
         self.select_tab("Dati")
     
-    def generate_document(self):
-        """Raccoglie i dati dal form e genera il documento"""
-        # Raccolta dati
+    def _reset_images(self):
+        """Svuota lista immagini, anteprima e cache (il tab Immagini potrebbe non essere ancora costruito)"""
+        self._cancel_pending_import()
+        self._pending_list_refresh.clear()
+        self.images = []
+        self._image_paths.clear()
+        self.selected_image_index = None
+        if hasattr(self, 'images_listbox'):
+            self.images_listbox.delete(0, tk.END)
+        self._refresh_gallery()
+        self.clear_image_preview()
+        self._clear_image_cache()
+    
+    def collect_form_data(self):
+        """
+        Raccoglie i valori dei campi e delle caselle di controllo.
+
+        Il testo dei campi formattati contiene i marcatori <b>, <i>, <u>.
+
+        Returns:
+            dict: Valori indicizzati per nome del campo
+        """
         data = {}
         
         # Raccogli i dati dai campi
@@ -751,13 +1755,45 @@ class FormApplication:
         
         # Raccogli gli stati dei checkbox
         data.update({field: var.get() for field, var in self.checkboxes.items()})
+        return data
+    
+    def segment_formatted_fields(self, data):
+        """
+        Converte i campi formattati di collect_form_data in liste di coppie (testo, tag),
+        il formato usato dall'anteprima e dall'esportazione PDF.
+        """
+        data = dict(data)
+        for field, widget in self.fields.items():
+            if isinstance(widget, dict) and 'widget' in widget and field in data:
+                data[field] = parse_formatted_text(data[field])
+        return data
+    
+    def generate_document(self, export_all=False):
+        """
+        Raccoglie i dati dal form e genera il documento.
+
+        Con export_all produce insieme il .docx, il PDF e lo zip delle foto accanto al
+        percorso scelto, codificando le foto una sola volta.
+        """
+        # Raccolta dati
+        data = self.collect_form_data()
         
-        # Verifica del modello
-        template_path = self.model_path_var.get()
-        if not template_path or not os.path.exists(template_path):
+        # Verifica del modello (i modelli di rete vengono letti dal mirror locale)
+        template_path = template_cache.resolve_template(self.model_path_var.get())
+        if not template_path:
             messagebox.showerror("Errore", "Seleziona un modello Word valido.")
             return
         
+        # Le immagini segnalate come non leggibili all'importazione verrebbero sostituite da un errore
+        unreadable = [f"{i+1}: {os.path.basename(img['path'])}" for i, img in enumerate(self.images) if img.get("error")]
+        if unreadable:
+            result = messagebox.askquestion("Attenzione",
+                              "Le seguenti immagini non sono leggibili:\n\n" +
+                              "\n".join(unreadable) +
+                              "\n\nVuoi continuare comunque?")
+            if result.lower() != "yes":
+                return
+        
         # Verifica che le immagini abbiano descrizioni
         missing_descriptions = []
         for i, img in enumerate(self.images):
@@ -774,25 +1810,41 @@ class FormApplication:
                 return
         
         # Selezione del percorso di output
-        output_path = filedialog.asksaveasfilename(
-            title="Salva documento generato",
-            defaultextension=".docx",
-            filetypes=[("Word files", "*.docx")]
-        )
+        if export_all:
+            output_path = filedialog.asksaveasfilename(
+                title="Salva verbale (Word, PDF e zip delle foto)",
+                defaultextension=".docx",
+                filetypes=[("Word files", "*.docx")]
+            )
+        else:
+            output_path = filedialog.asksaveasfilename(
+                title="Salva documento generato",
+                defaultextension=".docx",
+                filetypes=[("Word files", "*.docx"), ("PDF files", "*.pdf")]
+            )
         
         if not output_path:
             return
         
-        # Processa le immagini in memoria
-        self.preprocess_images_for_document()
+        # Dimensione massima opzionale del documento
+        max_output_size = None
+        max_size_text = self.max_size_var.get().strip().replace(",", ".")
+        if max_size_text:
+            try:
+                max_output_size = int(float(max_size_text) * 1024 * 1024)
+                if max_output_size <= 0:
+                    raise ValueError(max_size_text)
+            except ValueError:
+                messagebox.showerror("Errore", "La dimensione massima deve essere un numero di MB maggiore di zero.")
+                return
         
         # Salva i dati nel file last.sav
         self.save_data_to_file(data)
         
         # Creazione della finestra di caricamento
-        self.show_loading_dialog(template_path, output_path, data)
+        self.show_loading_dialog(template_path, output_path, data, max_output_size, export_all)
     
-    def show_loading_dialog(self, template_path, output_path, data):
+    def show_loading_dialog(self, template_path, output_path, data, max_output_size=None, export_all=False):
         """Mostra una finestra di dialogo con indicatore di caricamento durante la generazione del documento"""
         # Crea una finestra di dialogo modale
         loading_window = ctk.CTkToplevel(self.root)
@@ -849,28 +1901,50 @@ class FormApplication:
         
         # Variabile per memorizzare gli errori nel thread
         error_message = [None]
+        report = {}
+        archive_originals = self.archive_originals_var.get() and bool(self.images)
         
         # Funzione da eseguire in un thread separato
         def generate_in_thread():
             try:
-                # Genera il documento
-                generate_document(template_path, output_path, data, self.images)
+                # Attende l'importazione in background del generatore
+                ensure_heavy_imports("docx_generator")
                 
-                # Rimuovi le immagini processate dalla memoria
-                for img_info in self.images:
-                    if "processed_image" in img_info:
-                        del img_info["processed_image"]
+                if export_all:
+                    # Word, PDF e zip delle foto con le stesse figure codificate una volta
+                    import export_pipeline
+                    export_pipeline.export_all(template_path, export_pipeline.default_outputs(output_path),
+                                               data, self.images, max_output_size=max_output_size, report=report,
+                                               include_originals=archive_originals)
+                elif output_path.lower().endswith(".pdf"):
+                    # Esportazione diretta in PDF, senza Word
+                    import pdf_exporter
+                    pdf_exporter.export_pdf(template_path, output_path, data, self.images,
+                                            max_output_size=max_output_size, report=report)
+                else:
+                    # Genera il documento: le foto vengono lette, orientate e ridimensionate
+                    # dal generatore in questo thread (o incorporate senza ricodifica)
+                    generate_document(template_path, output_path, data, self.images,
+                                      max_output_size=max_output_size, report=report)
+                
+                # Foto originali copiate a blocchi in uno zip accanto al documento
+                if archive_originals and not export_all:
+                    import export_pipeline
+                    report["archive"] = export_pipeline.write_photo_archive(
+                        export_pipeline.originals_archive_path(output_path), self.images, originals=True)
             except Exception as e:
                 # Memorizza l'errore per mostrarlo dopo
                 error_message[0] = str(e)
             finally:
                 # Chiudi la finestra di caricamento dal thread principale
-                self.root.after(100, lambda: self.finish_loading(loading_window, error_message[0], output_path))
+                self.root.after(100, lambda: self.finish_loading(loading_window, error_message[0], output_path,
+                                                                 report if max_output_size or export_all or report.get("incremental")
+                                                                 or report.get("archive") else None))
         
         # Avvia il thread
         threading.Thread(target=generate_in_thread, daemon=True).start()
     
-    def finish_loading(self, loading_window, error_message, output_path):
+    def finish_loading(self, loading_window, error_message, output_path, report=None):
         """Gestisce la chiusura della finestra di caricamento e mostra il risultato"""
         # Chiudi la finestra di caricamento
         loading_window.destroy()
@@ -878,78 +1952,42 @@ class FormApplication:
         # Mostra messaggio di errore o di successo
         if error_message:
             messagebox.showerror("Errore", f"Errore durante la generazione del documento:\n{error_message}")
-        else:
-            messagebox.showinfo("Successo", f"Il documento è stato generato correttamente:\n{output_path}")
-    
-    def preprocess_images_for_document(self):
-        """Prepara le immagini ruotate per il documento mantenendole in memoria"""
-        for i, img_info in enumerate(self.images):
-            try:
-                # Controlla se l'immagine è già stata processata
-                if "processed_image" in img_info:
-                    continue
-
-                # Carica l'immagine originale
-                img = Image.open(img_info["path"])
-                
-                # Applica la correzione automatica dell'orientamento EXIF
-                try:
-                    img = ImageOps.exif_transpose(img)
-                except Exception:
-                    pass # Ignora errori EXIF
-
-                # Applica la rotazione manuale se presente
-                rotation = img_info.get("rotation", 0)
-                if rotation != 0:
-                    img = img.rotate(rotation, expand=True)
-
-                # Ottimizza l'immagine per il documento
-                img_processed = optimize_image(img.copy(), max_size=(800, 800), quality=85) # Passa una copia
-
-                # Memorizza l'immagine processata
-                self.images[i]["processed_image"] = img_processed
-
-            except Exception as e:
-                messagebox.showwarning("Avviso", f"Impossibile processare l'immagine {os.path.basename(img_info['path'])}: {str(e)}")
+            return
+        
+        if report and "outputs" in report:
+            message = "Esportazione completata:\n" + "\n".join(
+                f"{os.path.basename(path)} ({os.path.getsize(path) / 1048576:.2f} MB)"
+                for path in report["outputs"].values() if os.path.exists(path))
+            messagebox.showinfo("Successo", message)
+            return
+        message = f"Il documento è stato generato correttamente:\n{output_path}"
+        if report and report.get("incremental"):
+            message += "\n\nAggiornati solo i campi e le didascalie modificati."
+        if report and report.get("archive"):
+            message += f"\n\nFoto originali: {os.path.basename(report['archive'])}"
+        if report and "output_size" in report:
+            message += f"\n\nDimensione: {report['output_size'] / 1048576:.2f} MB"
+            if "factor" in report:
+                message += f"\nScala immagini: {report['scale']:.0%}"
+                if report.get("photo_quality"):
+                    low, high = report["photo_quality"]
+                    message += f", qualità JPEG {low}" + (f"-{high}" if high != low else "")
+            if not report.get("within_limit", True):
+                message += "\n\nAttenzione: il documento supera la dimensione massima anche con la compressione massima."
+        messagebox.showinfo("Successo", message)
     
     def auto_save_details(self, *args):
         """Salva automaticamente i dettagli dell'immagine quando vengono modificati"""
-        if self.selected_image_index is None:
+        if self.selected_image_index is None or self.selected_image_index >= len(self.images):
             return
         
-        # Ottieni i valori dai controlli
-        caption = self.caption_text.get("1.0", tk.END).strip()
-        figure_number = self.figure_number_entry.get().strip()
-        
-        # Aggiorna l'immagine nella lista
-        self.images[self.selected_image_index]["description"] = caption
-        self.images[self.selected_image_index]["figure_number"] = figure_number
-        self.images[self.selected_image_index]["rotation"] = self.current_rotation
-        
-        # Stampa di debug per verificare il salvataggio
-        print(f"\nSalvataggio automatico dettagli immagine #{self.selected_image_index}:")
-        print(f"Didascalia: '{caption}'")
-        print(f"Numero figura: '{figure_number}'")
-        print(f"Rotazione: {self.current_rotation}")
-        
-        # Verifica che le informazioni siano state correttamente salvate
-        saved_caption = self.images[self.selected_image_index].get("description", "")
-        if saved_caption != caption:
-            print(f"ERRORE: La didascalia non è stata salvata correttamente!")
-            print(f"Valore nel dizionario: '{saved_caption}'")
-            print(f"Valore inserito: '{caption}'")
-            # Riprova a salvare la didascalia
-            self.images[self.selected_image_index]["description"] = caption
-        
-        # Aggiorna la listbox con il nuovo formato
-        display_text = f"Fig. {figure_number}" if figure_number else "Figura"
-        display_text += f": {caption[:25]}..." if len(caption) > 25 else f": {caption}"
-        
-        self.images_listbox.delete(self.selected_image_index)
-        self.images_listbox.insert(self.selected_image_index, display_text)
+        # Il modello si aggiorna subito, la lista viene ridisegnata dopo una pausa
+        image_info = self.images[self.selected_image_index]
+        image_info["description"] = self.caption_text.get("1.0", tk.END).strip()
+        image_info["figure_number"] = self.figure_number_entry.get().strip()
+        image_info["rotation"] = self.current_rotation
         
-        # Riseleziona l'elemento
-        self.images_listbox.selection_set(self.selected_image_index)
+        self._schedule_list_refresh(self.selected_image_index)
     
     def clear_image_preview(self):
         """Cancella l'anteprima dell'immagine e i campi correlati"""
@@ -1017,6 +2055,12 @@ class FormApplication:
             self.initialize_dati_tab()
         elif name == "Immagini" and not hasattr(self, 'images_list_frame'):
             self.initialize_immagini_tab()
+        
+        # L'anteprima si aggiorna ogni volta che viene mostrata
+        if name == "Anteprima":
+            if not hasattr(self, 'document_preview_canvas'):
+                self.initialize_anteprima_tab()
+            self.schedule_preview_refresh(0)
 
     def initialize_dati_tab(self):
         """Inizializza il contenuto del tab Dati"""
@@ -1064,6 +2108,9 @@ class FormApplication:
             if field == "Data Ispezione" or field == "Data Verbale":
                 # Importa la libreria tkcalendar se disponibile, altrimenti usa una entry normale
                 try:
+                    if DateEntry is None:
+                        raise ImportError("tkcalendar non disponibile")
+                    
                     # Frame per contenere il DateEntry - senza bordo
                     date_frame = ctk.CTkFrame(left_frame,
                                           fg_color=self.colors['surface'],
@@ -1108,8 +2155,7 @@ class FormApplication:
                     
                     self.fields[field] = date_picker
                 except ImportError:
-                    # Fallback a una entry normale con messaggio
-                    messagebox.showwarning("Avviso", "Il modulo tkcalendar non è disponibile. Usare il formato GG/MM/AAAA per la data.")
+                    # Fallback a una entry normale (l'avviso è già stato stampato all'importazione)
                     entry = ctk.CTkEntry(left_frame, width=400, font=("Arial", 10))  # Allungo gli entry
                     entry.grid(row=i, column=1, sticky="w", padx=10, pady=5)
                     self.fields[field] = entry
@@ -1359,20 +2405,24 @@ class FormApplication:
                               border_color=self.colors['outline'],
                               border_width=1)
         list_frame.grid(row=1, column=0, sticky="nsew", padx=(20, 0))  # Spostata un po' a destra
+        self.images_list_container = list_frame
         
         # Scrollbar per la lista
         scrollbar = tk.Scrollbar(list_frame)
         scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.images_list_scrollbar = scrollbar
         
         # Listbox per visualizzare le immagini selezionate - rimuovo il bordo bianco che interrompe
+        self.images_listvar = tk.Variable(self.root, value=())
         self.images_listbox = tk.Listbox(list_frame, 
+                                       listvariable=self.images_listvar,
                                        width=40, 
                                        height=15,
                                        font=('Arial', 12),  # Font più grande
                                        borderwidth=0,  # Rimuove il bordo bianco
                                        highlightthickness=0)  # Rimuove l'evidenziazione che interrompe
         self.images_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.images_listbox.config(yscrollcommand=scrollbar.set)
+        self.images_listbox.config(yscrollcommand=self._on_images_list_scroll)
         scrollbar.config(command=self.images_listbox.yview)
         
         # Binding per la selezione nella listbox
@@ -1386,9 +2436,23 @@ class FormApplication:
         add_images_button = self.create_button_func(image_buttons_frame, "Aggiungi Immagini", self.add_images)
         add_images_button.pack(side=tk.LEFT, padx=5)
         
+        add_folder_button = self.create_button_func(image_buttons_frame, "Aggiungi Cartella", self.add_image_folder)
+        add_folder_button.pack(side=tk.LEFT, padx=5)
+        
         remove_image_button = self.create_button_func(image_buttons_frame, "Rimuovi Immagine", self.remove_image, is_primary=False)
         remove_image_button.pack(side=tk.LEFT, padx=5)
         
+        # Alterna elenco e griglia delle miniature
+        self.gallery_button = self.create_button_func(image_buttons_frame, "Vista Miniature", self.toggle_gallery, is_primary=False)
+        self.gallery_button.pack(side=tk.LEFT, padx=5)
+        
+        # Contatore di avanzamento per le importazioni di molte immagini
+        self.import_status_label = ctk.CTkLabel(self.images_list_frame,
+                                                text="",
+                                                font=ctk.CTkFont(size=12),
+                                                text_color=self.colors['on_surface_variant'])
+        self.import_status_label.grid(row=3, column=0, sticky="w", padx=(20, 0))
+        
         # Frame per i dettagli dell'immagine (frame a destra)
         self.image_details_frame.grid_rowconfigure(0, weight=0)  # Anteprima
         self.image_details_frame.grid_rowconfigure(1, weight=0)  # Descrizione
@@ -1464,6 +2528,13 @@ class FormApplication:
         save_caption_button = self.create_button_func(info_frame, "Salva Didascalia", self.save_image_details)
         save_caption_button.grid(row=4, column=0, padx=10, pady=10, sticky="e")
         
+        # Conferma del salvataggio (sostituisce la finestra modale)
+        self.details_status_label = ctk.CTkLabel(info_frame,
+                                                 text="",
+                                                 font=ctk.CTkFont(size=12),
+                                                 text_color=self.colors['on_surface_variant'])
+        self.details_status_label.grid(row=4, column=0, padx=10, pady=10, sticky="w")
+        
         # Frame per rotazione immagine
         rotation_frame = ctk.CTkFrame(self.image_details_frame, 
                                    fg_color=self.colors['surface'],
@@ -1497,6 +2568,119 @@ class FormApplication:
                                              fg_color=self.colors['primary'],
                                              border_color=self.colors['primary_dark'])
         rotate_right_radio.pack(side=tk.RIGHT, padx=10, pady=5, expand=True)
+        
+        # Immagini aggiunte prima della costruzione del tab (es. progetto ripristinato)
+        if self._pending_list_rows and self._import_job is None:
+            self._import_job = self.root.after(0, self._insert_pending_list_rows)
+    
+    def initialize_anteprima_tab(self):
+        """Inizializza il tab Anteprima (pagine del documento disegnate senza passare da Word)"""
+        self.tabs["Anteprima"].grid_rowconfigure(1, weight=1)
+        self.tabs["Anteprima"].grid_columnconfigure(0, weight=1)
+        
+        toolbar = ctk.CTkFrame(self.tabs["Anteprima"], fg_color=self.colors['surface'])
+        toolbar.grid(row=0, column=0, columnspan=2, sticky="ew", padx=20, pady=(10, 5))
+        
+        refresh_button = self.create_button_func(toolbar, "Aggiorna", lambda: self.schedule_preview_refresh(0), is_primary=False, width=100)
+        refresh_button.pack(side=tk.LEFT, padx=5)
+        
+        self.preview_status_label = ctk.CTkLabel(toolbar, text="", text_color=self.colors['on_surface_variant'])
+        self.preview_status_label.pack(side=tk.LEFT, padx=10)
+        
+        # Pagine impilate in un canvas scorrevole
+        self.document_preview_canvas = tk.Canvas(self.tabs["Anteprima"], bg=self.colors['surface_variant'], highlightthickness=0)
+        self.document_preview_canvas.grid(row=1, column=0, sticky="nsew", padx=(20, 0), pady=(0, 10))
+        preview_scrollbar = tk.Scrollbar(self.tabs["Anteprima"], command=self.document_preview_canvas.yview)
+        preview_scrollbar.grid(row=1, column=1, sticky="ns", padx=(0, 20), pady=(0, 10))
+        self.document_preview_canvas.configure(yscrollcommand=preview_scrollbar.set)
+        self.document_preview_canvas.bind("<MouseWheel>", lambda e: self.document_preview_canvas.yview_scroll(int(-e.delta / 120) or (-1 if e.delta > 0 else 1), "units"))
+        self.document_preview_canvas.bind("<Button-4>", lambda e: self.document_preview_canvas.yview_scroll(-3, "units"))
+        self.document_preview_canvas.bind("<Button-5>", lambda e: self.document_preview_canvas.yview_scroll(3, "units"))
+        self.document_preview_canvas.bind("<Configure>", lambda e: self._layout_preview_pages())
+    
+    def schedule_preview_refresh(self, delay=PREVIEW_REFRESH_DELAY_MS):
+        """Programma (con attesa) un aggiornamento dell'anteprima, raggruppando le richieste ravvicinate"""
+        if self._preview_job is not None:
+            self.root.after_cancel(self._preview_job)
+        self._preview_job = self.root.after(delay, self._start_preview_render)
+    
+    def _start_preview_render(self):
+        """Raccoglie lo stato del form e disegna l'anteprima in un thread secondario"""
+        self._preview_job = None
+        if self._preview_running:
+            # Un aggiornamento è già in corso: se ne farà un altro al termine
+            self._preview_pending = True
+            return
+        if not hasattr(self, 'form_frame'):
+            self.initialize_dati_tab()
+        
+        # Istantanea dello stato nel thread della GUI
+        data = self.segment_formatted_fields(self.collect_form_data())
+        images = [{"path": img["path"], "description": img.get("description", ""), "rotation": img.get("rotation", 0)}
+                  for img in self.images]
+        thumbnails = {}
+        for img in images:
+            thumb = self._image_cache.peek(img["path"])
+            if thumb is not None:
+                thumbnails[img["path"]] = thumb
+        model_path = self.model_path_var.get()
+        
+        self._preview_running = True
+        self.preview_status_label.configure(text="Aggiornamento anteprima...")
+        
+        def render_in_thread():
+            start_time = time.perf_counter()
+            pages, missing, error_message = [], [], None
+            try:
+                ensure_heavy_imports("PIL", "docx_generator")
+                import preview_renderer
+                template_path = template_cache.resolve_template(model_path)
+                if not template_path:
+                    raise FileNotFoundError("Modello Word non disponibile")
+                index = preview_renderer.load_template_index(template_path)
+                if self._preview_renderer is None:
+                    self._preview_renderer = preview_renderer.PreviewRenderer()
+                pages, missing = self._preview_renderer.render(index, data, images, thumbnails)
+            except Exception as e:
+                error_message = str(e)
+            elapsed = time.perf_counter() - start_time
+            try:
+                self.root.after(0, self._show_preview_pages, pages, missing, elapsed, error_message)
+            except RuntimeError:
+                pass
+        
+        threading.Thread(target=render_in_thread, name="document-preview", daemon=True).start()
+    
+    def _show_preview_pages(self, pages, missing, elapsed, error_message):
+        """Mostra (nel thread della GUI) le pagine disegnate"""
+        self._preview_running = False
+        if error_message:
+            self.preview_status_label.configure(text=f"Anteprima non disponibile: {error_message}")
+        else:
+            self._preview_photos = [ImageTk.PhotoImage(page) for page in pages]
+            self._layout_preview_pages()
+            self.preview_status_label.configure(
+                text=f"Prime {len(pages)} pagine (approssimate), aggiornate in {elapsed * 1000:.0f} ms")
+            
+            # Le miniature mancanti nelle pagine mostrate passano in testa alla coda
+            self._preview_missing = set(missing)
+            if missing:
+                self._get_prefetcher().prioritize(missing)
+        
+        if self._preview_pending:
+            self._preview_pending = False
+            self.schedule_preview_refresh()
+    
+    def _layout_preview_pages(self):
+        """Dispone le pagine centrate una sotto l'altra nel canvas"""
+        canvas = self.document_preview_canvas
+        canvas.delete("all")
+        width = canvas.winfo_width()
+        y = PREVIEW_PAGE_GAP
+        for photo in self._preview_photos:
+            canvas.create_image(max(width // 2, photo.width() // 2 + PREVIEW_PAGE_GAP), y, image=photo, anchor="n")
+            y += photo.height() + PREVIEW_PAGE_GAP
+        canvas.configure(scrollregion=(0, 0, width, y))
     
     def _update_tab_text_color(self, button):
         """Aggiorna il colore del testo nei tab in base allo stato"""
@@ -1507,6 +2691,7 @@ class FormApplication:
             button.configure(text_color=self.colors['on_surface'])
 
 if __name__ == "__main__":
+    start_heavy_imports()
     root = ctk.CTk()
     app = FormApplication(root)
     root.mainloop()
\ No newline at end of file
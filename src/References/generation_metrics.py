@@ -0,0 +1,324 @@
+"""
+Storico delle generazioni: un record JSON per riga nella cartella dati dell'applicazione.
+
+Ogni esecuzione di generate_document aggiunge durata delle fasi, numero di paragrafi e di
+immagini, megapixel elaborati, dimensione del documento e picco di memoria del processo.
+Il file ruota oltre METRICS_MAX_BYTES. Il riepilogo calcola i percentili e segnala le
+generazioni il cui tempo per immagine supera la mediana delle precedenti sulla stessa
+postazione di oltre la soglia indicata. Per l'allarme immediato a fine generazione gli
+ultimi tempi per immagine di ogni postazione si tengono in un piccolo file di stato, che
+non dipende dalla rotazione dello storico.
+
+Riepilogo da riga di comando:
+    python generation_metrics.py [--last N] [--threshold 0.5]
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import hashlib
+import platform
+import argparse
+import threading
+from statistics import median
+
+import template_cache
+
+METRICS_FILE_NAME = "generation.jsonl"
+BASELINE_FILE_NAME = "baseline.json"
+METRICS_MAX_BYTES = 2 * 1024 * 1024
+METRICS_BACKUPS = 3
+
+# Regressioni: tempo per immagine oltre la mediana delle ultime REGRESSION_WINDOW generazioni
+# della stessa postazione (almeno REGRESSION_MIN_RUNS) moltiplicata per 1 + soglia
+REGRESSION_THRESHOLD = 0.5
+REGRESSION_WINDOW = 20
+REGRESSION_MIN_RUNS = 5
+
+_write_lock = threading.Lock()
+_baseline_lock = threading.Lock()
+_template_hashes = {}
+
+def metrics_path(backup=0):
+    """Percorso del file delle metriche (backup > 0 per i file ruotati)"""
+    name = METRICS_FILE_NAME if not backup else f"generation.{backup}.jsonl"
+    return os.path.join(template_cache.app_data_dir("metrics"), name)
+
+def baseline_path():
+    """Percorso del file di stato con gli ultimi tempi per immagine di ogni postazione"""
+    return os.path.join(template_cache.app_data_dir("metrics"), BASELINE_FILE_NAME)
+
+def load_baseline():
+    """
+    Ultimi REGRESSION_WINDOW tempi per immagine per postazione.
+
+    Se il file di stato non esiste ancora viene ricostruito una volta dallo storico completo.
+    """
+    try:
+        with open(baseline_path(), encoding="utf-8") as f:
+            baseline = json.load(f)
+        if isinstance(baseline, dict):
+            return baseline
+    except (OSError, ValueError):
+        pass
+    baseline = {}
+    for record in load_records():
+        value = seconds_per_image(record)
+        if value is not None:
+            baseline.setdefault(record.get("host"), []).append(value)
+    return {host: values[-REGRESSION_WINDOW:] for host, values in baseline.items()}
+
+def save_baseline(baseline):
+    """Scrive il file di stato in modo atomico"""
+    path = baseline_path()
+    temp_path = path + ".tmp"
+    try:
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Impossibile salvare il riferimento delle metriche: {str(e)}")
+
+def template_hash(path):
+    """Impronta breve del contenuto del modello (ricalcolata solo se il file cambia)"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+    if key not in _template_hashes:
+        with open(path, "rb") as f:
+            _template_hashes[key] = hashlib.sha1(f.read()).hexdigest()[:12]
+    return _template_hashes[key]
+
+def peak_rss_bytes():
+    """Picco di memoria residente del processo dall'avvio (None se non disponibile)"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux restituisce KB, macOS byte
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except Exception:
+        pass
+    return None
+
+def library_versions():
+    """Versioni delle librerie che incidono sui tempi (solo quelle già caricate)"""
+    versions = {"python": platform.python_version()}
+    for name, module_name in (("pillow", "PIL"), ("python-docx", "docx"), ("lxml", "lxml.etree")):
+        module = sys.modules.get(module_name)
+        version = getattr(module, "__version__", None) or getattr(module, "__VERSION__", None)
+        if version:
+            versions[name] = str(version)
+    return versions
+
+def append_record(record):
+    """Aggiunge un record allo storico, ruotando i file quando supera METRICS_MAX_BYTES"""
+    line = json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+    with _write_lock:
+        path = metrics_path()
+        try:
+            if os.path.exists(path) and os.path.getsize(path) + len(line) > METRICS_MAX_BYTES:
+                for backup in range(METRICS_BACKUPS - 1, 0, -1):
+                    if os.path.exists(metrics_path(backup)):
+                        os.replace(metrics_path(backup), metrics_path(backup + 1))
+                os.replace(path, metrics_path(1))
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError as e:
+            print(f"Impossibile salvare le metriche di generazione: {str(e)}")
+
+def load_records(include_backups=True):
+    """Record dello storico dal più vecchio al più recente (le righe illeggibili vengono saltate)"""
+    paths = [metrics_path(backup) for backup in range(METRICS_BACKUPS, 0, -1)] if include_backups else []
+    paths.append(metrics_path())
+    records = []
+    for path in paths:
+        try:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return records
+
+def seconds_per_image(record):
+    """Tempo per immagine di una generazione completa con foto (None negli altri casi)"""
+    if record.get("mode") != "full" or not record.get("images"):
+        return None
+    return record["seconds"] / record["images"]
+
+def check_regression(record, previous, threshold=REGRESSION_THRESHOLD):
+    """
+    Confronta il tempo per immagine di record con la mediana delle generazioni precedenti
+    della stessa postazione.
+
+    Returns:
+        float: Rapporto tra tempo attuale e riferimento se supera 1 + threshold, altrimenti None
+    """
+    baseline = [value for value in (seconds_per_image(r) for r in previous if r.get("host") == record.get("host"))
+                if value is not None]
+    return regression_ratio(seconds_per_image(record), baseline, threshold)
+
+def regression_ratio(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """Rapporto tra current e la mediana degli ultimi REGRESSION_WINDOW valori di baseline se supera 1 + threshold"""
+    if current is None:
+        return None
+    baseline = baseline[-REGRESSION_WINDOW:]
+    if len(baseline) < REGRESSION_MIN_RUNS:
+        return None
+    reference = median(baseline)
+    if reference > 0 and current > reference * (1 + threshold):
+        return current / reference
+    return None
+
+class GenerationRun:
+    """Misura una generazione: tempi delle fasi con mark() e record finale con finish()"""
+
+    def __init__(self, template_path, output_format="docx"):
+        self.template_path = template_path
+        self.output_format = output_format
+        self.job_id = uuid.uuid4().hex[:12]
+        self.phases = {}
+        self._start = self._last = time.perf_counter()
+
+    def mark(self, phase):
+        """Chiude la fase indicata: il tempo trascorso dalla fase precedente"""
+        now = time.perf_counter()
+        self.phases[phase] = round(self.phases.get(phase, 0) + now - self._last, 4)
+        self._last = now
+
+    def finish(self, output_path, mode="full", paragraphs=None, images=0, megapixels=None):
+        """Registra la generazione nello storico; gli errori non interrompono mai la generazione"""
+        try:
+            record = {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "job": self.job_id,
+                "host": socket.gethostname(),
+                "format": self.output_format,
+                "mode": mode,
+                "template": template_hash(self.template_path),
+                "paragraphs": paragraphs,
+                "images": images,
+                "megapixels": round(megapixels, 2) if megapixels is not None else None,
+                "phases": self.phases,
+                "seconds": round(time.perf_counter() - self._start, 4),
+                "output_bytes": os.path.getsize(output_path) if os.path.exists(output_path) else None,
+                "peak_rss_mb": None,
+                "versions": library_versions(),
+            }
+            peak = peak_rss_bytes()
+            if peak is not None:
+                record["peak_rss_mb"] = round(peak / 1048576, 1)
+
+            # Allarme immediato se la generazione è molto più lenta del solito su questa postazione
+            current = seconds_per_image(record)
+            if current is None:
+                append_record(record)
+                return record
+            with _baseline_lock:
+                baseline = load_baseline()
+                host_values = baseline.get(record["host"], [])
+                ratio = regression_ratio(current, host_values)
+                baseline[record["host"]] = (host_values + [current])[-REGRESSION_WINDOW:]
+                save_baseline(baseline)
+            if ratio is not None:
+                record["regression"] = round(ratio, 2)
+                print(f"Attenzione: generazione {ratio:.1f} volte più lenta per immagine rispetto alle precedenti")
+            append_record(record)
+            return record
+        except Exception as e:
+            print(f"Errore nella registrazione delle metriche: {str(e)}")
+            return None
+
+def percentile(values, fraction):
+    """Percentile con il metodo nearest-rank"""
+    ordered = sorted(values)
+    if not ordered:
+        return None
+    rank = max(1, int(-(-fraction * len(ordered) // 1)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+def summarize(records, threshold=REGRESSION_THRESHOLD):
+    """
+    Riepilogo dello storico: percentili di durata, tempo per immagine, dimensione e memoria,
+    più l'elenco delle generazioni con tempo per immagine in regressione.
+    """
+    series = {
+        "seconds": [r["seconds"] for r in records if r.get("seconds") is not None],
+        "seconds_per_image": [v for v in map(seconds_per_image, records) if v is not None],
+        "output_mb": [r["output_bytes"] / 1048576 for r in records if r.get("output_bytes")],
+        "peak_rss_mb": [r["peak_rss_mb"] for r in records if r.get("peak_rss_mb") is not None],
+    }
+    summary = {"runs": len(records), "incremental": sum(1 for r in records if r.get("mode") == "incremental")}
+    for name, values in series.items():
+        if values:
+            summary[name] = {"p50": percentile(values, 0.5), "p90": percentile(values, 0.9),
+                             "p99": percentile(values, 0.99), "max": max(values)}
+    summary["regressions"] = []
+    for index, record in enumerate(records):
+        ratio = check_regression(record, records[:index], threshold)
+        if ratio is not None:
+            summary["regressions"].append({"ts": record.get("ts"), "job": record.get("job"),
+                                           "host": record.get("host"), "ratio": round(ratio, 2),
+                                           "versions": record.get("versions")})
+    return summary
+
+def format_summary(summary):
+    labels = {"seconds": "Durata (s)", "seconds_per_image": "Secondi per immagine",
+              "output_mb": "Dimensione (MB)", "peak_rss_mb": "Picco memoria (MB)"}
+    lines = [f"Generazioni: {summary['runs']} (incrementali: {summary['incremental']})"]
+    for name, label in labels.items():
+        if name in summary:
+            stats = summary[name]
+            lines.append(f"{label:<22} p50 {stats['p50']:8.2f}  p90 {stats['p90']:8.2f}  "
+                         f"p99 {stats['p99']:8.2f}  max {stats['max']:8.2f}")
+    if summary["regressions"]:
+        lines.append("")
+        lines.append("Regressioni del tempo per immagine:")
+        for item in summary["regressions"]:
+            lines.append(f"  {item['ts']}  {item['host']}  job {item['job']}  x{item['ratio']:.2f}  {item['versions']}")
+    else:
+        lines.append("Nessuna regressione del tempo per immagine")
+    return "\n".join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Riepilogo dello storico delle generazioni")
+    parser.add_argument("--last", type=int, default=None, help="Considera solo le ultime N generazioni")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Soglia di regressione rispetto alla mediana (0.5 = +50%%)")
+    args = parser.parse_args()
+
+    records = load_records()
+    if args.last:
+        records = records[-args.last:]
+    if not records:
+        print(f"Nessuna generazione registrata in {metrics_path()}")
+        return
+    print(format_summary(summarize(records, args.threshold)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,539 @@
+import io
+import os
+import re
+import time
+import zlib
+import struct
+import unicodedata
+from functools import lru_cache
+
+from PIL import Image
+
+from preview_renderer import (load_template_index, resolve_runs, resolve_page_fields, CHECKED_MARK,
+                              UNCHECKED_MARK, DEFAULT_FONT_SIZE, LINE_SPACING, TAB_WIDTH_PT, CELL_PADDING_PT,
+                              CAPTION_FONT_SIZE, CAPTION_SPACE_AFTER_PT)
+from docx_generator import prepare_renditions, caption_text, FieldLookup, BUDGET_IMAGE_OVERHEAD
+from rich_text import parse_formatted_text, has_formatting
+
+# Spazio dopo la figura e righe vuote della cella, come nella tabella delle foto del documento Word
+PICTURE_SPACE_AFTER_PT = 24
+EMPTY_LINE_PT = DEFAULT_FONT_SIZE * LINE_SPACING
+EMU_PER_POINT = 12700
+
+# Byte stimati per struttura, font e testo del PDF (per il budget delle figure)
+PDF_BASE_OVERHEAD = 64 * 1024
+CONTENT_COMPRESSION_LEVEL = 6
+
+# Font standard PDF (non incorporati) con codifica WinAnsi: nomi delle risorse per (grassetto, corsivo)
+PDF_FONTS = {
+    (False, False): ("F1", "Helvetica"),
+    (True, False): ("F2", "Helvetica-Bold"),
+    (False, True): ("F3", "Helvetica-Oblique"),
+    (True, True): ("F4", "Helvetica-BoldOblique"),
+}
+
+# Larghezze (millesimi di em) dei caratteri ASCII 32-126 di Helvetica e Helvetica-Bold (metriche AFM);
+# le varianti oblique hanno le stesse larghezze
+HELVETICA_WIDTHS = (
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+)
+HELVETICA_BOLD_WIDTHS = (
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+)
+
+# Simboli WinAnsi più comuni oltre l'ASCII: (normale, grassetto). Le lettere accentate usano
+# la larghezza della lettera base; gli altri caratteri una larghezza media
+EXTRA_WIDTHS = {
+    " ": (278, 278), "€": (556, 556), "…": (1000, 1000), "•": (350, 350),
+    "–": (556, 556), "—": (1000, 1000), "‘": (222, 278), "’": (222, 278),
+    "‚": (222, 278), "“": (333, 500), "”": (333, 500), "„": (333, 500),
+    "°": (400, 400), "«": (556, 556), "»": (556, 556), "§": (556, 556),
+    "·": (278, 278), "×": (584, 584), "±": (584, 584), "²": (333, 333),
+    "³": (333, 333), "¹": (333, 333), "µ": (556, 611), "ß": (611, 611),
+    "æ": (889, 889), "Æ": (1000, 1000), "ø": (611, 611), "Ø": (778, 778),
+    "©": (737, 737), "®": (737, 737), "™": (1000, 1000), "£": (556, 556),
+    "ì": (278, 278), "í": (278, 278), "î": (278, 278), "ï": (278, 278),
+}
+DEFAULT_CHAR_WIDTH = 556
+
+_TOKEN_PATTERN = re.compile(r"\n|\t| +|[^\s]+")
+_MARKS = (CHECKED_MARK, UNCHECKED_MARK)
+
+@lru_cache(maxsize=4096)
+def char_width(char, bold):
+    """Larghezza di un carattere in millesimi di em"""
+    widths = HELVETICA_BOLD_WIDTHS if bold else HELVETICA_WIDTHS
+    code = ord(char)
+    if 32 <= code <= 126:
+        return widths[code - 32]
+    if char in EXTRA_WIDTHS:
+        return EXTRA_WIDTHS[char][1 if bold else 0]
+    base = unicodedata.normalize("NFD", char)[0]
+    if base != char and 32 <= ord(base) <= 126:
+        return widths[ord(base) - 32]
+    return DEFAULT_CHAR_WIDTH
+
+def text_width(text, bold, size):
+    """Larghezza di un testo in punti"""
+    if text in _MARKS:
+        return size
+    return sum(char_width(char, bold) for char in text) * size / 1000
+
+def pdf_string(text):
+    """Stringa letterale PDF in codifica WinAnsi (i caratteri non rappresentabili diventano '?')"""
+    out = bytearray(b"(")
+    for byte in text.encode("cp1252", errors="replace"):
+        if byte in (0x28, 0x29, 0x5C):
+            out += b"\\" + bytes((byte,))
+        elif byte < 32 or byte > 126:
+            out += b"\\%03o" % byte
+        else:
+            out.append(byte)
+    out += b")"
+    return bytes(out)
+
+def _number(value):
+    """Numero formattato per il flusso di contenuto"""
+    return (b"%.2f" % value).rstrip(b"0").rstrip(b".") or b"0"
+
+class PdfPage:
+    """Operatori di disegno di una pagina, con coordinate dall'alto come nel resto dell'impaginazione"""
+
+    def __init__(self, height):
+        self.height = height
+        self.ops = []
+
+    def text(self, x, baseline, text, bold, italic, size):
+        font = PDF_FONTS[(bool(bold), bool(italic))][0].encode("ascii")
+        self.ops.append(b"BT /%s %s Tf 1 0 0 1 %s %s Tm %s Tj ET" % (
+            font, _number(size), _number(x), _number(self.height - baseline), pdf_string(text)))
+
+    def line(self, x1, y1, x2, y2, width=0.5):
+        self.ops.append(b"%s w %s %s m %s %s l S" % (
+            _number(width), _number(x1), _number(self.height - y1), _number(x2), _number(self.height - y2)))
+
+    def rect(self, x, y, width, height, line_width=0.5, gray=0):
+        self.ops.append(b"%s G %s w %s %s %s %s re S 0 G" % (
+            _number(gray), _number(line_width), _number(x), _number(self.height - y - height),
+            _number(width), _number(height)))
+
+    def checkbox(self, x, baseline, size, checked):
+        """Casella di controllo disegnata (i simboli ☒/☐ non esistono nei font standard)"""
+        box = size * 0.75
+        top = baseline - box
+        self.rect(x + size * 0.1, top, box, box, line_width=0.6)
+        if checked:
+            self.line(x + size * 0.1, top, x + size * 0.1 + box, top + box, 0.6)
+            self.line(x + size * 0.1, top + box, x + size * 0.1 + box, top, 0.6)
+
+    def image(self, name, x, y, width, height, rotate_180=False):
+        bottom = self.height - y - height
+        if rotate_180:
+            matrix = (-width, 0, 0, -height, x + width, bottom + height)
+        else:
+            matrix = (width, 0, 0, height, x, bottom)
+        self.ops.append(b"q %s cm /%s Do Q" % (b" ".join(_number(v) for v in matrix), name.encode("ascii")))
+
+    def content(self):
+        return zlib.compress(b"\n".join(self.ops), CONTENT_COMPRESSION_LEVEL)
+
+class PdfWriter:
+    """
+    Scrittura sequenziale di un file PDF.
+
+    Gli oggetti vengono scritti appena sono pronti (le immagini passano direttamente
+    dai byte codificati al file); quelli che dipendono dal resto del documento si
+    riservano prima e si scrivono alla fine.
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = {}
+        self._next_ref = 1
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def reserve(self):
+        ref = self._next_ref
+        self._next_ref += 1
+        return ref
+
+    def write_object(self, ref, body, stream=None):
+        """Scrive un oggetto; con stream, body contiene le voci del dizionario del flusso"""
+        self.offsets[ref] = self.f.tell()
+        self.f.write(b"%d 0 obj\n" % ref)
+        if stream is None:
+            self.f.write(body)
+        else:
+            self.f.write(b"<<%s /Length %d>>\nstream\n" % (body, len(stream)))
+            self.f.write(stream)
+            self.f.write(b"\nendstream")
+        self.f.write(b"\nendobj\n")
+
+    def add(self, body, stream=None):
+        ref = self.reserve()
+        self.write_object(ref, body, stream)
+        return ref
+
+    def close(self, root_ref):
+        """Scrive la tabella dei riferimenti incrociati e il trailer"""
+        xref_offset = self.f.tell()
+        count = self._next_ref
+        self.f.write(b"xref\n0 %d\n0000000000 65535 f \n" % count)
+        for ref in range(1, count):
+            self.f.write(b"%010d 00000 n \n" % self.offsets[ref])
+        self.f.write(b"trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n" % (count, root_ref, xref_offset))
+
+def jpeg_xobject(data):
+    """Immagine JPEG incorporata così com'è (DCTDecode)"""
+    with Image.open(io.BytesIO(data)) as img:
+        width, height = img.size
+        mode = img.mode
+    if mode == "CMYK":
+        # I JPEG CMYK di Adobe sono memorizzati invertiti
+        color = b"/DeviceCMYK /Decode [1 0 1 0 1 0 1 0]"
+    elif mode in ("L", "1"):
+        color = b"/DeviceGray"
+    else:
+        color = b"/DeviceRGB"
+    entries = b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent 8 /Filter /DCTDecode" % (
+        width, height, color)
+    return entries, data
+
+def png_xobject(data):
+    """
+    Immagine PNG incorporata senza ricodifica: i dati IDAT sono già un flusso zlib con
+    i predittori PNG, che il PDF decodifica con FlateDecode e Predictor 15.
+
+    PNG con trasparenza, interlacciati o a 16 bit vengono decodificati e compressi di nuovo.
+    """
+    pos = 8
+    idat = []
+    palette = None
+    header = None
+    while pos + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if chunk_type == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif chunk_type == b"PLTE":
+            palette = chunk
+        elif chunk_type == b"IDAT":
+            idat.append(chunk)
+        elif chunk_type == b"IEND":
+            break
+
+    if header is not None:
+        width, height, bit_depth, color_type, _, _, interlace = header
+        colors = {0: 1, 2: 3, 3: 1}.get(color_type)
+        if colors is not None and not interlace and bit_depth <= 8 and (color_type != 3 or palette):
+            if color_type == 3:
+                color = b"[/Indexed /DeviceRGB %d <%s>]" % (len(palette) // 3 - 1, palette.hex().encode("ascii"))
+            else:
+                color = b"/DeviceRGB" if colors == 3 else b"/DeviceGray"
+            entries = (b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s /BitsPerComponent %d "
+                       b"/Filter /FlateDecode /DecodeParms <</Predictor 15 /Colors %d /BitsPerComponent %d /Columns %d>>" % (
+                           width, height, color, bit_depth, colors, bit_depth, width))
+            return entries, b"".join(idat)
+
+    with Image.open(io.BytesIO(data)) as img:
+        if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+            background = Image.new("RGB", img.size, "white")
+            background.paste(img.convert("RGBA"), mask=img.convert("RGBA").getchannel("A"))
+            img = background
+        else:
+            img = img.convert("RGB")
+        entries = b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode" % img.size
+        return entries, zlib.compress(img.tobytes(), CONTENT_COMPRESSION_LEVEL)
+
+def image_xobject(data):
+    """Dizionario e flusso dell'oggetto immagine per i byte di una figura codificata"""
+    if data[:2] == b"\xff\xd8":
+        return jpeg_xobject(data)
+    if data[:8] == b"\x89PNG\r\n\x1a\n":
+        return png_xobject(data)
+    raise ValueError("Formato della figura non supportato nel PDF")
+
+def compute_image_box(index):
+    """Riquadro di una figura in EMU, calcolato come compute_image_box del generatore Word"""
+    width = index.page_width - index.left_margin - index.right_margin
+    page_height = index.page_height - index.top_margin - index.bottom_margin
+    height = ((page_height - 2 / 2.54 * 72) / 2) * 0.8
+    return int(width * EMU_PER_POINT), int(height * EMU_PER_POINT)
+
+def layout_lines(runs, width):
+    """
+    Dispone i run di un paragrafo su righe di larghezza massima width.
+
+    Returns:
+        list: Righe (altezza, larghezza, elementi), con elementi (x, testo, grassetto, corsivo, sottolineato, dimensione)
+    """
+    lines = [[]]
+    x = 0
+    for text, bold, italic, underline, size in runs:
+        for token in _TOKEN_PATTERN.findall(text):
+            if token == "\n":
+                lines.append([])
+                x = 0
+                continue
+            if token == "\t":
+                x = (int(x // TAB_WIDTH_PT) + 1) * TAB_WIDTH_PT
+                continue
+            token_width = text_width(token, bold, size)
+            if x + token_width > width and lines[-1] and not token.isspace():
+                lines.append([])
+                x = 0
+            if token.isspace() and not lines[-1]:
+                continue
+            lines[-1].append((x, token, bold, italic, underline, size))
+            x += token_width
+
+    result = []
+    for line in lines:
+        if not line:
+            result.append((EMPTY_LINE_PT, 0, line))
+            continue
+        last = line[-1]
+        line_width = last[0] + text_width(last[1], last[2], last[5])
+        result.append((max(item[5] for item in line) * LINE_SPACING, line_width, line))
+    return result
+
+def paragraph_rows(runs, width, align="left", space_after=0):
+    """Righe impaginabili (altezza, funzione di disegno) di un paragrafo"""
+    rows = []
+    lines = layout_lines(runs, width)
+    for position, (height, line_width, items) in enumerate(lines):
+        offset = {"center": (width - line_width) / 2, "right": width - line_width}.get(align, 0)
+
+        def draw(page, x0, y0, items=items, height=height, offset=offset):
+            # Le parole consecutive con lo stesso stile diventano un solo testo (spazi compresi)
+            groups = []
+            for x, token, bold, italic, underline, size in items:
+                style = (bold, italic, underline, size)
+                if (token not in _MARKS and groups and groups[-1][2] == style
+                        and groups[-1][1][-1] not in _MARKS and abs(groups[-1][3] - x) < 0.01):
+                    groups[-1][1].append(token)
+                else:
+                    groups.append([x, [token], style, x])
+                groups[-1][3] = x + text_width(token, bold, size)
+            for x, tokens, (bold, italic, underline, size), end in groups:
+                baseline = y0 + height - size * (LINE_SPACING - 1) / 2 - size * 0.2
+                text = "".join(tokens)
+                if text in _MARKS:
+                    page.checkbox(x0 + offset + x, baseline, size, text == CHECKED_MARK)
+                elif not text.isspace():
+                    page.text(x0 + offset + x, baseline, text, bold, italic, size)
+                if underline:
+                    underline_y = baseline + size * 0.1
+                    page.line(x0 + offset + x, underline_y, x0 + offset + end, underline_y)
+        if position == len(lines) - 1:
+            height += space_after
+        rows.append((height, draw))
+    return rows
+
+def container_rows(blocks, data, width):
+    """Righe di una sequenza di blocchi (paragrafi e tabelle) con i segnaposto risolti"""
+    rows = []
+    for block in blocks:
+        if block["type"] == "paragraph":
+            rows.extend(paragraph_rows(resolve_runs(block["runs"], data), width, block["align"], block["space_after"]))
+        elif block["type"] == "table":
+            rows.extend(table_rows(block, data, width))
+    return rows
+
+def table_rows(block, data, width):
+    """Una riga impaginabile per ogni riga della tabella, con i bordi delle celle"""
+    rows = []
+    for row in block["rows"]:
+        column = 0
+        cells = []
+        for cell in row:
+            cell_width = width * sum(block["widths"][column:column + cell["span"]])
+            column += cell["span"]
+            cells.append((cell_width, container_rows(cell["blocks"], data, max(1, cell_width - 2 * CELL_PADDING_PT))))
+        row_height = max((sum(height for height, _ in contents) for _, contents in cells), default=0) + 2 * CELL_PADDING_PT
+
+        def draw(page, x0, y0, cells=cells, row_height=row_height):
+            x = x0
+            for cell_width, contents in cells:
+                y = y0 + CELL_PADDING_PT
+                for height, draw_content in contents:
+                    draw_content(page, x + CELL_PADDING_PT, y)
+                    y += height
+                page.rect(x, y0, cell_width, row_height, gray=0.6)
+                x += cell_width
+        rows.append((row_height, draw))
+    return rows
+
+def photo_rows(image_refs, images, renditions, width):
+    """
+    Righe della documentazione fotografica: figura centrata, didascalia "Figura N - ..."
+    e spaziature come nella tabella delle foto del documento Word.
+
+    Come nel documento Word, solo le figure inserite vengono numerate.
+    """
+    rows = []
+    figure_number = 0
+    for number, (img_info, rendition) in enumerate(zip(images, renditions), 1):
+        if isinstance(rendition, Exception) or number not in image_refs:
+            error_rows = paragraph_rows(((f"Errore nel caricamento dell'immagine: {rendition}", False, False, False,
+                                          DEFAULT_FONT_SIZE),), width, "left", PICTURE_SPACE_AFTER_PT)
+            rows.extend(error_rows)
+            continue
+
+        figure_number += 1
+        caption = caption_text(img_info.get("description", ""), figure_number)
+        caption_rows = paragraph_rows(((caption, False, False, False, CAPTION_FONT_SIZE),), width, "center",
+                                      CAPTION_SPACE_AFTER_PT)
+        caption_height = sum(height for height, _ in caption_rows)
+
+        picture_width = rendition["width_emu"] / EMU_PER_POINT
+        picture_height = rendition["height_emu"] / EMU_PER_POINT
+        height = picture_height + PICTURE_SPACE_AFTER_PT + EMPTY_LINE_PT + caption_height + EMPTY_LINE_PT
+
+        def draw(page, x0, y0, name=image_refs[number], rendition=rendition, picture_width=picture_width,
+                 picture_height=picture_height, caption_rows=caption_rows):
+            page.image(name, x0 + (width - picture_width) / 2, y0, picture_width, picture_height, rendition["rotate_180"])
+            y = y0 + picture_height + PICTURE_SPACE_AFTER_PT + EMPTY_LINE_PT
+            for caption_height, draw_caption in caption_rows:
+                draw_caption(page, x0, y)
+                y += caption_height
+        rows.append((height, draw))
+    return rows
+
+def export_pdf(template_path, output_path, data=None, images=None, max_output_size=None, report=None, renditions=None):
+    """
+    Esporta il verbale direttamente in PDF, senza Word.
+
+    Il modello viene letto con lo stesso indice dell'anteprima; testo, caselle di controllo,
+    campi formattati e tabelle vengono impaginati con i font standard del PDF e le figure
+    codificate per il documento Word vengono incorporate senza ricodifica.
+
+    Args:
+        template_path (str): Percorso del modello Word (.docx)
+        output_path (str): Percorso del PDF da creare
+        data (dict): Valori dei campi (i campi formattati con i marcatori <b>, <i>, <u>
+            o già divisi in coppie testo/tag)
+        images (list): Lista di dizionari con path, description e rotation
+        max_output_size (int, optional): Dimensione massima del PDF in byte
+        report (dict, optional): Riceve pagine, dimensione finale e impostazioni delle figure
+        renditions (list, optional): Figure già codificate con prepare_renditions (la lista viene modificata)
+    """
+    start_time = time.time()
+    data = FieldLookup({field: parse_formatted_text(value) if isinstance(value, str) and has_formatting(value) else value
+                        for field, value in (data or {}).items()})
+    images = images or []
+    index = load_template_index(template_path)
+
+    if renditions is None:
+        renditions = []
+    if images and not renditions:
+        image_budget = None
+        if max_output_size:
+            image_budget = max_output_size - PDF_BASE_OVERHEAD - BUDGET_IMAGE_OVERHEAD * len(images)
+        renditions = prepare_renditions(images, *compute_image_box(index), image_budget=image_budget, report=report)
+
+    width = index.page_width - index.left_margin - index.right_margin
+    top = index.top_margin
+    bottom = index.page_height - index.bottom_margin
+    temp_path = output_path + ".tmp"
+
+    with open(temp_path, 'wb') as f:
+        writer = PdfWriter(f)
+        catalog_ref = writer.reserve()
+        pages_ref = writer.reserve()
+        resources_ref = writer.reserve()
+
+        font_refs = {}
+        for name, base_font in PDF_FONTS.values():
+            font_refs[name] = writer.add(b"<</Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding>>" %
+                                         base_font.encode("ascii"))
+
+        # Le figure vanno nel file subito, con i byte già codificati
+        image_refs = {}
+        xobject_refs = {}
+        for number, rendition in enumerate(renditions, 1):
+            if isinstance(rendition, Exception):
+                continue
+            try:
+                entries, stream = image_xobject(rendition["data"])
+            except Exception as e:
+                print(f"Errore nell'incorporazione della figura {number} nel PDF: {str(e)}")
+                renditions[number - 1] = e
+                continue
+            name = f"Im{number}"
+            xobject_refs[name] = writer.add(entries, stream)
+            image_refs[number] = name
+
+        pages = []
+        state = {"y": bottom}
+
+        def new_page():
+            pages.append(PdfPage(index.page_height))
+            state["y"] = top
+
+        def place(rows):
+            for height, draw in rows:
+                if state["y"] + height > bottom and state["y"] > top:
+                    new_page()
+                draw(pages[-1], index.left_margin, state["y"])
+                state["y"] += height
+
+        new_page()
+        for block in index.blocks:
+            if block["type"] == "photos":
+                if images:
+                    place(photo_rows(image_refs, images, renditions, width))
+                continue
+            place(container_rows([block], data, width))
+        if images and not index.has_photo_placeholder:
+            place(paragraph_rows((("Documentazione Fotografica", True, False, False, 14),), width, "left", 6))
+            place(photo_rows(image_refs, images, renditions, width))
+
+        # Intestazioni e piè di pagina a impaginazione finita, con PAGE e NUMPAGES della pagina
+        for number, page in enumerate(pages, 1):
+            header, footer = (container_rows(resolve_page_fields(blocks, number, len(pages)), data, width)
+                              for blocks in index.header_footer(number))
+            y = max(0, top - sum(height for height, _ in header))
+            for height, draw in header:
+                draw(page, index.left_margin, y)
+                y += height
+            y = bottom
+            for height, draw in footer:
+                draw(page, index.left_margin, y)
+                y += height
+
+        page_refs = []
+        for page in pages:
+            content_ref = writer.add(b"/Filter /FlateDecode", page.content())
+            page_refs.append(writer.add(
+                b"<</Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] /Resources %d 0 R /Contents %d 0 R>>" % (
+                    pages_ref, _number(index.page_width), _number(index.page_height), resources_ref, content_ref)))
+
+        fonts = b" ".join(b"/%s %d 0 R" % (name.encode("ascii"), ref) for name, ref in font_refs.items())
+        xobjects = b" ".join(b"/%s %d 0 R" % (name.encode("ascii"), ref) for name, ref in xobject_refs.items())
+        writer.write_object(resources_ref, b"<</Font <<%s>> /XObject <<%s>> /ProcSet [/PDF /Text /ImageC /ImageI]>>" % (
+            fonts, xobjects))
+        writer.write_object(pages_ref, b"<</Type /Pages /Kids [%s] /Count %d>>" % (
+            b" ".join(b"%d 0 R" % ref for ref in page_refs), len(page_refs)))
+        writer.write_object(catalog_ref, b"<</Type /Catalog /Pages %d 0 R>>" % pages_ref)
+        writer.close(catalog_ref)
+    os.replace(temp_path, output_path)
+
+    output_size = os.path.getsize(output_path)
+    print(f"PDF esportato: {output_path} ({len(pages)} pagine, {output_size / 1048576:.2f} MB, {time.time() - start_time:.2f} s)")
+    if report is not None:
+        report["pages"] = len(pages)
+        report["output_size"] = output_size
+        if max_output_size:
+            report["within_limit"] = output_size <= max_output_size
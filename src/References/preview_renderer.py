@@ -0,0 +1,516 @@
+import os
+import re
+import sys
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text.paragraph import Paragraph
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from PIL import Image, ImageDraw, ImageFont
+
+from docx_generator import FieldLookup, CHECKBOX_FIELDS, ROTATION_TRANSPOSE, caption_text
+
+# Scala dell'anteprima: a zoom 1 un punto tipografico corrisponde a un pixel (72 DPI)
+DEFAULT_ZOOM = 1.0
+PREVIEW_MAX_PAGES = 3
+DEFAULT_FONT_SIZE = 10
+LINE_SPACING = 1.2
+TAB_WIDTH_PT = 36
+CELL_PADDING_PT = 4
+CAPTION_FONT_SIZE = 10
+CAPTION_SPACE_AFTER_PT = 24
+
+# Paragrafi renderizzati conservati tra un aggiornamento e l'altro
+STRIP_CACHE_ENTRIES = 1024
+
+PLACEHOLDER_PATTERN = re.compile(r"\{\{([^}]+)\}\}")
+PHOTO_PLACEHOLDERS = ("foto", "Foto")
+# Campi di numerazione delle pagine: il risultato salvato nel modello vale solo per la pagina in cui Word l'ha calcolato
+PAGE_FIELDS = ("PAGE", "NUMPAGES", "SECTIONPAGES")
+CHECKED_MARK = "☒"
+UNCHECKED_MARK = "☐"
+
+FONT_FILES = {
+    (False, False): "DejaVuSans.ttf",
+    (True, False): "DejaVuSans-Bold.ttf",
+    (False, True): "DejaVuSans-Oblique.ttf",
+    (True, True): "DejaVuSans-BoldOblique.ttf",
+}
+
+ALIGNMENTS = {
+    WD_ALIGN_PARAGRAPH.CENTER: "center",
+    WD_ALIGN_PARAGRAPH.RIGHT: "right",
+}
+
+_TOKEN_PATTERN = re.compile(r"\n|\t| +|[^\s]+")
+
+def _font_dir():
+    """Cerca la cartella dei font DejaVu (eseguibile PyInstaller o cartella public del progetto)"""
+    module_dir = os.path.dirname(os.path.abspath(__file__))
+    candidates = []
+    if hasattr(sys, "_MEIPASS"):
+        candidates += [os.path.join(sys._MEIPASS, "fonts"), os.path.join(sys._MEIPASS, "public", "fonts")]
+    candidates += [
+        os.path.join(module_dir, "fonts"),
+        os.path.join(module_dir, "..", "..", "public", "fonts"),
+        os.path.join(os.path.abspath("."), "public", "fonts"),
+    ]
+    for directory in candidates:
+        if os.path.exists(os.path.join(directory, FONT_FILES[(False, False)])):
+            return directory
+    return None
+
+@lru_cache(maxsize=None)
+def get_font(bold, italic, size_px):
+    """Font DejaVu per lo stile indicato (font predefinito di Pillow se non disponibile)"""
+    directory = _font_dir()
+    if directory:
+        try:
+            return ImageFont.truetype(os.path.join(directory, FONT_FILES[(bool(bold), bool(italic))]), size_px)
+        except OSError as e:
+            print(f"Font non disponibile per l'anteprima: {str(e)}")
+    return ImageFont.load_default(size_px)
+
+def _index_paragraph(paragraph):
+    """Estrae testo e formattazione essenziale di un paragrafo"""
+    style = paragraph.style
+    style_size = style.font.size.pt if style is not None and style.font.size else None
+    is_heading = style is not None and style.name.lower().startswith(("heading", "titolo"))
+    runs = []
+    # Run con il risultato dei campi PAGE/NUMPAGES: (posizione, campo), None per le parti successive
+    fields = []
+    instruction = None
+    field = None
+    first = False
+    for run in paragraph.runs:
+        for child in run._r.iterchildren(qn("w:fldChar"), qn("w:instrText")):
+            if child.tag == qn("w:instrText"):
+                if instruction is not None:
+                    instruction += child.text or ""
+                continue
+            char_type = child.get(qn("w:fldCharType"))
+            if char_type == "begin":
+                instruction, field = "", None
+            elif char_type == "separate" and instruction is not None:
+                name = (instruction.split() or [""])[0].upper()
+                field = name if name in PAGE_FIELDS else None
+                first = True
+            elif char_type == "end":
+                instruction, field = None, None
+        if not run.text:
+            continue
+        if field is not None:
+            fields.append((len(runs), field if first else None))
+            first = False
+        size = run.font.size.pt if run.font.size else (style_size or (14 if is_heading else DEFAULT_FONT_SIZE))
+        runs.append((run.text, bool(run.bold) or is_heading, bool(run.italic), bool(run.underline), size))
+
+    text = "".join(run[0] for run in runs)
+    if any(f"{{{{{name}}}}}" in text for name in PHOTO_PLACEHOLDERS):
+        return {"type": "photos"}
+
+    space_after = paragraph.paragraph_format.space_after
+    return {
+        "type": "paragraph",
+        "runs": tuple(runs),
+        "align": ALIGNMENTS.get(paragraph.alignment, "left"),
+        "space_after": space_after.pt if space_after is not None else 0,
+        "fields": tuple(fields),
+    }
+
+def _index_container(element, parent):
+    """Indicizza in ordine paragrafi e tabelle di un contenitore (corpo, cella, intestazione)"""
+    blocks = []
+    for child in element.iterchildren():
+        tag = child.tag.rsplit("}", 1)[-1]
+        if tag == "p":
+            blocks.append(_index_paragraph(Paragraph(child, parent)))
+        elif tag == "tbl":
+            blocks.append(_index_table(Table(child, parent)))
+    return blocks
+
+def _index_table(table):
+    """Indicizza righe e celle di una tabella (le celle unite diventano una cella con span)"""
+    grid = [col.w for col in table._tbl.tblGrid.gridCol_lst if col.w]
+    total = sum(grid) or 1
+    widths = [w / total for w in grid] if grid else None
+
+    rows = []
+    for row in table.rows:
+        cells = []
+        for cell in row.cells:
+            if cells and cells[-1]["tc"] is cell._tc:
+                cells[-1]["span"] += 1
+                continue
+            cells.append({"tc": cell._tc, "span": 1, "blocks": _index_container(cell._tc, cell)})
+        rows.append([{"span": c["span"], "blocks": c["blocks"]} for c in cells])
+    columns = max((sum(c["span"] for c in row) for row in rows), default=1)
+    if not widths or len(widths) != columns:
+        widths = [1 / columns] * columns
+    return {"type": "table", "widths": widths, "rows": rows}
+
+class TemplateIndex:
+    """
+    Struttura del modello Word letta una sola volta: pagina, margini, blocchi del corpo,
+    intestazione e piè di pagina.
+    """
+
+    def __init__(self, template_path):
+        doc = Document(template_path)
+        section = doc.sections[0]
+        self.page_width = section.page_width.pt
+        self.page_height = section.page_height.pt
+        self.left_margin = section.left_margin.pt
+        self.right_margin = section.right_margin.pt
+        self.top_margin = section.top_margin.pt
+        self.bottom_margin = section.bottom_margin.pt
+        self.blocks = _index_container(doc.element.body, doc._body)
+        self.header = _index_container(section.header._element, section.header)
+        self.footer = _index_container(section.footer._element, section.footer)
+        # Prima pagina (titlePg) e pagine pari (evenAndOddHeaders) con intestazione e piè di pagina propri
+        self.first_page = None
+        if section.different_first_page_header_footer:
+            self.first_page = (_index_container(section.first_page_header._element, section.first_page_header),
+                               _index_container(section.first_page_footer._element, section.first_page_footer))
+        self.even_page = None
+        if doc.settings.odd_and_even_pages_header_footer:
+            self.even_page = (_index_container(section.even_page_header._element, section.even_page_header),
+                              _index_container(section.even_page_footer._element, section.even_page_footer))
+        self.has_photo_placeholder = any(block["type"] == "photos" for block in self.blocks)
+
+    def header_footer(self, page):
+        """Blocchi di intestazione e piè di pagina della pagina indicata (numerata da 1)"""
+        if page == 1 and self.first_page is not None:
+            return self.first_page
+        if page % 2 == 0 and self.even_page is not None:
+            return self.even_page
+        return self.header, self.footer
+
+_index_cache = {}
+_index_lock = threading.Lock()
+
+def load_template_index(template_path):
+    """Restituisce l'indice del modello, riletto solo se il file è cambiato"""
+    st = os.stat(template_path)
+    key = (os.path.abspath(template_path), st.st_size, st.st_mtime_ns)
+    with _index_lock:
+        index = _index_cache.get(key)
+    if index is None:
+        index = TemplateIndex(template_path)
+        with _index_lock:
+            _index_cache.clear()
+            _index_cache[key] = index
+    return index
+
+def resolve_runs(runs, data):
+    """
+    Sostituisce i segnaposto nei run di un paragrafo.
+
+    Il valore eredita la formattazione del run in cui inizia il segnaposto; i valori
+    booleani diventano una casella di controllo seguita dal nome del campo e i campi
+    formattati (lista di coppie testo/tag) mantengono grassetto, corsivo e sottolineato.
+    I nomi si cercano come nel generatore Word (FieldLookup): i segnaposto senza valore
+    diventano vuoti, tranne le caselle di controllo che Word converte in seguito.
+
+    Args:
+        runs (tuple): Run del paragrafo indicizzato
+        data (dict | FieldLookup): Valori dei campi; conviene passare un FieldLookup creato
+            una volta per tutto il documento
+
+    Returns:
+        tuple: Run (testo, grassetto, corsivo, sottolineato, dimensione) risolti
+    """
+    text = "".join(run[0] for run in runs)
+    if "{{" not in text:
+        return runs
+    lookup = data if isinstance(data, FieldLookup) else FieldLookup(data)
+
+    # Run di appartenenza di ogni carattere
+    owners = []
+    for position, run in enumerate(runs):
+        owners.extend([position] * len(run[0]))
+
+    resolved = []
+    cursor = 0
+    def copy_text(start, end):
+        for position in range(start, end):
+            owner = runs[owners[position]]
+            if resolved and resolved[-1][1:] == owner[1:]:
+                resolved[-1] = (resolved[-1][0] + text[position],) + owner[1:]
+            else:
+                resolved.append((text[position],) + owner[1:])
+
+    for match in PLACEHOLDER_PATTERN.finditer(text):
+        name = match.group(1)
+        if name.startswith("checkbox_"):
+            name = name[len("checkbox_"):]
+        value = lookup.value(name)
+        if value == "" and (name != match.group(1) or name in CHECKBOX_FIELDS):
+            continue
+        copy_text(cursor, match.start())
+        _, bold, italic, underline, size = runs[owners[match.start()]]
+        if isinstance(value, bool):
+            resolved.append((f"{CHECKED_MARK if value else UNCHECKED_MARK} {name}", bold, italic, underline, size))
+        elif isinstance(value, (list, tuple)):
+            for segment, tags in value:
+                resolved.append((segment, bold or "bold" in tags, italic or "italic" in tags,
+                                 underline or "underline" in tags, size))
+        else:
+            resolved.append((str(value), bold, italic, underline, size))
+        cursor = match.end()
+    copy_text(cursor, len(text))
+    return tuple(resolved)
+
+def resolve_page_fields(blocks, page, pages):
+    """
+    Copia dei blocchi con i campi PAGE e NUMPAGES calcolati per la pagina indicata.
+
+    Va applicata dopo l'impaginazione del corpo, quando il numero di pagine è noto.
+    """
+    values = {"PAGE": str(page), "NUMPAGES": str(pages), "SECTIONPAGES": str(pages)}
+    result = []
+    for block in blocks:
+        if block["type"] == "paragraph" and block.get("fields"):
+            runs = list(block["runs"])
+            for position, field in block["fields"]:
+                runs[position] = (values[field] if field else "",) + runs[position][1:]
+            block = dict(block, runs=tuple(runs))
+        elif block["type"] == "table":
+            rows = [[dict(cell, blocks=resolve_page_fields(cell["blocks"], page, pages)) for cell in row]
+                    for row in block["rows"]]
+            block = dict(block, rows=rows)
+        result.append(block)
+    return result
+
+def layout_paragraph(runs, width, align="left", zoom=DEFAULT_ZOOM, space_after=0):
+    """
+    Dispone un paragrafo su righe di larghezza massima width e lo disegna.
+
+    Returns:
+        PIL.Image: Striscia RGB del paragrafo
+    """
+    lines = [[]]
+    x = 0
+    for text, bold, italic, underline, size in runs:
+        font = get_font(bold, italic, max(1, int(round(size * zoom))))
+        for token in _TOKEN_PATTERN.findall(text):
+            if token == "\n":
+                lines.append([])
+                x = 0
+                continue
+            if token == "\t":
+                tab = TAB_WIDTH_PT * zoom
+                x = (int(x // tab) + 1) * tab
+                continue
+            token_width = font.getlength(token)
+            if x + token_width > width and lines[-1] and not token.isspace():
+                lines.append([])
+                x = 0
+            if token.isspace() and not lines[-1]:
+                continue
+            lines[-1].append((x, token, font, underline, size))
+            x += token_width
+
+    default_height = DEFAULT_FONT_SIZE * LINE_SPACING * zoom
+    heights = [max((item[4] for item in line), default=DEFAULT_FONT_SIZE) * LINE_SPACING * zoom if line else default_height
+               for line in lines]
+    total_height = int(sum(heights) + space_after * zoom) or 1
+    strip = Image.new("RGB", (max(1, int(width)), total_height), "white")
+    draw = ImageDraw.Draw(strip)
+    y = 0
+    for line, height in zip(lines, heights):
+        if line:
+            line_width = line[-1][0] + line[-1][2].getlength(line[-1][1])
+            offset = {"center": (width - line_width) / 2, "right": width - line_width}.get(align, 0)
+            for x, token, font, underline, size in line:
+                draw.text((offset + x, y), token, fill="black", font=font)
+                if underline:
+                    underline_y = y + size * zoom * 1.05
+                    draw.line((offset + x, underline_y, offset + x + font.getlength(token), underline_y), fill="black")
+        y += height
+    return strip
+
+class PreviewRenderer:
+    """
+    Anteprima approssimata del documento come immagini delle prime pagine.
+
+    I paragrafi renderizzati restano in una cache LRU indicizzata dal contenuto risolto,
+    così a ogni aggiornamento si ridisegnano solo i blocchi il cui testo è cambiato;
+    le pagine si ricompongono incollando le strisce.
+    """
+
+    def __init__(self, zoom=DEFAULT_ZOOM, max_pages=PREVIEW_MAX_PAGES):
+        self.zoom = zoom
+        self.max_pages = max_pages
+        self._strips = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, render):
+        """Restituisce una striscia dalla cache o la disegna"""
+        strip = self._strips.get(key)
+        if strip is not None:
+            self._strips.move_to_end(key)
+            self.hits += 1
+            return strip
+        self.misses += 1
+        strip = render()
+        self._strips[key] = strip
+        while len(self._strips) > STRIP_CACHE_ENTRIES:
+            self._strips.popitem(last=False)
+        return strip
+
+    def _paragraph_strip(self, block, data, width):
+        runs = resolve_runs(block["runs"], data)
+        key = ("p", int(width), runs, block["align"], block["space_after"])
+        return self._cached(key, lambda: layout_paragraph(runs, width, block["align"], self.zoom, block["space_after"]))
+
+    def _container_strips(self, blocks, data, width):
+        """Strisce di una sequenza di blocchi (le tabelle producono una striscia per riga)"""
+        strips = []
+        for block in blocks:
+            if block["type"] == "paragraph":
+                strips.append(self._paragraph_strip(block, data, width))
+            elif block["type"] == "table":
+                strips.extend(self._table_strips(block, data, width))
+        return strips
+
+    def _table_strips(self, block, data, width):
+        """Disegna una tabella riga per riga con i bordi delle celle"""
+        padding = CELL_PADDING_PT * self.zoom
+        strips = []
+        for row in block["rows"]:
+            column = 0
+            cells = []
+            for cell in row:
+                cell_width = width * sum(block["widths"][column:column + cell["span"]])
+                column += cell["span"]
+                contents = self._container_strips(cell["blocks"], data, max(1, cell_width - 2 * padding))
+                cells.append((cell_width, contents))
+            row_height = int(max((sum(s.height for s in contents) for _, contents in cells), default=0) + 2 * padding) or 1
+
+            strip = Image.new("RGB", (max(1, int(width)), row_height), "white")
+            draw = ImageDraw.Draw(strip)
+            x = 0
+            for cell_width, contents in cells:
+                y = padding
+                for content in contents:
+                    strip.paste(content, (int(x + padding), int(y)))
+                    y += content.height
+                draw.rectangle((int(x), 0, int(x + cell_width) - 1, row_height - 1), outline=(160, 160, 160))
+                x += cell_width
+            strips.append(strip)
+        return strips
+
+    def _photo_strips(self, index, images, first_number, thumbnails, width, missing):
+        """Una striscia per foto: miniatura nel riquadro della figura e didascalia "Figura N - ..." """
+        # Stesso riquadro del generatore: metà pagina utile (meno le didascalie) all'80%
+        page_height = index.page_height - index.top_margin - index.bottom_margin
+        box_height = ((page_height - 2 / 2.54 * 72) / 2) * 0.8 * self.zoom
+        caption_font = get_font(False, False, int(round(CAPTION_FONT_SIZE * self.zoom)))
+        strips = []
+        for number, img_info in enumerate(images, first_number):
+            thumb = thumbnails.get(img_info["path"])
+            if thumb is None:
+                missing.append(img_info["path"])
+            caption = caption_text(img_info.get("description", ""), number)
+            rotation = img_info.get("rotation", 0) % 360
+            key = ("photo", int(width), img_info["path"], rotation, caption, thumb.size if thumb else None)
+
+            def render(thumb=thumb, caption=caption, rotation=rotation):
+                caption_runs = ((caption, False, False, False, CAPTION_FONT_SIZE),)
+                caption_strip = layout_paragraph(caption_runs, width, "center", self.zoom, CAPTION_SPACE_AFTER_PT)
+                strip = Image.new("RGB", (int(width), int(box_height) + caption_strip.height), "white")
+                if thumb is not None:
+                    if rotation in ROTATION_TRANSPOSE:
+                        thumb = thumb.transpose(ROTATION_TRANSPOSE[rotation])
+                    scale = min(width / thumb.width, box_height / thumb.height)
+                    picture = thumb.resize((max(1, int(thumb.width * scale)), max(1, int(thumb.height * scale))), Image.BILINEAR)
+                    strip.paste(picture, (int((width - picture.width) / 2), int(box_height - picture.height)))
+                else:
+                    draw = ImageDraw.Draw(strip)
+                    box_width = box_height * 4 / 3
+                    left = (width - box_width) / 2
+                    draw.rectangle((left, 0, left + box_width, box_height), fill=(235, 235, 235), outline=(200, 200, 200))
+                    draw.text((width / 2, box_height / 2), "Caricamento...", fill=(120, 120, 120), font=caption_font, anchor="mm")
+                strip.paste(caption_strip, (0, int(box_height)))
+                return strip
+            strips.append(self._cached(key, render))
+        return strips
+
+    def render(self, index, data, images=(), thumbnails=None):
+        """
+        Genera le immagini delle prime pagine del documento.
+
+        Args:
+            index (TemplateIndex): Modello indicizzato
+            data (dict): Valori dei campi (i campi formattati come lista di coppie testo/tag)
+            images (list): Immagini con path, description e rotation
+            thumbnails (dict): Miniature disponibili (percorso -> immagine PIL già orientata)
+
+        Returns:
+            Tuple: (lista di pagine PIL, percorsi delle miniature mancanti nelle pagine mostrate)
+        """
+        thumbnails = thumbnails or {}
+        data = FieldLookup(data)
+        zoom = self.zoom
+        page_size = (int(index.page_width * zoom), int(index.page_height * zoom))
+        width = (index.page_width - index.left_margin - index.right_margin) * zoom
+        top = index.top_margin * zoom
+        bottom = (index.page_height - index.bottom_margin) * zoom
+        left = index.left_margin * zoom
+        missing = []
+
+        pages = []
+        state = {"y": bottom}
+
+        def new_page():
+            page = Image.new("RGB", page_size, "white")
+            header, footer = (self._container_strips(blocks, data, width)
+                              for blocks in index.header_footer(len(pages) + 1))
+            y = max(0, top - sum(s.height for s in header))
+            for strip in header:
+                page.paste(strip, (int(left), int(y)))
+                y += strip.height
+            y = bottom
+            for strip in footer:
+                page.paste(strip, (int(left), int(y)))
+                y += strip.height
+            pages.append(page)
+            state["y"] = top
+
+        def place(strips):
+            """Incolla le strisce andando a capo pagina; False quando le pagine richieste sono piene"""
+            for strip in strips:
+                if state["y"] + strip.height > bottom and (not pages or state["y"] > top):
+                    if len(pages) >= self.max_pages:
+                        return False
+                    new_page()
+                pages[-1].paste(strip, (int(left), int(state["y"])))
+                state["y"] += strip.height
+            return True
+
+        new_page()
+        blocks = list(index.blocks)
+        if images and not index.has_photo_placeholder:
+            heading = {"type": "paragraph", "runs": (("Documentazione Fotografica", True, False, False, 14),),
+                       "align": "left", "space_after": 6}
+            blocks += [heading, {"type": "photos"}]
+
+        for block in blocks:
+            if block["type"] == "photos":
+                if images:
+                    # Le foto si dispongono una alla volta per fermarsi alle pagine mostrate
+                    for position in range(len(images)):
+                        strips = self._photo_strips(index, images[position:position + 1], position + 1,
+                                                    thumbnails, width, missing)
+                        if not place(strips):
+                            return pages, missing
+                continue
+            if not place(self._container_strips([block], data, width)):
+                break
+        return pages, missing
@@ -0,0 +1,220 @@
+import os
+import json
+import queue
+import hashlib
+import threading
+
+import template_cache
+
+# Estensione dei file di progetto e cartella affiancata con le miniature
+PROJECT_EXTENSION = ".vip"
+PROJECT_VERSION = 1
+THUMBNAIL_DIR_SUFFIX = "_miniature"
+THUMBNAIL_QUALITY = 85
+
+# Campi delle immagini che non vanno salvati (stato calcolato durante la sessione)
+TRANSIENT_IMAGE_KEYS = ("error", "processed_image")
+
+def session_path():
+    """Percorso del progetto di sessione usato per l'autosalvataggio quando non è aperto un progetto"""
+    return os.path.join(template_cache.app_data_dir("sessione"), "ultima_sessione" + PROJECT_EXTENSION)
+
+def thumbnail_dir(project_path):
+    """Cartella delle miniature affiancata al file di progetto"""
+    return os.path.splitext(project_path)[0] + THUMBNAIL_DIR_SUFFIX
+
+def thumbnail_name(image_path, st):
+    """
+    Nome della miniatura di una foto.
+
+    Il nome dipende da percorso, dimensione e data di modifica dell'originale, così una foto
+    sostituita su disco non riusa la miniatura vecchia.
+    """
+    key = f"{os.path.normcase(image_path)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".jpg"
+
+def write_atomic(path, data):
+    """Scrive un file in modo atomico (file temporaneo + rename)"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def serialize_project(fields, images, model_path=None):
+    """
+    Converte lo stato del form in byte JSON.
+
+    Args:
+        fields (dict): Valori dei campi e delle caselle di controllo
+        images (list): Immagini con percorso, didascalia, numero figura e rotazione
+        model_path (str): Percorso del modello Word
+
+    Returns:
+        bytes: Contenuto del file di progetto
+    """
+    project = {
+        "version": PROJECT_VERSION,
+        "model_path": model_path,
+        "fields": fields,
+        "images": [{key: value for key, value in img.items() if key not in TRANSIENT_IMAGE_KEYS}
+                   for img in images],
+    }
+    return json.dumps(project, ensure_ascii=False, indent=2).encode("utf-8")
+
+def load_project(project_path):
+    """
+    Legge un file di progetto.
+
+    Returns:
+        dict: Progetto con chiavi "fields", "images" e "model_path"
+
+    Raises:
+        ValueError: Se il file non è un progetto valido o è di una versione successiva
+    """
+    with open(project_path, 'r', encoding='utf-8') as f:
+        project = json.load(f)
+    if not isinstance(project, dict) or "images" not in project:
+        raise ValueError("Il file non è un progetto del verbale di ispezione")
+    if project.get("version", 0) > PROJECT_VERSION:
+        raise ValueError(f"Versione del progetto non supportata: {project.get('version')}")
+    project.setdefault("fields", {})
+    project.setdefault("model_path", None)
+    return project
+
+def load_thumbnail(project_path, image_path):
+    """
+    Carica la miniatura salvata di una foto se corrisponde ancora all'originale.
+
+    Returns:
+        PIL.Image oppure None se la miniatura manca o non è più valida
+    """
+    from PIL import Image
+
+    try:
+        st = os.stat(image_path)
+    except OSError:
+        return None
+    path = os.path.join(thumbnail_dir(project_path), thumbnail_name(image_path, st))
+    if not os.path.exists(path):
+        return None
+    try:
+        with Image.open(path) as img:
+            img.load()
+            return img.convert("RGB") if img.mode != "RGB" else img.copy()
+    except Exception as e:
+        print(f"Miniatura salvata non leggibile ({path}): {str(e)}")
+        return None
+
+class ProjectAutosaver:
+    """
+    Autosalvataggio incrementale di un progetto.
+
+    Il file di progetto viene riscritto (in modo atomico) solo se il contenuto è cambiato
+    dall'ultimo salvataggio; le miniature vengono scritte una sola volta ciascuna da un
+    thread secondario, così l'interfaccia non si blocca dopo l'importazione di molte foto.
+    """
+
+    def __init__(self, project_path):
+        self.project_path = project_path
+        self._last_data = None
+        self._saved_thumbnails = set()  # Percorsi delle foto con miniatura già scritta
+        self._thumbnail_queue = queue.Queue()
+        self._writer = None
+        self._lock = threading.Lock()
+
+    def mark_saved(self, data):
+        """Registra il contenuto appena letto o scritto, per non riscriverlo senza modifiche"""
+        self._last_data = data
+
+    def save(self, data, thumbnails=()):
+        """
+        Salva il progetto se il contenuto è cambiato e accoda le miniature nuove.
+
+        Args:
+            data (bytes): Contenuto prodotto da serialize_project
+            thumbnails: Coppie (percorso foto, miniatura PIL) disponibili in memoria
+
+        Returns:
+            bool: True se il file di progetto è stato riscritto
+        """
+        with self._lock:
+            pending = [(path, thumb) for path, thumb in thumbnails if path not in self._saved_thumbnails]
+            self._saved_thumbnails.update(path for path, _ in pending)
+            for item in pending:
+                self._thumbnail_queue.put(item)
+            if pending and self._writer is None:
+                self._writer = threading.Thread(target=self._write_thumbnails, name="project-thumbnails", daemon=True)
+                self._writer.start()
+
+        if data == self._last_data:
+            return False
+        write_atomic(self.project_path, data)
+        self._last_data = data
+        return True
+
+    def flush(self, timeout=5):
+        """
+        Attende la scrittura delle miniature in coda (es. alla chiusura).
+
+        Returns:
+            bool: False se allo scadere del timeout il thread di scrittura è ancora attivo
+        """
+        writer = self._writer
+        if writer is None:
+            return True
+        self._thumbnail_queue.put(None)
+        writer.join(timeout)
+        # Il thread si toglie da solo quando termina; se è ancora attivo resta registrato
+        return not writer.is_alive()
+
+    def forget(self, image_path):
+        """Permette di riscrivere la miniatura di una foto (es. rigenerata dopo una modifica)"""
+        with self._lock:
+            self._saved_thumbnails.discard(image_path)
+
+    def reset(self):
+        """Svuota la cartella delle miniature (nuova sessione)"""
+        finished = self.flush()
+        with self._lock:
+            self._saved_thumbnails.clear()
+        if not finished:
+            # Non si cancellano file che il thread di scrittura sta ancora producendo
+            print("Scrittura delle miniature ancora in corso: cartella delle miniature non svuotata")
+            return
+        directory = thumbnail_dir(self.project_path)
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    def _write_thumbnails(self):
+        """Thread di scrittura delle miniature nella cartella del progetto"""
+        directory = thumbnail_dir(self.project_path)
+        while True:
+            item = self._thumbnail_queue.get()
+            if item is None:
+                # Termina solo se nel frattempo non sono state accodate altre miniature
+                with self._lock:
+                    if self._thumbnail_queue.empty():
+                        self._writer = None
+                        return
+                continue
+            image_path, thumb = item
+            try:
+                st = os.stat(image_path)
+                path = os.path.join(directory, thumbnail_name(image_path, st))
+                if os.path.exists(path):
+                    continue
+                os.makedirs(directory, exist_ok=True)
+                temp_path = path + ".tmp"
+                thumb.save(temp_path, format="JPEG", quality=THUMBNAIL_QUALITY)
+                os.replace(temp_path, path)
+            except Exception as e:
+                print(f"Errore durante il salvataggio della miniatura di {image_path}: {str(e)}")
@@ -0,0 +1,41 @@
+import re
+
+# Marcatori di formattazione usati nel testo dei campi con grassetto, corsivo e sottolineato
+FORMAT_TAGS = {"b": "bold", "i": "italic", "u": "underline"}
+_FORMAT_TOKEN = re.compile(r"<(/?)([biu])>")
+
+def parse_formatted_text(text):
+    """
+    Divide un testo con marcatori <b>, <i>, <u> in segmenti con i relativi tag del widget Text.
+
+    Returns:
+        list: Coppie (testo, tupla di tag)
+    """
+    segments = []
+    active = []
+    position = 0
+    
+    def add_segment(segment):
+        # collect_form_data marca ogni carattere: i segmenti adiacenti con gli stessi tag si uniscono
+        if segments and segments[-1][1] == tuple(active):
+            segments[-1] = (segments[-1][0] + segment, segments[-1][1])
+        else:
+            segments.append((segment, tuple(active)))
+    
+    for match in _FORMAT_TOKEN.finditer(text):
+        if match.start() > position:
+            add_segment(text[position:match.start()])
+        tag = FORMAT_TAGS[match.group(2)]
+        if match.group(1):
+            if tag in active:
+                active.remove(tag)
+        elif tag not in active:
+            active.append(tag)
+        position = match.end()
+    if position < len(text):
+        add_segment(text[position:])
+    return segments
+
+def has_formatting(text):
+    """Verifica se un testo contiene marcatori di formattazione"""
+    return bool(_FORMAT_TOKEN.search(text))
@@ -0,0 +1,331 @@
+"""
+Processo di servizio per la shell desktop: JSON-RPC 2.0 su stdin/stdout, un messaggio per riga.
+
+Il processo resta attivo tra una richiesta e l'altra, così i moduli importati, l'indice dei
+modelli, il mirror locale dei modelli di rete e le miniature restano in memoria. Tutti i
+messaggi di debug dei generatori vengono dirottati su stderr: stdout contiene solo risposte.
+
+Metodi:
+    ping                                          -> {"pong": true, "uptime": secondi}
+    template_inspect(template_path)               -> segnaposto, pagina e intestazioni del modello
+    preview_thumbnail(path, size, rotation)       -> miniatura JPEG orientata (base64)
+    generate(template_path, output_path, data, images, max_output_size, output_format)
+                                                  -> percorso, durata e resoconto
+
+Tra una generazione e l'altra restano in memoria anche il modello Word già letto (ogni
+generazione ne modifica una copia) e le figure codificate, indicizzate dal file e dalla
+rotazione di ogni foto: rigenerare dopo aver cambiato solo i testi non ricodifica le foto.
+Entrambi si preparano solo se il documento non si può aggiornare in modo incrementale.
+    shutdown                                      -> termina dopo le richieste in corso
+"""
+import io
+import os
+import re
+import sys
+import copy
+import json
+import inspect
+import time
+import base64
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import template_cache
+
+# Le risposte usano lo stdout originale; print dei moduli importati va su stderr
+_protocol_out = sys.stdout
+sys.stdout = sys.stderr
+
+SIDECAR_WORKERS = 4
+THUMBNAIL_SIZE = 256
+THUMBNAIL_QUALITY = 85
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+RENDITION_CACHE_BYTES = 256 * 1024 * 1024
+
+# Codici di errore JSON-RPC
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+_PLACEHOLDER_PATTERN = re.compile(r"\{\{([^}]+)\}\}")
+
+class RpcError(Exception):
+    """Errore da restituire al chiamante con un codice JSON-RPC"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class ThumbnailCache:
+    """Miniature JPEG già codificate, LRU limitata in byte (measure misura un elemento)"""
+
+    def __init__(self, capacity_bytes=THUMBNAIL_CACHE_BYTES, measure=len):
+        self.capacity_bytes = capacity_bytes
+        self.measure = measure
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._items.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._items:
+                self._bytes -= self.measure(self._items.pop(key))
+            self._items[key] = data
+            self._bytes += self.measure(data)
+            while self._bytes > self.capacity_bytes and len(self._items) > 1:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= self.measure(evicted)
+
+class Sidecar:
+    """Stato caldo del processo e implementazione dei metodi"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.thumbnails = ThumbnailCache()
+        self.renditions = ThumbnailCache(RENDITION_CACHE_BYTES, measure=lambda rendition: len(rendition["data"]))
+        self._templates = {}             # percorso locale -> (firma del file, Document non modificato)
+        self._generate_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=SIDECAR_WORKERS)
+        self.methods = {
+            "ping": self.ping,
+            "template_inspect": self.template_inspect,
+            "preview_thumbnail": self.preview_thumbnail,
+            "generate": self.generate,
+            "shutdown": self.shutdown,
+        }
+
+    def warm_up(self):
+        """Importa in background i moduli pesanti, così la prima richiesta non li attende"""
+        def import_modules():
+            try:
+                import docx_generator
+                import preview_renderer
+                print("Sidecar: moduli caricati")
+            except Exception as e:
+                print(f"Sidecar: errore durante il caricamento dei moduli: {str(e)}")
+        threading.Thread(target=import_modules, name="sidecar-warm-up", daemon=True).start()
+
+    def ping(self):
+        return {"pong": True, "uptime": round(time.time() - self.started, 1)}
+
+    def _resolve_template(self, template_path):
+        local_path = template_cache.resolve_template(template_path)
+        if not local_path:
+            raise RpcError(INVALID_PARAMS, f"Modello non disponibile: {template_path}")
+        return local_path
+
+    def template_inspect(self, template_path):
+        """Segnaposto e struttura del modello (l'indice resta in memoria finché il file non cambia)"""
+        import preview_renderer
+
+        index = preview_renderer.load_template_index(self._resolve_template(template_path))
+        placeholders = []
+
+        def collect(blocks):
+            for block in blocks:
+                if block["type"] == "paragraph":
+                    for name in _PLACEHOLDER_PATTERN.findall("".join(run[0] for run in block["runs"])):
+                        if name not in placeholders:
+                            placeholders.append(name)
+                elif block["type"] == "table":
+                    for row in block["rows"]:
+                        for cell in row:
+                            collect(cell["blocks"])
+        for blocks in (index.header, index.blocks, index.footer):
+            collect(blocks)
+
+        return {
+            "placeholders": placeholders,
+            "has_photo_placeholder": index.has_photo_placeholder,
+            "page": {
+                "width_pt": index.page_width, "height_pt": index.page_height,
+                "margins_pt": [index.top_margin, index.right_margin, index.bottom_margin, index.left_margin],
+            },
+        }
+
+    def preview_thumbnail(self, path, size=THUMBNAIL_SIZE, rotation=0):
+        """Miniatura orientata (EXIF e rotazione manuale) di una foto, come JPEG in base64"""
+        from docx_generator import load_oriented_image
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            raise RpcError(INVALID_PARAMS, f"File non trovato: {path}")
+        size = int(size)
+        rotation = int(rotation) % 360
+        key = (os.path.normcase(os.path.abspath(path)), st.st_size, st.st_mtime_ns, size, rotation)
+        data = self.thumbnails.get(key)
+        if data is None:
+            img = load_oriented_image(path, rotation, draft_size=(size, size))
+            img.thumbnail((size, size))
+            if img.mode != "RGB":
+                img = img.convert("RGB")
+            buffer = io.BytesIO()
+            img.save(buffer, format="JPEG", quality=THUMBNAIL_QUALITY)
+            data = buffer.getvalue()
+            self.thumbnails.put(key, data)
+        return {"mime": "image/jpeg", "data": base64.b64encode(data).decode("ascii")}
+
+    def _template_document(self, local_template):
+        """Copia del modello Word, letto dal disco solo quando il file cambia"""
+        from docx import Document
+        from docx_generator import file_signature
+
+        signature = file_signature(local_template)
+        cached = self._templates.get(local_template)
+        if cached is None or cached[0] != signature:
+            cached = (signature, Document(local_template))
+            self._templates[local_template] = cached
+        return copy.deepcopy(cached[1])
+
+    def _cached_renditions(self, images, box, image_budget):
+        """
+        Figure a piena qualità dalla cache, codificando solo quelle nuove o cambiate.
+
+        Returns:
+            list: Figure nell'ordine di images, o None se insieme superano il budget
+                (la riduzione comune la calcola il generatore)
+        """
+        from docx_generator import image_cache_key, prepare_renditions
+
+        keys = [(json.dumps(image_cache_key(img_info)), box) for img_info in images]
+        renditions = [self.renditions.get(key) for key in keys]
+        missing = [position for position, rendition in enumerate(renditions) if rendition is None]
+        if missing:
+            fresh = prepare_renditions([images[position] for position in missing], *box)
+            for position, rendition in zip(missing, fresh):
+                renditions[position] = rendition
+                if not isinstance(rendition, Exception):
+                    self.renditions.put(keys[position], rendition)
+        if image_budget is not None:
+            total = sum(len(rendition["data"]) for rendition in renditions if not isinstance(rendition, Exception))
+            if total > image_budget:
+                return None
+        return renditions
+
+    def generate(self, template_path, output_path, data=None, images=None, max_output_size=None, output_format=None):
+        """
+        Genera il verbale (.docx, o .pdf senza Word) con gli stessi parametri dell'applicazione.
+
+        Le generazioni sono eseguite una alla volta; le altre richieste restano servite.
+        """
+        local_template = self._resolve_template(template_path)
+        data = data or {}
+        output_format = (output_format or os.path.splitext(output_path)[1].lstrip(".") or "docx").lower()
+        if output_format not in ("docx", "pdf"):
+            raise RpcError(INVALID_PARAMS, f"Formato non supportato: {output_format}")
+        report = {}
+        start_time = time.time()
+        with self._generate_lock:
+            if output_format == "pdf":
+                import pdf_exporter
+                import preview_renderer
+
+                renditions = None
+                if images:
+                    box = pdf_exporter.compute_image_box(preview_renderer.load_template_index(local_template))
+                    image_budget = None
+                    if max_output_size:
+                        image_budget = (max_output_size - pdf_exporter.PDF_BASE_OVERHEAD
+                                        - pdf_exporter.BUDGET_IMAGE_OVERHEAD * len(images))
+                    renditions = self._cached_renditions(images, box, image_budget)
+                pdf_exporter.export_pdf(local_template, output_path, data, images,
+                                        max_output_size=max_output_size, report=report, renditions=renditions)
+            else:
+                from docx_generator import generate_document, compute_image_box, document_image_budget
+
+                # Modello e figure servono solo se l'aggiornamento incrementale non è possibile
+                def cached_renditions(document):
+                    if not images:
+                        return None
+                    return self._cached_renditions(images, compute_image_box(document),
+                                                   document_image_budget(local_template, images, max_output_size))
+
+                generate_document(local_template, output_path, data, images, max_output_size=max_output_size,
+                                  report=report, renditions=cached_renditions,
+                                  template_document=lambda: self._template_document(local_template))
+        return {"output_path": output_path, "seconds": round(time.time() - start_time, 2),
+                "report": {key: value for key, value in report.items() if isinstance(value, (int, float, str, bool, list, type(None)))}}
+
+    def shutdown(self):
+        """Gestito dal ciclo di lettura: risponde e termina dopo le richieste in corso"""
+        return {"stopping": True}
+
+    def _send(self, message):
+        line = json.dumps(message, ensure_ascii=False) + "\n"
+        with self._write_lock:
+            _protocol_out.write(line)
+            _protocol_out.flush()
+
+    def _handle(self, request):
+        """Esegue una richiesta e invia la risposta (nessuna risposta per le notifiche senza id)"""
+        request_id = request.get("id")
+        try:
+            method = self.methods.get(request.get("method"))
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"Metodo sconosciuto: {request.get('method')}")
+            params = request.get("params") or {}
+            # Solo gli errori nel collegare i parametri sono del chiamante; i TypeError interni no
+            try:
+                bound = (inspect.signature(method).bind(**params) if isinstance(params, dict)
+                         else inspect.signature(method).bind(*params))
+            except TypeError as e:
+                raise RpcError(INVALID_PARAMS, str(e))
+            result = method(*bound.args, **bound.kwargs)
+            response = {"jsonrpc": "2.0", "id": request_id, "result": result}
+        except RpcError as e:
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": e.code, "message": str(e)}}
+        except Exception as e:
+            print(f"Sidecar: errore in {request.get('method')}: {str(e)}")
+            response = {"jsonrpc": "2.0", "id": request_id, "error": {"code": SERVER_ERROR, "message": str(e)}}
+        if "id" in request:
+            self._send(response)
+
+    def serve(self, stream=None):
+        """Legge le richieste riga per riga finché stdin non si chiude o arriva shutdown"""
+        stream = stream or sys.stdin
+        self.warm_up()
+        for line in stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                self._send({"jsonrpc": "2.0", "id": None, "error": {"code": PARSE_ERROR, "message": str(e)}})
+                continue
+            if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+                self._send({"jsonrpc": "2.0", "id": None, "error": {"code": INVALID_REQUEST, "message": "Richiesta non valida"}})
+                continue
+            if request["method"] == "shutdown":
+                self._handle(request)
+                break
+            self._executor.submit(self._handle, request)
+        self._executor.shutdown(wait=True)
+
+def main():
+    # Le richieste e le risposte sono in UTF-8 indipendentemente dalla codifica della console
+    if hasattr(sys.stdin, "reconfigure"):
+        sys.stdin.reconfigure(encoding="utf-8")
+    if hasattr(_protocol_out, "reconfigure"):
+        _protocol_out.reconfigure(encoding="utf-8")
+    Sidecar().serve()
+
+if __name__ == "__main__":
+    main()
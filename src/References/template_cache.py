@@ -0,0 +1,186 @@
+import os
+import sys
+import json
+import shutil
+import queue
+import hashlib
+import threading
+
+# Tempo massimo di attesa per una stat sulla share di rete prima di usare la copia locale
+STAT_TIMEOUT = 1.5
+
+# Serializza le copie verso il mirror locale (foreground e background)
+_mirror_lock = threading.Lock()
+
+# Un solo thread esegue le stat remote; finché una stat è bloccata non se ne avviano altre
+_stat_lock = threading.Lock()
+_stat_requests = queue.Queue()
+_stat_worker = None
+_stat_pending = None
+
+def app_data_dir(*parts):
+    """
+    Restituisce (e crea se necessario) una cartella dati dell'applicazione nel profilo utente.
+
+    Args:
+        *parts: Sottocartelle da aggiungere al percorso base
+    """
+    if sys.platform == "win32" and os.environ.get("LOCALAPPDATA"):
+        base_dir = os.path.join(os.environ["LOCALAPPDATA"], "VerbaleIspezione")
+    else:
+        base_dir = os.path.join(os.path.expanduser("~"), ".verbale_ispezione")
+    path = os.path.join(base_dir, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def is_network_path(path):
+    """Verifica se il percorso punta a una share di rete (percorso UNC)"""
+    return bool(path) and (path.startswith("\\\\") or path.startswith("//"))
+
+def mirror_path(remote_path):
+    """
+    Calcola il percorso della copia locale di un modello remoto.
+
+    Il nome contiene un hash del percorso completo, così modelli omonimi in cartelle
+    diverse non si sovrascrivono.
+    """
+    digest = hashlib.sha1(os.path.normcase(remote_path).encode("utf-8")).hexdigest()[:12]
+    file_name = remote_path.replace("\\", "/").rsplit("/", 1)[-1]
+    return os.path.join(app_data_dir("modelli"), f"{digest}_{file_name}")
+
+def _stat_loop():
+    """Thread delle stat remote: esegue le richieste una alla volta"""
+    while True:
+        path, result, done = _stat_requests.get()
+        try:
+            result.append(os.stat(path))
+        except OSError:
+            pass
+        finally:
+            done.set()
+
+def stat_with_timeout(path, timeout=STAT_TIMEOUT):
+    """
+    Esegue os.stat nel thread delle stat per non bloccarsi su una share lenta o offline.
+
+    Se la stat precedente non è ancora terminata (share bloccata) non ne viene accodata
+    un'altra: il file si considera non raggiungibile senza attendere.
+
+    Returns:
+        os.stat_result oppure None se il file non è raggiungibile entro il timeout
+    """
+    global _stat_worker, _stat_pending
+    with _stat_lock:
+        if _stat_pending is not None and not _stat_pending.is_set():
+            print(f"Stat precedente sulla share ancora in corso, salto: {path}")
+            return None
+        if _stat_worker is None:
+            _stat_worker = threading.Thread(target=_stat_loop, name="template-stat", daemon=True)
+            _stat_worker.start()
+        result = []
+        done = threading.Event()
+        _stat_pending = done
+        _stat_requests.put((path, result, done))
+    done.wait(timeout)
+    return result[0] if result else None
+
+def _read_meta(local_path):
+    """Legge i metadati (dimensione e data di modifica) del file sorgente del mirror"""
+    try:
+        with open(local_path + ".json", 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _is_current(local_path, st):
+    """Verifica se la copia locale corrisponde al file remoto confrontando dimensione e mtime"""
+    meta = _read_meta(local_path)
+    return (os.path.exists(local_path)
+            and meta.get("size") == st.st_size
+            and meta.get("mtime_ns") == st.st_mtime_ns)
+
+def _copy_to_mirror(remote_path, local_path, st):
+    """Copia il modello nel mirror locale in modo atomico (file temporaneo + rename)"""
+    with _mirror_lock:
+        # Un'altra copia potrebbe essere stata completata mentre si attendeva il lock
+        if _is_current(local_path, st):
+            return
+        temp_path = local_path + ".tmp"
+        shutil.copyfile(remote_path, temp_path)
+        os.replace(temp_path, local_path)
+        # Anche i metadati via file temporaneo: un file troncato farebbe ricopiare il modello
+        # (project_file.write_atomic non è importabile qui: project_file importa questo modulo)
+        meta_path = local_path + ".json"
+        with open(meta_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({"source": remote_path, "size": st.st_size, "mtime_ns": st.st_mtime_ns}, f)
+        os.replace(meta_path + ".tmp", meta_path)
+        print(f"Modello copiato nel mirror locale: {local_path}")
+
+def resolve_template(template_path, timeout=STAT_TIMEOUT):
+    """
+    Restituisce il percorso locale da usare per leggere il modello Word.
+
+    I modelli su share di rete vengono letti dal mirror locale nel profilo utente,
+    validato con una sola stat su dimensione e data di modifica. Se la share è lenta
+    o non raggiungibile si usa l'ultima copia disponibile.
+
+    Args:
+        template_path (str): Percorso del modello selezionato
+        timeout (float): Secondi di attesa massima per la stat remota
+
+    Returns:
+        str: Percorso locale del modello, oppure None se non è disponibile
+    """
+    if not template_path:
+        return None
+
+    if not is_network_path(template_path):
+        return template_path if os.path.exists(template_path) else None
+
+    local_path = mirror_path(template_path)
+    st = stat_with_timeout(template_path, timeout)
+
+    if st is None:
+        if os.path.exists(local_path):
+            print(f"Share non raggiungibile, uso la copia locale del modello: {local_path}")
+            return local_path
+        return None
+
+    if _is_current(local_path, st):
+        return local_path
+
+    # Modello modificato o non ancora copiato: aggiorna subito il mirror
+    try:
+        _copy_to_mirror(template_path, local_path, st)
+    except OSError as e:
+        print(f"Errore durante la copia del modello nel mirror locale: {str(e)}")
+        if not os.path.exists(local_path):
+            return None
+    return local_path
+
+def refresh_in_background(template_path):
+    """Aggiorna il mirror locale del modello in un thread secondario"""
+    if not is_network_path(template_path):
+        return
+
+    def refresh():
+        try:
+            # In background si può attendere più a lungo una share lenta
+            resolve_template(template_path, timeout=30)
+        except Exception as e:
+            print(f"Errore durante l'aggiornamento del mirror del modello: {str(e)}")
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def browse_directory(template_path, timeout=STAT_TIMEOUT):
+    """
+    Restituisce la cartella iniziale per la selezione del modello.
+
+    Se la cartella di rete non risponde entro il timeout si apre la cartella del mirror locale.
+    """
+    directory = os.path.dirname(template_path) if template_path else ""
+    if not is_network_path(directory):
+        return directory
+    if stat_with_timeout(directory, timeout) is not None:
+        return directory
+    return app_data_dir("modelli")